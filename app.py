@@ -1,19 +1,105 @@
-from flask import Flask, render_template, request, jsonify, send_from_directory
+from flask import Flask, Response, render_template, request, jsonify, send_from_directory, redirect, url_for, g
 from dotenv import load_dotenv
 import os
 import yt_dlp
 import re
 import uuid
-from flask import send_file
-from threading import Thread
-from time import sleep
+import json
+import copy
+import time
+import threading
+import logging
+import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from flask import send_file, abort
+from werkzeug.utils import safe_join
+from werkzeug.wsgi import FileWrapper
+from werkzeug.middleware.proxy_fix import ProxyFix
+from yt_dlp.utils import DownloadCancelled
+from download_queue import DownloadQueue, QueueFullError
+from task_store import create_task_store, FINAL_STATUSES
+from progress_reporter import ProgressReporter
+from info_cache import InfoCache, canonical_video_id
+from content_store import ContentStore
+from storage_manager import StorageManager
+from info_schema import compact_info, parse_fields
+from compression import compress_response
+from playlist import extract_entries, summarize, iter_zip
+from ydl_pool import get_pool
+from segmented_download import SegmentedYoutubeDL, set_connection_limit
+from bandwidth import BandwidthScheduler
+from metrics import MetricsRegistry
+from log_setup import setup_logging, bind_context, reset_context, YdlLogger, VERBOSE
+from stream_proxy import is_progressive, find_format, content_disposition, open_upstream, iter_body, PASSTHROUGH_HEADERS
 
 # Загрузка переменных окружения
 load_dotenv()
+# Лог пишется отдельным потоком: LOG_LEVEL, LOG_FORMAT, LOG_VERBOSE_SAMPLE_RATE
+setup_logging()
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
+# За обратным прокси адрес клиента берётся из X-Forwarded-For (нужен для
+# лимита скорости на клиента); PROXY_COUNT — число доверенных прокси
+if int(os.getenv('PROXY_COUNT', 0)):
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=int(os.getenv('PROXY_COUNT')))
+# Отдача файлов через X-Sendfile фронтового сервера (Apache, lighttpd)
+app.config['USE_X_SENDFILE'] = os.getenv('USE_X_SENDFILE') == '1'
 
-progress_dict = {}
+DATA_DIR = os.getenv('DATA_DIR', 'data')
+MAX_PRIORITY = 10
+# Как часто (в секундах) хук прогресса пишет в хранилище заданий
+PROGRESS_UPDATE_INTERVAL = float(os.getenv('PROGRESS_UPDATE_INTERVAL', 0.5))
+# Интервал служебных сообщений в потоке прогресса (держит соединение через прокси)
+SSE_HEARTBEAT_INTERVAL = float(os.getenv('SSE_HEARTBEAT_INTERVAL', 5))
+# Поток прогресса закрывается через столько секунд, после чего браузер
+# переходит на опрос /api/progress
+SSE_MAX_LIFETIME = float(os.getenv('SSE_MAX_LIFETIME', 300))
+# Долгие ответы (поток прогресса, потоковая отдача, ZIP плейлиста, пакетный
+# /api/info/batch) занимают поток gthread (соединение gevent) на всё время
+# передачи. Им отдаётся не больше половины потоков процесса, остальные
+# остаются для коротких запросов
+if os.getenv('WEB_WORKER_CLASS', 'gthread') == 'gevent':
+    _web_slots = int(os.getenv('WEB_WORKER_CONNECTIONS', 1000))
+else:
+    _web_slots = int(os.getenv('WEB_THREADS', 64))
+MAX_LONG_REQUESTS = int(os.getenv('MAX_LONG_REQUESTS', max(1, _web_slots // 2)))
+long_requests = {'open': 0}
+long_requests_lock = threading.Lock()
+# Сохранять ли в хранилище файлы, отданные клиенту потоком
+STREAM_TEE = os.getenv('STREAM_TEE', '1') == '1'
+# Внутренний префикс nginx для X-Accel-Redirect (например, /protected-downloads/);
+# если задан, файлы отдаёт nginx, а воркер освобождается сразу
+X_ACCEL_REDIRECT_PREFIX = os.getenv('X_ACCEL_REDIRECT_PREFIX')
+# Сколько секунд браузер и прокси могут кэшировать скачанный файл
+FILES_MAX_AGE = int(os.getenv('FILES_MAX_AGE', 86400))
+# Сколько видео одного плейлиста скачиваются одновременно и сколько видео
+# берётся из плейлиста или канала
+PLAYLIST_CONCURRENCY = int(os.getenv('PLAYLIST_CONCURRENCY', 2))
+MAX_PLAYLIST_ITEMS = int(os.getenv('MAX_PLAYLIST_ITEMS', 200))
+PLAYLIST_POLL_INTERVAL = 1.0
+# Крупные файлы качаются в несколько соединений: столько на одно задание
+# и не больше MAX_DOWNLOAD_CONNECTIONS на процесс
+DOWNLOAD_CONNECTIONS = int(os.getenv('DOWNLOAD_CONNECTIONS', 4))
+set_connection_limit(int(os.getenv('MAX_DOWNLOAD_CONNECTIONS', 16)))
+# Скачивание отменяется, если прогресс задания (или его плейлиста) никто
+# не запрашивал столько секунд; 0 — не отменять
+DOWNLOAD_IDLE_TIMEOUT = int(os.getenv('DOWNLOAD_IDLE_TIMEOUT', 300))
+
+# Ограничение скорости скачивания (байт в секунду, 0 — без ограничения):
+# общая полоса процесса делится поровну между заданиями, плюс лимиты на
+# задание и на клиента. Файл bandwidth.json в DATA_DIR меняет их на лету
+bandwidth = BandwidthScheduler(
+    rate=int(os.getenv('BANDWIDTH_LIMIT', 0)),
+    job_rate=int(os.getenv('BANDWIDTH_JOB_LIMIT', 0)),
+    client_rate=int(os.getenv('BANDWIDTH_CLIENT_LIMIT', 0)),
+)
+
+# Состояние заданий общее для всех процессов gunicorn
+task_store = create_task_store(
+    os.getenv('TASK_STORE_URL', os.path.join(DATA_DIR, 'tasks.db')),
+    ttl=int(os.getenv('TASK_TTL', 3600)),
+)
 
 @app.route('/')
 def index():
@@ -27,6 +113,284 @@ def is_supported_url(url):
     youtube_pattern = r'^(https?://)?(www\.)?(youtube\.com/watch\?v=|youtu\.be/)[a-zA-Z0-9_-]+'
     return bool(re.match(youtube_pattern, url))
 
+HTTP_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.9',
+    'Accept-Encoding': 'gzip, deflate, br',
+    'Connection': 'keep-alive'
+}
+
+INFO_YDL_OPTS = {
+    'quiet': False,
+    'no_warnings': False,
+    'extract_flat': False,
+    'format': 'best',
+    'nocheckcertificate': True,
+    'ignoreerrors': True,
+    'socket_timeout': 30,
+    'http_headers': HTTP_HEADERS,
+    # Сообщения yt-dlp идут в лог, а не синхронно в stdout
+    'logger': YdlLogger(),
+}
+
+# Кэш информации о видео: повторный поиск и последующее скачивание того же
+# видео не выполняют извлечение заново
+info_cache = InfoCache(
+    max_entries=int(os.getenv('INFO_CACHE_SIZE', 256)),
+    ttl=int(os.getenv('INFO_CACHE_TTL', 3600)),
+    disk_dir=os.getenv('INFO_CACHE_DIR', os.path.join(DATA_DIR, 'info_cache')) or None,
+)
+
+# Общий пул для /api/info/batch: ограничивает число одновременных
+# извлечений в процессе независимо от числа пакетных запросов
+MAX_BATCH_URLS = int(os.getenv('MAX_BATCH_URLS', 500))
+info_executor = ThreadPoolExecutor(max_workers=int(os.getenv('INFO_BATCH_WORKERS', 8)),
+                                   thread_name_prefix='info')
+
+# Скачанные файлы адресуются по видео и формату, так что повторные
+# запросы получают готовый файл без нового скачивания
+DOWNLOADS_DIR = os.path.join('static', 'downloads')
+content_store = ContentStore(DOWNLOADS_DIR, '/files')
+
+def content_key(url, format_id):
+    return ContentStore.make_key(canonical_video_id(url), format_id or 'best')
+
+# Готовые экземпляры YoutubeDL для извлечения информации: повторные запросы
+# используют уже созданные экстракторы и открытые соединения
+YDL_POOL_SIZE = int(os.getenv('YDL_POOL_SIZE', 8))
+info_ydl_pool = get_pool('info', INFO_YDL_OPTS, YDL_POOL_SIZE)
+playlist_ydl_pool = get_pool(
+    'playlist', dict(INFO_YDL_OPTS, extract_flat='in_playlist', playlistend=MAX_PLAYLIST_ITEMS), YDL_POOL_SIZE)
+
+# Метрики для Prometheus (/metrics): процессы gunicorn складывают свои
+# значения через снимки в DATA_DIR/metrics
+metrics = MetricsRegistry(os.path.join(DATA_DIR, 'metrics'))
+extract_duration = metrics.histogram(
+    'downloader_extract_duration_seconds', 'Длительность извлечения информации о видео', ['extractor'])
+extract_failures = metrics.counter(
+    'downloader_extract_failures_total', 'Неудачные извлечения информации по классу ошибки', ['error'])
+download_duration = metrics.histogram(
+    'downloader_download_duration_seconds', 'Длительность фазы скачивания (без постобработки)')
+postprocess_duration = metrics.histogram(
+    'downloader_postprocess_duration_seconds', 'Длительность постобработки (склейка, конвертация ffmpeg)',
+    ['postprocessor'])
+download_throughput = metrics.histogram(
+    'downloader_download_throughput_bytes_per_second', 'Средняя скорость скачивания задания',
+    buckets=(64 * 1024, 256 * 1024, 1 << 20, 4 << 20, 16 << 20, 64 << 20, 256 << 20))
+downloaded_bytes = metrics.counter('downloader_downloaded_bytes_total', 'Размер скачанных файлов')
+downloads_total = metrics.counter('downloader_downloads_total', 'Завершённые задания по итогу', ['status'])
+download_failures = metrics.counter(
+    'downloader_download_failures_total', 'Неудачные скачивания по классу ошибки', ['error'])
+http_requests = metrics.counter('downloader_http_requests_total', 'HTTP-запросы', ['endpoint', 'status'])
+http_duration = metrics.histogram(
+    'downloader_http_request_duration_seconds', 'Время обработки запроса до отправки заголовков ответа',
+    ['endpoint'])
+http_response_bytes = metrics.counter(
+    'downloader_http_response_bytes_total', 'Отданные байты по Content-Length ответа', ['endpoint'])
+long_responses_rejected = metrics.counter(
+    'downloader_long_responses_rejected_total', 'Долгие ответы, отклонённые из-за MAX_LONG_REQUESTS', ['endpoint'])
+metrics.gauge_func('downloader_long_responses',
+                   'Открытые долгие ответы (поток прогресса, потоковая отдача, ZIP, /api/info/batch)',
+                   lambda: long_requests['open'])
+metrics.counter_func(
+    'downloader_info_cache_requests_total', 'Обращения к кэшу информации о видео',
+    lambda: {'hit': info_cache.hits, 'miss': info_cache.misses}, ['result'])
+metrics.counter_func(
+    'downloader_ydl_pool_acquires_total', 'Выдачи экземпляров YoutubeDL из пулов',
+    lambda: {(name, result): getattr(pool, result)
+             for name, pool in (('info', info_ydl_pool), ('playlist', playlist_ydl_pool))
+             for result in ('created', 'reused')}, ['pool', 'result'])
+
+def extract_video_info(url):
+    """Извлечение информации о видео без скачивания."""
+    start = time.perf_counter()
+    try:
+        with info_ydl_pool.acquire() as ydl:
+            logger.debug("Извлечение информации: %s", url)
+            info = ydl.extract_info(url, download=False)
+    except Exception as e:
+        extract_failures.inc(error=type(e).__name__)
+        raise
+    if info is None:
+        # С ignoreerrors yt-dlp сообщает об ошибке в лог и возвращает None
+        extract_failures.inc(error='NoInfo')
+    else:
+        extract_duration.observe(time.perf_counter() - start, extractor=info.get('extractor_key') or 'unknown')
+    return info
+
+def downloaded_filepath(ydl, info):
+    """Путь к итоговому файлу после скачивания и постобработки."""
+    downloads = info.get('requested_downloads') or []
+    if downloads and downloads[0].get('filepath'):
+        return downloads[0]['filepath']
+    return ydl.prepare_filename(info)
+
+class DownloadTimer:
+    """Замер фаз скачивания для метрик: скачивание до первого постпроцессора и сама постобработка."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.download_time = None
+        self._postprocessors = {}
+
+    def postprocessor_hook(self, d):
+        now = time.perf_counter()
+        name = d.get('postprocessor')
+        if d.get('status') == 'started':
+            if self.download_time is None:
+                self.download_time = now - self.started
+            self._postprocessors[name] = now
+        elif d.get('status') == 'finished' and name in self._postprocessors:
+            postprocess_duration.observe(now - self._postprocessors.pop(name), postprocessor=name)
+
+    def finish(self, size):
+        if self.download_time is None:
+            self.download_time = time.perf_counter() - self.started
+        download_duration.observe(self.download_time)
+        downloaded_bytes.inc(size)
+        if self.download_time > 0:
+            download_throughput.observe(size / self.download_time)
+
+def run_download(task_id, payload):
+    """Выполнение задания на скачивание (вызывается воркером очереди)."""
+    url = payload['url']
+    format_id = payload.get('format_id')
+    key = payload.get('content_key') or content_key(url, format_id)
+    existing = content_store.lookup(key)
+    if existing is not None:
+        # Пока задание ждало в очереди, этот файл уже скачали
+        storage_manager.touch(existing)
+        task_store.update(task_id, file_url=content_store.url_for(existing), status='finished',
+                          phase='done', progress=100.0, error=None)
+        return
+    # Задание нужно, пока прогресс запрашивает хоть один присоединённый
+    # клиент: запрос /api/download или плейлист
+    reporter = ProgressReporter(task_id, task_store, PROGRESS_UPDATE_INTERVAL, DOWNLOAD_IDLE_TIMEOUT,
+                                watch_ids=lambda: download_queue.watchers(task_id))
+    # Отмена из этого же процесса срабатывает сразу, из других — через хранилище
+    stop = running_downloads[task_id] = threading.Event()
+    timer = DownloadTimer()
+    try:
+        reporter.check_cancelled()
+        task_store.update(task_id, progress=0.0, status='downloading', phase='download', file_url=None, error=None)
+        # Скачиваем во временный каталог задания и переносим готовый файл
+        # в хранилище одним rename, чтобы никто не получил недокачанный файл
+        outtmpl = os.path.join(content_store.temp_dir(task_id), '%(title)s.%(ext)s')
+        
+        ydl_opts = {
+            'format': format_id if format_id else 'best',
+            'outtmpl': outtmpl,
+            'quiet': False,
+            'no_warnings': False,
+            'nocheckcertificate': True,
+            'ignoreerrors': True,
+            'extract_flat': False,
+            'socket_timeout': 30,
+            # Задание, прерванное перезапуском процесса, очередь выполняет
+            # заново в том же временном каталоге: недокачанные .part, .ytdl
+            # (фрагменты HLS/DASH) и сегменты продолжаются с места остановки
+            'continuedl': True,
+            'concurrent_fragment_downloads': DOWNLOAD_CONNECTIONS,
+            'progress_hooks': [reporter.progress_hook],
+            'postprocessor_hooks': [reporter.postprocessor_hook, timer.postprocessor_hook],
+            'http_headers': HTTP_HEADERS,
+            'logger': YdlLogger(),
+        }
+        
+        logger.info("Начинаем скачивание: %s", url)
+        info, cached = info_cache.get_or_extract(url, extract_video_info)
+        filename = None
+        timer.started = time.perf_counter()
+        with bandwidth.job(task_id, payload.get('client')) as throttle, \
+                SegmentedYoutubeDL(ydl_opts, connections=DOWNLOAD_CONNECTIONS, stop=stop, throttle=throttle) as ydl:
+            if info:
+                result = ydl.process_ie_result(copy.deepcopy(info), download=True)
+                filename = downloaded_filepath(ydl, result)
+                if cached and not os.path.exists(filename):
+                    # Ссылки из кэша могли устареть — извлекаем заново
+                    logger.info("Скачивание по информации из кэша не удалось, повторяем с новым извлечением")
+                    info_cache.invalidate(canonical_video_id(url))
+                    info, _ = info_cache.get_or_extract(url, extract_video_info)
+                    if info:
+                        result = ydl.process_ie_result(copy.deepcopy(info), download=True)
+                        filename = downloaded_filepath(ydl, result)
+        if filename and os.path.exists(filename):
+            timer.finish(os.path.getsize(filename))
+            filename = content_store.commit(key, task_id, filename)
+            storage_manager.record(filename)
+            task_store.update(task_id, file_url=content_store.url_for(filename), status='finished',
+                              phase='done', progress=100.0)
+            downloads_total.inc(status='finished')
+            logger.info("Скачивание завершено: %s", filename)
+        else:
+            content_store.discard(task_id)
+            task_store.update(task_id, status='error', error='Не удалось скачать видео')
+            downloads_total.inc(status='error')
+            download_failures.inc(error='NotDownloaded')
+            logger.error("Видео не скачано: %s", url)
+                
+    except DownloadCancelled as e:
+        # Соединения и ffmpeg к этому моменту остановлены, недокачанное удаляем
+        logger.info("Скачивание отменено: %s", e)
+        content_store.discard(task_id)
+        task_store.update(task_id, status='cancelled', phase='done', error=str(e))
+        downloads_total.inc(status='cancelled')
+    except Exception as e:
+        logger.exception("Ошибка при скачивании: %s", e)
+        downloads_total.inc(status='error')
+        download_failures.inc(error=type(e).__name__)
+        content_store.discard(task_id)
+        task_store.update(task_id, status='error', error=str(e))
+    finally:
+        running_downloads.pop(task_id, None)
+
+# События отмены скачиваний, выполняемых этим процессом
+running_downloads = {}
+
+# Пул воркеров с очередью заданий: число одновременных скачиваний
+# ограничено, а поставленные в очередь задания переживают перезапуск.
+# DOWNLOAD_WORKERS — потоки каждого процесса gunicorn, MAX_RUNNING_DOWNLOADS —
+# предел одновременных скачиваний всех процессов вместе (через общую очередь)
+DOWNLOAD_WORKERS = int(os.getenv('DOWNLOAD_WORKERS', min(4, os.cpu_count() or 1)))
+download_queue = DownloadQueue(
+    os.path.join(DATA_DIR, 'queue.db'),
+    run_download,
+    workers=DOWNLOAD_WORKERS,
+    max_queued=int(os.getenv('MAX_QUEUED_DOWNLOADS', 100)),
+    max_running=int(os.getenv('MAX_RUNNING_DOWNLOADS', DOWNLOAD_WORKERS)),
+)
+
+# Квота на каталог скачиваний; файлы, к которым недавно обращались или
+# которые сейчас отдаются, не удаляются
+storage_manager = StorageManager(
+    DOWNLOADS_DIR,
+    os.path.join(DATA_DIR, 'storage.db'),
+    quota=int(os.getenv('STORAGE_QUOTA_BYTES', 0)),
+    policy=os.getenv('STORAGE_EVICTION_POLICY', 'lru'),
+    grace=int(os.getenv('STORAGE_EVICTION_GRACE', 600)),
+    max_age=int(os.getenv('STORAGE_MAX_AGE', 0)),
+    sweep_interval=int(os.getenv('STORAGE_SWEEP_INTERVAL', 60)),
+    active_tasks=lambda: download_queue.active_task_ids(),
+)
+
+metrics.gauge_func('downloader_active_downloads', 'Выполняющиеся скачивания', lambda: len(running_downloads))
+metrics.gauge_func('downloader_download_workers', 'Воркеры очереди скачиваний', lambda: download_queue.workers)
+
+@metrics.collector
+def shared_metrics():
+    """Очередь и хранилище общие для всех процессов — их метрики не складываются."""
+    samples = [('downloader_queue_jobs', 'gauge', 'Задания в очереди по статусу', {'status': status}, count)
+               for status, count in dict({'queued': 0, 'running': 0}, **download_queue.stats()).items()]
+    storage = storage_manager.stats()
+    samples += [
+        ('downloader_storage_used_bytes', 'gauge', 'Занятое место в каталоге скачиваний', {}, storage['used_bytes']),
+        ('downloader_storage_files', 'gauge', 'Файлы в каталоге скачиваний', {}, storage['files']),
+        ('downloader_storage_evictions_total', 'counter', 'Удаления по квоте и сроку хранения', {},
+         storage['evictions']),
+    ]
+    return samples
+
 @app.route('/api/download', methods=['POST'])
 def download_video():
     data = request.get_json()
@@ -34,69 +398,462 @@ def download_video():
     format_id = data.get('format_id')
     if not url:
         return jsonify({'error': 'Не передан URL'}), 400
+    try:
+        priority = max(0, min(int(data.get('priority', 0)), MAX_PRIORITY))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Некорректный приоритет'}), 400
     task_id = str(uuid.uuid4())
-    progress_dict[task_id] = {'progress': 0.0, 'status': 'downloading', 'file_url': None, 'error': None}
-
-    def run_download():
+    key = content_key(url, format_id)
+    existing = content_store.lookup(key)
+    if existing is None and data.get('mode') == 'stream':
+        # Однофайловые форматы отдаём клиенту потоком, не дожидаясь
+        # скачивания на сервер; остальные ставим в очередь как обычно
         try:
-            save_path = os.path.join('static', 'downloads')
-            os.makedirs(save_path, exist_ok=True)
-            outtmpl = os.path.join(save_path, '%(title)s.%(ext)s')
-            
-            ydl_opts = {
-                'format': format_id if format_id else 'best',
-                'outtmpl': outtmpl,
-                'quiet': False,
-                'no_warnings': False,
-                'nocheckcertificate': True,
-                'ignoreerrors': True,
-                'extract_flat': False,
-                'socket_timeout': 30,
-                'http_headers': {
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36',
-                    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-                    'Accept-Language': 'en-US,en;q=0.9',
-                    'Accept-Encoding': 'gzip, deflate, br',
-                    'Connection': 'keep-alive'
-                }
-            }
-            
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                print(f"Начинаем скачивание: {url}")
-                info = ydl.extract_info(url)
-                if info:
-                    filename = ydl.prepare_filename(info)
-                    file_url = '/static/downloads/' + os.path.basename(filename)
-                    progress_dict[task_id]['file_url'] = file_url
-                    progress_dict[task_id]['status'] = 'finished'
-                    progress_dict[task_id]['progress'] = 100.0
-                    print(f"Скачивание завершено: {filename}")
-                else:
-                    progress_dict[task_id]['status'] = 'error'
-                    progress_dict[task_id]['error'] = 'Не удалось скачать видео'
-                    print("Ошибка: информация о видео не получена")
-                    
+            info, _ = info_cache.get_or_extract(url, extract_video_info)
         except Exception as e:
-            print(f"Ошибка при скачивании: {str(e)}")
-            progress_dict[task_id]['status'] = 'error'
-            progress_dict[task_id]['error'] = str(e)
+            # Задание в очереди повторит извлечение и сообщит об ошибке в статусе
+            logger.warning("Ошибка при получении информации для потоковой отдачи: %s", e)
+            info = None
+        if info and is_progressive(find_format(info, format_id)):
+            return jsonify({'stream_url': url_for('stream_video', url=url, format_id=format_id)})
+    if existing is not None:
+        logger.info("Файл уже скачан: %s", existing)
+        storage_manager.touch(existing)
+        task_store.create(task_id, progress=100.0, status='finished', phase='done',
+                          file_url=content_store.url_for(existing), error=None)
+        return jsonify({'task_id': task_id, 'queue_position': 0})
+    task_store.create(task_id, progress=0.0, status='queued', file_url=None, error=None)
+    task_store.touch(task_id)
+    try:
+        # Одинаковые запросы присоединяются к уже поставленному заданию
+        job_id, position = download_queue.submit(
+            task_id, {'url': url, 'format_id': format_id, 'content_key': key, 'client': request.remote_addr},
+            priority, dedup_key=key)
+    except QueueFullError as e:
+        task_store.delete(task_id)
+        response = jsonify({'error': 'Сервер перегружен, попробуйте позже', 'queue_length': e.queued})
+        response.headers['Retry-After'] = '30'
+        return response, 429
+    if job_id != task_id:
+        task_store.delete(task_id)
+        task_store.touch(job_id)
+    # attachment_id — участие этого запроса в задании (см. DELETE)
+    return jsonify({'task_id': job_id, 'attachment_id': task_id, 'queue_position': position})
+
+@app.route('/api/download/<task_id>', methods=['DELETE'])
+def cancel_download(task_id):
+    """Отмена скачивания: ждущее задание убирается из очереди, выполняющееся прерывается.
+
+    Одинаковые запросы разделяют одно задание, поэтому клиент передаёт
+    attachment_id из ответа /api/download: отсоединяется только он, а
+    задание отменяется, когда не осталось ни одного клиента.
+    """
+    attachment_id = request.args.get('attachment_id')
+    if not attachment_id:
+        return jsonify({'error': 'Не передан attachment_id'}), 400
+    state = task_store.get(task_id)
+    if state is None or state.get('kind') == 'playlist':
+        return jsonify({'error': 'Задание не найдено'}), 404
+    if state['status'] in FINAL_STATUSES:
+        return jsonify({'error': 'Задание уже завершено', 'status': state['status']}), 409
+    remaining = download_queue.detach(task_id, attachment_id)
+    if remaining is None:
+        # Этот клиент уже отсоединился: повторный запрос ничего не меняет
+        return jsonify({'task_id': task_id, 'status': state['status']})
+    if remaining:
+        return jsonify({'task_id': task_id, 'status': 'detached', 'clients': remaining})
+    if download_queue.cancel(task_id):
+        task_store.update(task_id, status='cancelled', phase='done', error='Скачивание отменено')
+        return jsonify({'task_id': task_id, 'status': 'cancelled'})
+    # Задание выполняется, возможно в другом процессе: воркер заметит флаг
+    # в хуке прогресса, удалит недокачанное и сменит статус на cancelled
+    task_store.update(task_id, cancel_requested=True)
+    stop = running_downloads.get(task_id)
+    if stop is not None:
+        stop.set()
+    return jsonify({'task_id': task_id, 'status': 'cancelling'}), 202
 
-    Thread(target=run_download).start()
-    return jsonify({'task_id': task_id})
+@app.route('/api/playlist', methods=['POST'])
+def download_playlist():
+    """Скачивание плейлиста или канала: по заданию в очереди на каждое видео."""
+    data = request.get_json(silent=True) or {}
+    url = data.get('url')
+    format_id = data.get('format_id')
+    if not url:
+        return jsonify({'error': 'Не передан URL'}), 400
+    try:
+        priority = max(0, min(int(data.get('priority', 0)), MAX_PRIORITY))
+        concurrency = max(1, min(int(data.get('concurrency', PLAYLIST_CONCURRENCY)), PLAYLIST_CONCURRENCY))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Некорректный приоритет или число одновременных скачиваний'}), 400
+    try:
+        with playlist_ydl_pool.acquire() as ydl:
+            title, entries = extract_entries(ydl, url, MAX_PLAYLIST_ITEMS)
+    except Exception as e:
+        logger.warning("Ошибка при получении списка видео: %s", e)
+        return jsonify({'error': f'Не удалось получить список видео: {str(e)}'}), 400
+    if not entries:
+        return jsonify({'error': 'Плейлист пуст или недоступен'}), 400
+
+    playlist_id = str(uuid.uuid4())
+    items = []
+    jobs = []
+    for entry in entries:
+        key = content_key(entry['url'], format_id)
+        item = dict(entry, content_key=key, task_id=None)
+        # Уже скачанные видео пропускаются: хранилище по ключу содержимого
+        # служит архивом загрузок, и повторная отправка плейлиста докачивает
+        # только недостающее
+        if content_store.lookup(key) is None:
+            item['task_id'] = str(uuid.uuid4())
+            task_store.create(item['task_id'], progress=0.0, status='queued', file_url=None, error=None)
+            jobs.append({
+                'task_id': item['task_id'],
+                'payload': {'url': entry['url'], 'format_id': format_id, 'content_key': key,
+                            'playlist_id': playlist_id, 'client': request.remote_addr},
+                'priority': priority,
+                'dedup_key': key,
+                'watch_id': playlist_id,
+                'group': playlist_id,
+                'group_limit': concurrency,
+            })
+        items.append(item)
+    try:
+        job_ids = download_queue.submit_many(jobs)
+    except QueueFullError as e:
+        for job in jobs:
+            task_store.delete(job['task_id'])
+        response = jsonify({'error': 'Сервер перегружен, попробуйте позже', 'queue_length': e.queued})
+        response.headers['Retry-After'] = '30'
+        return response, 429
+    job_map = {}
+    for job, job_id in zip(jobs, job_ids):
+        job_map[job['task_id']] = job_id
+        if job_id != job['task_id']:
+            # Видео уже скачивается по другому запросу
+            task_store.delete(job['task_id'])
+    for item in items:
+        if item['task_id']:
+            item['task_id'] = job_map[item['task_id']]
+    task_store.create(playlist_id, kind='playlist', title=title, url=url, items=items,
+                      progress=0.0, status='downloading', error=None)
+    task_store.touch(playlist_id)
+    logger.info("Плейлист %s: %s видео, в очередь поставлено %s", title, len(items), len(jobs))
+    return jsonify({'playlist_id': playlist_id, 'title': title, 'total': len(items), 'queued': len(jobs)})
+
+def playlist_item_state(item):
+    """Состояние задания элемента плейлиста; завершённые давно задания ищутся в хранилище."""
+    state = task_store.get(item['task_id']) if item['task_id'] else None
+    if state is not None:
+        return state
+    path = content_store.lookup(item['content_key'])
+    if path is not None:
+        return {'status': 'finished', 'progress': 100.0, 'file_url': content_store.url_for(path)}
+    return {'status': 'error', 'progress': 0.0, 'error': 'Видео не скачано'}
+
+def get_playlist(playlist_id):
+    playlist = task_store.get(playlist_id)
+    return playlist if playlist is not None and playlist.get('kind') == 'playlist' else None
+
+@app.route('/api/playlist/<playlist_id>')
+def playlist_progress(playlist_id):
+    """Сводный прогресс плейлиста и состояние каждого видео."""
+    playlist = get_playlist(playlist_id)
+    if playlist is None:
+        return jsonify({'error': 'Плейлист не найден'}), 404
+    task_store.touch(playlist_id)
+    states = [playlist_item_state(item) for item in playlist['items']]
+    summary = summarize(states)
+    if summary['status'] != playlist['status'] or summary['progress'] != playlist['progress']:
+        # Завершённый плейлист получает срок хранения, как и обычные задания
+        task_store.update(playlist_id, status=summary['status'], progress=summary['progress'])
+    items = [{
+        'index': item['index'],
+        'title': item['title'],
+        'url': item['url'],
+        'status': state.get('status'),
+        'progress': state.get('progress'),
+        'file_url': state.get('file_url'),
+        'error': state.get('error'),
+    } for item, state in zip(playlist['items'], states)]
+    return jsonify(dict(summary, title=playlist['title'], items=items,
+                        archive_url=url_for('playlist_archive', playlist_id=playlist_id)))
+
+@app.route('/api/playlist/<playlist_id>/archive')
+def playlist_archive(playlist_id):
+    """ZIP-архив плейлиста: видео добавляются по мере готовности, не дожидаясь всех."""
+    playlist = get_playlist(playlist_id)
+    if playlist is None:
+        return jsonify({'error': 'Плейлист не найден'}), 404
+    busy = long_response_slot()
+    if busy is not None:
+        return busy
+
+    def files():
+        pending = list(playlist['items'])
+        while pending:
+            # Пока архив отдаётся, скачивание плейлиста не считается брошенным
+            task_store.touch(playlist_id)
+            waiting = []
+            for item in pending:
+                state = playlist_item_state(item)
+                if state['status'] == 'finished':
+                    path = content_store.lookup(item['content_key'])
+                    if path is None:
+                        continue
+                    storage_manager.pin(path)
+                    try:
+                        yield f"{item['index']:03d} - {os.path.basename(path)}", path
+                    finally:
+                        storage_manager.unpin(path)
+                elif state['status'] not in FINAL_STATUSES:
+                    waiting.append(item)
+            pending = waiting
+            if pending:
+                time.sleep(PLAYLIST_POLL_INTERVAL)
+
+    filename = f"{yt_dlp.utils.sanitize_filename(playlist.get('title') or 'playlist')}.zip"
+    return Response(_LongResponse(iter_zip(files())), mimetype='application/zip', headers={
+        'Content-Disposition': content_disposition(filename),
+        'X-Accel-Buffering': 'no',
+    })
+
+def progress_payload(task_id, prog):
+    """Ответ о прогрессе задания для /api/progress и потока событий."""
+    return {
+        'progress': prog['progress'],
+        'status': prog['status'],
+        'phase': prog.get('phase'),
+        'downloaded_bytes': prog.get('downloaded_bytes'),
+        'total_bytes': prog.get('total_bytes'),
+        'total_is_estimate': prog.get('total_is_estimate'),
+        'speed': prog.get('speed'),
+        'eta': prog.get('eta'),
+        'fragment_index': prog.get('fragment_index'),
+        'fragment_count': prog.get('fragment_count'),
+        'stream_index': prog.get('stream_index'),
+        'stream_count': prog.get('stream_count'),
+        'file_url': prog.get('file_url'),
+        'error': prog.get('error'),
+        'queue_position': download_queue.position(task_id) if prog['status'] == 'queued' else 0
+    }
+
+@app.route('/api/stream')
+def stream_video():
+    """Потоковая отдача однофайлового формата по мере его получения от источника."""
+    url = request.args.get('url')
+    format_id = request.args.get('format_id')
+    if not url:
+        return jsonify({'error': 'Не передан URL'}), 400
+    key = content_key(url, format_id)
+    existing = content_store.lookup(key)
+    if existing is not None:
+        storage_manager.touch(existing)
+        return redirect(content_store.url_for(existing))
+
+    try:
+        info, _ = info_cache.get_or_extract(url, extract_video_info)
+    except Exception as e:
+        return jsonify({'error': f'Не удалось получить информацию о видео: {str(e)}'}), 400
+    fmt = find_format(info, format_id) if info else None
+    if not is_progressive(fmt):
+        return jsonify({'error': 'Этот формат нельзя отдать потоком, используйте /api/download'}), 400
+
+    range_header = request.headers.get('Range')
+    try:
+        upstream = open_upstream(fmt, range_header)
+    except requests.RequestException as e:
+        logger.warning("Ошибка при подключении к источнику: %s", e)
+        return jsonify({'error': 'Источник недоступен'}), 502
+    if upstream.status_code not in (200, 206):
+        upstream.close()
+        if upstream.status_code == 416:
+            return Response(status=416)
+        # Ссылка на формат могла устареть
+        info_cache.invalidate(canonical_video_id(url))
+        return jsonify({'error': f'Источник ответил {upstream.status_code}'}), 502
+    busy = long_response_slot()
+    if busy is not None:
+        upstream.close()
+        return busy
+
+    filename = f"{yt_dlp.utils.sanitize_filename(info.get('title') or 'video')}.{fmt.get('ext') or 'mp4'}"
+    headers = {name: upstream.headers[name] for name in PASSTHROUGH_HEADERS if name in upstream.headers}
+    headers['Content-Disposition'] = content_disposition(filename)
+    headers['X-Accel-Buffering'] = 'no'
+
+    tee_id = tee_path = None
+    # Полный ответ заодно сохраняем в хранилище для следующих запросов
+    if STREAM_TEE and upstream.status_code == 200:
+        tee_id = f'stream-{uuid.uuid4()}'
+        tee_path = os.path.join(content_store.temp_dir(tee_id), filename)
+
+    # Вызываются, только если задан tee_path
+    def on_complete(path):
+        storage_manager.record(content_store.commit(key, tee_id, path))
+
+    def on_abort():
+        content_store.discard(tee_id)
+
+    logger.info("Потоковая отдача: %s (формат %s)", url, fmt.get('format_id'))
+    return Response(_LongResponse(iter_body(upstream, tee_path, on_complete, on_abort)),
+                    status=upstream.status_code, headers=headers, direct_passthrough=True)
 
 @app.route('/api/progress')
 def get_progress():
     task_id = request.args.get('task_id')
-    if not task_id or task_id not in progress_dict:
+    prog = task_store.get(task_id) if task_id else None
+    if prog is None:
         return jsonify({'error': 'Некорректный task_id'}), 400
-    prog = progress_dict[task_id]
-    return jsonify({
-        'progress': prog['progress'],
-        'status': prog['status'],
-        'file_url': prog.get('file_url'),
-        'error': prog.get('error')
+    task_store.touch(task_id)
+    return jsonify(progress_payload(task_id, prog))
+
+@app.route('/api/progress/stream')
+def stream_progress():
+    """Прогресс задания в виде Server-Sent Events вместо периодического опроса."""
+    task_id = request.args.get('task_id')
+    if not task_id or task_store.get(task_id) is None:
+        return jsonify({'error': 'Некорректный task_id'}), 400
+
+    busy = long_response_slot()
+    if busy is not None:
+        # Браузер получит ошибку потока и перейдёт на опрос
+        return busy
+
+    def generate():
+        yield 'retry: 2000\n\n'
+        last = None
+        touched = 0.0
+        opened = time.monotonic()
+        for prog in task_store.watch(task_id, heartbeat=SSE_HEARTBEAT_INTERVAL):
+            if time.monotonic() - opened >= SSE_MAX_LIFETIME:
+                # Закрываем поток: клиент, который ещё ждёт, перейдёт на опрос
+                break
+            # Открытый поток — признак того, что клиент ещё ждёт файл
+            if time.monotonic() - touched >= SSE_HEARTBEAT_INTERVAL:
+                touched = time.monotonic()
+                task_store.touch(task_id)
+            if prog is None:
+                # Позиция в очереди меняется без записи в хранилище,
+                # поэтому для ожидающих заданий обновляем её по таймеру
+                if last is not None and last['status'] == 'queued':
+                    prog = last
+                else:
+                    yield ': ping\n\n'
+                    continue
+            last = prog
+            yield f'data: {json.dumps(progress_payload(task_id, prog))}\n\n'
+            if prog['status'] in FINAL_STATUSES:
+                break
+
+    return Response(_LongResponse(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
     })
 
+class _LongResponse:
+    """Тело долгого ответа: держит слот long_requests, пока сервер его не закроет."""
+
+    def __init__(self, body):
+        self._body = body
+        self._released = False
+
+    def __iter__(self):
+        return iter(self._body)
+
+    def close(self):
+        if not self._released:
+            self._released = True
+            with long_requests_lock:
+                long_requests['open'] -= 1
+        if hasattr(self._body, 'close'):
+            self._body.close()
+
+def long_response_slot():
+    """Занять слот долгого ответа; None — слотов нет, иначе ответ 503 для клиента."""
+    with long_requests_lock:
+        if long_requests['open'] < MAX_LONG_REQUESTS:
+            long_requests['open'] += 1
+            return None
+    long_responses_rejected.inc(endpoint=request.endpoint or 'unknown')
+    response = jsonify({'error': 'Слишком много открытых потоков, попробуйте позже'})
+    response.headers['Retry-After'] = '5'
+    return response, 503
+
+class _PinnedFile:
+    """Файл, снимающий защиту от удаления по квоте при закрытии."""
+
+    def __init__(self, file, on_close):
+        self._file = file
+        self._on_close = on_close
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def close(self):
+        on_close, self._on_close = self._on_close, None
+        try:
+            self._file.close()
+        finally:
+            if on_close is not None:
+                on_close()
+
+@app.route('/files/<key>/<name>')
+def serve_file(key, name):
+    """Отдача скачанного файла с поддержкой Range, ETag и Last-Modified.
+
+    Под gunicorn файл уходит через sendfile; при X_ACCEL_REDIRECT_PREFIX
+    или USE_X_SENDFILE передачу выполняет фронтовой сервер.
+    """
+    path = safe_join(DOWNLOADS_DIR, key, name)
+    if path is None or not re.fullmatch(r'[0-9a-f]{40}', key) or not os.path.isfile(path):
+        abort(404)
+    if X_ACCEL_REDIRECT_PREFIX:
+        storage_manager.touch(path)
+        return Response(headers={
+            'X-Accel-Redirect': X_ACCEL_REDIRECT_PREFIX.rstrip('/') + content_store.url_for(path)[len('/files'):],
+            'Content-Disposition': content_disposition(name),
+        })
+    if app.config['USE_X_SENDFILE']:
+        storage_manager.touch(path)
+        return send_file(os.path.abspath(path), as_attachment=True, download_name=name,
+                         conditional=True, max_age=FILES_MAX_AGE)
+
+    # Файл защищён от удаления по квоте, пока передача не закончится:
+    # защита снимается при закрытии файла сервером
+    storage_manager.pin(path)
+    environ = request.environ
+    file_wrapper = environ.get('wsgi.file_wrapper', FileWrapper)
+    environ['wsgi.file_wrapper'] = lambda file, *args: file_wrapper(
+        _PinnedFile(file, lambda: storage_manager.unpin(path)), *args)
+    try:
+        response = send_file(os.path.abspath(path), as_attachment=True, download_name=name,
+                             conditional=True, max_age=FILES_MAX_AGE)
+    except Exception:
+        storage_manager.unpin(path)
+        raise
+    finally:
+        # gunicorn сравнивает ответ с wsgi.file_wrapper, чтобы использовать sendfile
+        environ['wsgi.file_wrapper'] = file_wrapper
+    # Сообщаем клиенту, что докачка по диапазонам поддерживается
+    response.headers['Accept-Ranges'] = 'bytes'
+    return response
+
+@app.route('/api/storage')
+def get_storage_stats():
+    """Занятое место в каталоге скачиваний и счётчики удалений."""
+    return jsonify(storage_manager.stats())
+
+@app.route('/metrics')
+def get_metrics():
+    """Метрики в текстовом формате Prometheus."""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/bandwidth')
+def get_bandwidth_stats():
+    """Действующие лимиты скорости и число скачиваний этого процесса."""
+    return jsonify(bandwidth.stats())
+
 @app.route('/api/info', methods=['POST'])
 def get_video_info():
     try:
@@ -105,69 +862,123 @@ def get_video_info():
         
         if not url:
             return jsonify({'error': 'URL не указан'}), 400
+        try:
+            fields = parse_fields(request.args.get('fields'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
 
-        print(f"Получение информации о видео... URL: {url}")
-        
-        ydl_opts = {
-            'quiet': False,
-            'no_warnings': False,
-            'extract_flat': False,
-            'format': 'best',
-            'nocheckcertificate': True,
-            'ignoreerrors': True,
-            'socket_timeout': 30,
-            'http_headers': {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36',
-                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-                'Accept-Language': 'en-US,en;q=0.9',
-                'Accept-Encoding': 'gzip, deflate, br',
-                'Connection': 'keep-alive'
-            }
-        }
+        logger.info("Получение информации о видео: %s", url, extra=VERBOSE)
         
         try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                print("Начинаем извлечение информации...")
-                info = ydl.extract_info(url, download=False)
-                if not info:
-                    print("Информация не получена")
-                    return jsonify({
-                        'error': 'Не удалось получить информацию о видео'
-                    }), 400
-                
-                print(f"Получена информация: {info.get('title')}")
-                
-                # Получаем доступные форматы
-                formats = []
-                if 'formats' in info:
-                    for f in info['formats']:
-                        if f.get('ext') in ['mp4', 'webm', 'm4a', 'mp3']:
-                            formats.append({
-                                'format_id': f.get('format_id'),
-                                'ext': f.get('ext'),
-                                'format_note': f.get('format_note'),
-                                'filesize': f.get('filesize'),
-                                'filesize_approx': f.get('filesize_approx'),
-                                'height': f.get('height'),
-                                'width': f.get('width'),
-                                'tbr': f.get('tbr'),
-                                'acodec': f.get('acodec'),
-                                'vcodec': f.get('vcodec'),
-                                'fps': f.get('fps'),
-                            })
-                info['formats'] = formats
-                return jsonify(info)
+            info, cached = info_cache.get_or_extract(url, extract_video_info)
+            if not info:
+                logger.warning("Информация не получена: %s", url)
+                return jsonify({
+                    'error': 'Не удалось получить информацию о видео'
+                }), 400
+            
+            logger.info("Получена информация: %s", info.get('title'), extra=dict(VERBOSE, cached=cached))
+            
+            # Отдаём только поля схемы: полный info yt-dlp занимает сотни килобайт
+            return jsonify(compact_info(info, fields))
                     
         except Exception as e:
-            print(f"Ошибка при получении информации: {str(e)}")
-            print(f"Тип ошибки: {type(e)}")
+            logger.warning("Ошибка при получении информации (%s): %s", type(e).__name__, e)
             return jsonify({
                 'error': f'Не удалось получить информацию о видео: {str(e)}'
             }), 400
                 
     except Exception as e:
-        print(f"Неожиданная ошибка: {str(e)}")
+        logger.exception("Неожиданная ошибка: %s", e)
         return jsonify({'error': f'Произошла ошибка: {str(e)}'}), 500
 
+@app.route('/api/info/batch', methods=['POST'])
+def get_video_info_batch():
+    """Информация о нескольких видео сразу.
+
+    Ответ — NDJSON: по строке на каждый URL в порядке готовности,
+    поле index указывает позицию URL в запросе.
+    """
+    data = request.get_json(silent=True) or {}
+    urls = data.get('urls')
+    if not isinstance(urls, list) or not urls or not all(isinstance(url, str) and url for url in urls):
+        return jsonify({'error': 'Ожидается непустой список urls'}), 400
+    if len(urls) > MAX_BATCH_URLS:
+        return jsonify({'error': f'Не больше {MAX_BATCH_URLS} URL за запрос'}), 400
+    try:
+        fields = parse_fields(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    # Ответ открыт, пока не извлечены все URL
+    busy = long_response_slot()
+    if busy is not None:
+        return busy
+
+    def generate():
+        # Ссылки на одно видео извлекаются один раз
+        futures = {}
+        indexes = {}
+        for index, url in enumerate(urls):
+            key = canonical_video_id(url)
+            if key not in indexes:
+                indexes[key] = []
+                futures[info_executor.submit(info_cache.get_or_extract, url, extract_video_info)] = key
+            indexes[key].append(index)
+        try:
+            for future in as_completed(futures):
+                try:
+                    info, cached = future.result()
+                    if info:
+                        result = {'cached': cached, 'info': compact_info(info, fields)}
+                    else:
+                        result = {'error': 'Не удалось получить информацию о видео'}
+                except Exception as e:
+                    result = {'error': f'Не удалось получить информацию о видео: {str(e)}'}
+                for index in indexes[futures[future]]:
+                    yield json.dumps(dict(index=index, url=urls[index], **result), ensure_ascii=False) + '\n'
+        finally:
+            # Клиент отключился — не извлекаем то, что ещё не начато
+            for future in futures:
+                future.cancel()
+
+    return Response(_LongResponse(generate()), mimetype='application/x-ndjson',
+                    headers={'X-Accel-Buffering': 'no'})
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    # Записи лога, сделанные при обработке запроса, помечаются его request_id
+    g.log_token = bind_context(request_id=request.headers.get('X-Request-ID') or uuid.uuid4().hex[:12])
+
+@app.teardown_request
+def reset_request_context(error=None):
+    token = g.pop('log_token', None)
+    if token is not None:
+        reset_context(token)
+
+# Регистрируется раньше compress, а выполняется после него: учитываются сжатые байты
+@app.after_request
+def record_request_metrics(response):
+    endpoint = request.endpoint or 'unmatched'
+    started = g.get('request_started')
+    if started is not None:
+        http_duration.observe(time.perf_counter() - started, endpoint=endpoint)
+    http_requests.inc(endpoint=endpoint, status=response.status_code)
+    if response.content_length:
+        http_response_bytes.inc(response.content_length, endpoint=endpoint)
+    return response
+
+@app.after_request
+def compress(response):
+    return compress_response(response, request.accept_encodings)
+
+# При запуске через `python app.py` с отладкой воркеры стартуют только в
+# дочернем процессе перезагрузчика, иначе задания разбирались бы дважды
+if __name__ != '__main__' or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+    storage_manager.start()
+    metrics.start()
+    bandwidth.watch(os.path.join(DATA_DIR, 'bandwidth.json'))
+    download_queue.start()
+
 if __name__ == '__main__':
     app.run(debug=True, port=5001) 
\ No newline at end of file
@@ -0,0 +1,211 @@
+import os
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Всплеск ведра — столько секунд трафика на полной скорости (не меньше блока)
+BURST_SECONDS = 0.5
+MIN_BURST = 256 * 1024
+
+
+class TokenBucket:
+    """Ведро токенов: в среднем не больше rate байт в секунду.
+
+    consume() списывает байты сразу, уходя в долг, и ждёт, пока долг не
+    погасится, поэтому одновременные вызовы из нескольких потоков не
+    превышают общую скорость. rate=0 — без ограничения.
+    """
+
+    def __init__(self, rate=0):
+        self._lock = threading.Lock()
+        self._tokens = 0.0
+        self._stamp = time.monotonic()
+        self.configure(rate)
+
+    def configure(self, rate):
+        with self._lock:
+            self.rate = max(0, int(rate or 0))
+            self.burst = max(self.rate * BURST_SECONDS, MIN_BURST)
+            self._tokens = min(self._tokens, self.burst)
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def consume(self, size):
+        if not self.rate:
+            return
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= size
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0
+        if delay:
+            time.sleep(delay)
+
+
+class JobThrottle:
+    """Ограничитель одного задания: его лимит, лимит клиента и общий."""
+
+    def __init__(self, scheduler, job_id, client, vtime):
+        self.scheduler = scheduler
+        self.job_id = job_id
+        self.client = client
+        self.bucket = TokenBucket(scheduler.job_rate)
+        # Сколько байт задание получило из общей полосы (для честного деления)
+        self.vtime = vtime
+        self.waiting = 0
+
+    def consume(self, size):
+        """Учесть size полученных байт, при необходимости подождав."""
+        self.bucket.consume(size)
+        client = self.scheduler._clients.get(self.client)
+        if client is not None:
+            client[0].consume(size)
+        self.scheduler._acquire(self, size)
+
+
+class BandwidthScheduler:
+    """Распределение полосы между скачиваниями процесса.
+
+    Общая полоса делится поровну между активными заданиями, а не между
+    соединениями: задание в 4 соединения не отнимает её у задания в одно.
+    Очередной блок получает ждущее задание, которому досталось меньше всех
+    (честная очередь по виртуальному времени), но если ждёт только одно
+    задание, ему отдаётся вся полоса. Поверх этого действуют лимиты на
+    задание и на клиента. Все лимиты в байтах в секунду, 0 — без ограничения,
+    и меняются на лету через configure().
+    """
+
+    def __init__(self, rate=0, job_rate=0, client_rate=0):
+        self._cond = threading.Condition()
+        self._jobs = {}
+        self._clients = {}
+        self._tokens = 0.0
+        self._stamp = time.monotonic()
+        self.rate = self.job_rate = self.client_rate = 0
+        self.configure(rate, job_rate, client_rate)
+
+    def configure(self, rate=None, job_rate=None, client_rate=None):
+        """Изменить лимиты (None — оставить прежний); действует и на идущие скачивания."""
+        with self._cond:
+            if rate is not None:
+                self.rate = max(0, int(rate))
+                self._tokens = min(self._tokens, self._burst())
+            if job_rate is not None:
+                self.job_rate = max(0, int(job_rate))
+                for job in self._jobs.values():
+                    job.bucket.configure(self.job_rate)
+            if client_rate is not None:
+                self.client_rate = max(0, int(client_rate))
+                for bucket, _ in self._clients.values():
+                    bucket.configure(self.client_rate)
+            self._cond.notify_all()
+
+    def _burst(self):
+        return max(self.rate * BURST_SECONDS, MIN_BURST)
+
+    @contextmanager
+    def job(self, job_id, client=None):
+        """Зарегистрировать задание на время скачивания; выдаёт JobThrottle."""
+        with self._cond:
+            # Новое задание начинает вровень с самым отстающим из активных,
+            # а не с нуля, чтобы не забрать всю полосу на время «догона»
+            vtime = min((job.vtime for job in self._jobs.values()), default=0)
+            throttle = self._jobs[job_id] = JobThrottle(self, job_id, client, vtime)
+            if client is not None:
+                entry = self._clients.setdefault(client, [TokenBucket(self.client_rate), 0])
+                entry[1] += 1
+        try:
+            yield throttle
+        finally:
+            with self._cond:
+                self._jobs.pop(job_id, None)
+                if client is not None:
+                    entry = self._clients[client]
+                    entry[1] -= 1
+                    if not entry[1]:
+                        del self._clients[client]
+                self._cond.notify_all()
+
+    def _acquire(self, job, size):
+        if not self.rate:
+            return
+        with self._cond:
+            if self._jobs.get(job.job_id) is not job:
+                return
+            if not job.waiting:
+                # Пока задание не ждало полосы (упиралось в свой лимит или в
+                # источник), оно не копит право на внеочередную полосу
+                waiting = [j.vtime for j in self._jobs.values() if j.waiting]
+                if waiting:
+                    job.vtime = max(job.vtime, min(waiting))
+            job.waiting += 1
+            try:
+                while self.rate:
+                    now = time.monotonic()
+                    self._tokens = min(self._burst(), self._tokens + (now - self._stamp) * self.rate)
+                    self._stamp = now
+                    if self._tokens > 0:
+                        turn = min((j for j in self._jobs.values() if j.waiting), key=lambda j: j.vtime)
+                        if turn is job:
+                            self._tokens -= size
+                            job.vtime += size
+                            self._cond.notify_all()
+                            return
+                        # Очередь другого задания: его поток разбудит остальных
+                        self._cond.wait(0.05)
+                    else:
+                        self._cond.wait(-self._tokens / self.rate)
+            finally:
+                job.waiting -= 1
+
+    def watch(self, path, interval=5.0):
+        """Перечитывать лимиты из JSON-файла path при его изменении (фоновый поток).
+
+        Ключи файла — rate, job_rate, client_rate. Так лимиты меняются без
+        перезапуска во всех процессах сразу; отсутствующий ключ или файл
+        возвращает значение, заданное при создании.
+        """
+        defaults = {'rate': self.rate, 'job_rate': self.job_rate, 'client_rate': self.client_rate}
+
+        def reload(mtime):
+            try:
+                current = os.stat(path).st_mtime
+            except OSError:
+                current = None
+            if current == mtime:
+                return mtime
+            settings = {}
+            if current is not None:
+                try:
+                    with open(path) as f:
+                        settings = json.load(f)
+                    settings = {key: int(settings.get(key, value)) for key, value in defaults.items()}
+                except (OSError, ValueError, TypeError, AttributeError) as e:
+                    logger.warning("Не удалось прочитать лимиты скорости из %s: %s", path, e)
+                    return current
+            self.configure(**dict(defaults, **settings))
+            logger.info("Лимиты скорости: %s", self.stats())
+            return current
+
+        def loop():
+            mtime = None
+            while True:
+                mtime = reload(mtime)
+                time.sleep(interval)
+
+        threading.Thread(target=loop, name='bandwidth-settings', daemon=True).start()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'rate': self.rate,
+                'job_rate': self.job_rate,
+                'client_rate': self.client_rate,
+                'active_jobs': len(self._jobs),
+                'active_clients': len(self._clients),
+            }
@@ -0,0 +1,38 @@
+import gzip
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Меньшие ответы сжимать невыгодно
+MIN_SIZE = 512
+COMPRESSIBLE_TYPES = ('application/json', 'text/html', 'text/css', 'application/javascript', 'text/javascript')
+
+
+def _encode(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=5)
+    return gzip.compress(data, compresslevel=6)
+
+
+def compress_response(response, accept_encodings):
+    """Сжать ответ gzip или brotli, если клиент это поддерживает.
+
+    Потоковые ответы (отдача файлов, Server-Sent Events) не трогаются.
+    """
+    if (response.direct_passthrough or response.is_streamed
+            or response.status_code < 200 or response.status_code in (204, 206, 304)
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_TYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = accept_encodings.best_match(['br', 'gzip'] if brotli else ['gzip'])
+    if encoding is None:
+        return response
+    data = response.get_data()
+    if len(data) < MIN_SIZE:
+        return response
+    response.set_data(_encode(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
@@ -0,0 +1,71 @@
+import os
+import shutil
+import hashlib
+from urllib.parse import quote
+
+# Каталог внутри хранилища для незавершённых скачиваний: лежит на той же
+# файловой системе, поэтому перенос готового файла — атомарный rename
+INCOMING_DIR = '.incoming'
+
+
+class ContentStore:
+    """Хранилище скачанных файлов, адресуемых по видео и формату.
+
+    Файл для ключа лежит в `<root>/<ключ>/<имя>`: одинаковые запросы
+    получают уже скачанный файл, а разные видео с одинаковым названием
+    не перезаписывают друг друга.
+    """
+
+    def __init__(self, root, url_prefix):
+        self.root = root
+        self.url_prefix = url_prefix.rstrip('/')
+        os.makedirs(os.path.join(root, INCOMING_DIR), exist_ok=True)
+
+    @staticmethod
+    def make_key(video_key, format_spec):
+        """Ключ содержимого по каноническому id видео ('Youtube:...') и спецификации формата."""
+        return hashlib.sha1(f'{video_key}|{format_spec}'.encode()).hexdigest()
+
+    def lookup(self, key):
+        """Путь к готовому файлу для ключа или None."""
+        directory = os.path.join(self.root, key)
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            return None
+        for name in names:
+            path = os.path.join(directory, name)
+            if os.path.isfile(path):
+                return path
+        return None
+
+    def url_for(self, path):
+        relative = os.path.relpath(path, self.root).replace(os.sep, '/')
+        return f'{self.url_prefix}/{quote(relative)}'
+
+    def temp_dir(self, task_id):
+        """Каталог для скачивания задания (создаётся при необходимости)."""
+        path = os.path.join(self.root, INCOMING_DIR, task_id)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def discard(self, task_id):
+        shutil.rmtree(os.path.join(self.root, INCOMING_DIR, task_id), ignore_errors=True)
+
+    def commit(self, key, task_id, path):
+        """Перенести скачанный файл задания в хранилище. Возвращает итоговый путь.
+
+        Если файл для ключа уже появился (его скачал другой процесс),
+        новый файл удаляется и возвращается существующий.
+        """
+        try:
+            existing = self.lookup(key)
+            if existing is not None:
+                return existing
+            directory = os.path.join(self.root, key)
+            os.makedirs(directory, exist_ok=True)
+            final_path = os.path.join(directory, os.path.basename(path))
+            os.replace(path, final_path)
+            return final_path
+        finally:
+            self.discard(task_id)
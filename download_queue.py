@@ -0,0 +1,305 @@
+import os
+import json
+import logging
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from log_setup import log_context
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Очередь заполнена, новое задание не принято."""
+
+    def __init__(self, queued):
+        super().__init__(f'Очередь заполнена ({queued} заданий)')
+        self.queued = queued
+
+
+def _pid_alive(pid):
+    """Проверка, что процесс с данным PID ещё существует."""
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class DownloadQueue:
+    """Очередь заданий на скачивание с фиксированным пулом воркеров.
+
+    Задания хранятся в SQLite, поэтому переживают перезапуск процесса
+    и разбираются воркерами всех процессов gunicorn без дублирования.
+    `workers` — потоки одного процесса; `max_running` ограничивает число
+    выполняющихся заданий во всех процессах вместе (0 — без ограничения).
+    """
+
+    def __init__(self, db_path, handler, workers=2, max_queued=100, poll_interval=1.0, max_running=0):
+        self.db_path = db_path
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.max_running = max_running
+        self.max_queued = max_queued
+        self.poll_interval = poll_interval
+        self._wakeup = threading.Condition()
+        self._threads = []
+        self._started = False
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS jobs (
+                    task_id TEXT PRIMARY KEY,
+                    payload TEXT NOT NULL,
+                    priority INTEGER NOT NULL DEFAULT 0,
+                    status TEXT NOT NULL DEFAULT 'queued',
+                    worker_pid INTEGER,
+                    created_at REAL NOT NULL,
+                    started_at REAL
+                )
+            ''')
+            columns = {row['name'] for row in conn.execute('PRAGMA table_info(jobs)')}
+            if 'dedup_key' not in columns:
+                conn.execute('ALTER TABLE jobs ADD COLUMN dedup_key TEXT')
+            if 'group_key' not in columns:
+                conn.execute('ALTER TABLE jobs ADD COLUMN group_key TEXT')
+                conn.execute('ALTER TABLE jobs ADD COLUMN group_limit INTEGER NOT NULL DEFAULT 0')
+            conn.execute('CREATE INDEX IF NOT EXISTS jobs_pending ON jobs (status, priority, created_at)')
+            conn.execute('CREATE INDEX IF NOT EXISTS jobs_dedup ON jobs (dedup_key)')
+            conn.execute('CREATE INDEX IF NOT EXISTS jobs_group ON jobs (group_key, status)')
+            # Клиенты (запросы и плейлисты), ждущие результат задания: у каждого
+            # свой идентификатор для отсоединения и свой идентификатор наблюдения,
+            # по обращениям к которому задание считается нужным
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS attachments (
+                    attachment_id TEXT PRIMARY KEY,
+                    task_id TEXT NOT NULL,
+                    watch_id TEXT NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS attachments_task ON attachments (task_id)')
+            # Задания из базы прежней версии принадлежат своему создателю
+            conn.execute('''
+                INSERT OR IGNORE INTO attachments (attachment_id, task_id, watch_id)
+                SELECT task_id, task_id, task_id FROM jobs
+                WHERE task_id NOT IN (SELECT task_id FROM attachments)
+            ''')
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def start(self):
+        """Запуск пула воркеров (повторные вызовы игнорируются)."""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        self._recover()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f'download-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _recover(self):
+        """Возвращает в очередь задания, чей процесс-исполнитель завершился."""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT task_id, worker_pid FROM jobs WHERE status = 'running'").fetchall()
+            for row in rows:
+                if row['worker_pid'] == os.getpid() or not _pid_alive(row['worker_pid']):
+                    conn.execute(
+                        "UPDATE jobs SET status = 'queued', worker_pid = NULL, started_at = NULL WHERE task_id = ?",
+                        (row['task_id'],))
+                    logger.info("Задание %s возвращено в очередь после перезапуска", row['task_id'])
+
+    def submit(self, task_id, payload, priority=0, dedup_key=None, group=None, group_limit=0, watch_id=None):
+        """Поставить задание в очередь.
+
+        Если в очереди или в работе уже есть задание с тем же `dedup_key`,
+        новое не создаётся, а к существующему присоединяется ещё один
+        клиент. Клиент получает присоединение с идентификатором `task_id`
+        (см. detach) и наблюдением `watch_id` (по умолчанию — фактическое
+        задание, см. watchers). Задания одной группы (`group`) выполняются
+        не более чем по `group_limit` одновременно. Возвращает (task_id
+        фактического задания, позиция в очереди: 1 — следующее, 0 — уже
+        выполняется).
+        """
+        job_id = self.submit_many([{
+            'task_id': task_id, 'payload': payload, 'priority': priority,
+            'dedup_key': dedup_key, 'group': group, 'group_limit': group_limit, 'watch_id': watch_id,
+        }])[0]
+        return job_id, self.position(job_id)
+
+    def submit_many(self, jobs):
+        """Поставить в очередь несколько заданий разом (все или ни одного).
+
+        Задание — словарь с ключами task_id и payload и необязательными
+        priority, dedup_key, group, group_limit, watch_id. Возвращает task_id
+        фактических заданий в том же порядке.
+        """
+        job_ids = []
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            queued = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+            now = time.time()
+            for job in jobs:
+                dedup_key = job.get('dedup_key')
+                existing = None
+                if dedup_key is not None:
+                    # Задание, от которого отсоединились все клиенты, отменяется —
+                    # к нему не присоединяемся
+                    existing = conn.execute('''
+                        SELECT task_id FROM jobs AS j WHERE dedup_key = ?
+                        AND EXISTS (SELECT 1 FROM attachments AS a WHERE a.task_id = j.task_id)
+                    ''', (dedup_key,)).fetchone()
+                if existing is not None:
+                    job_id = existing['task_id']
+                else:
+                    if queued >= self.max_queued:
+                        conn.execute('ROLLBACK')
+                        raise QueueFullError(queued)
+                    job_id = job['task_id']
+                    conn.execute('''
+                        INSERT INTO jobs (task_id, payload, priority, created_at, dedup_key, group_key, group_limit)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ''', (job_id, json.dumps(job['payload']), job.get('priority', 0), now, dedup_key,
+                          job.get('group'), job.get('group_limit', 0)))
+                    queued += 1
+                conn.execute('INSERT INTO attachments (attachment_id, task_id, watch_id) VALUES (?, ?, ?)',
+                             (job['task_id'], job_id, job.get('watch_id') or job_id))
+                job_ids.append(job_id)
+            conn.execute('COMMIT')
+        with self._wakeup:
+            self._wakeup.notify_all()
+        return job_ids
+
+    def detach(self, task_id, attachment_id):
+        """Отсоединить клиента `attachment_id` от задания.
+
+        Возвращает число оставшихся клиентов (0 — задание можно отменять)
+        или None, если такого присоединения нет (повторный вызов ничего не меняет).
+        """
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            removed = conn.execute('DELETE FROM attachments WHERE attachment_id = ? AND task_id = ?',
+                                   (attachment_id, task_id)).rowcount
+            remaining = conn.execute('SELECT COUNT(*) FROM attachments WHERE task_id = ?', (task_id,)).fetchone()[0]
+            conn.execute('COMMIT')
+            return remaining if removed else None
+
+    def watchers(self, task_id):
+        """Идентификаторы наблюдения присоединённых к заданию клиентов."""
+        with self._connect() as conn:
+            rows = conn.execute('SELECT DISTINCT watch_id FROM attachments WHERE task_id = ?', (task_id,))
+            return [row['watch_id'] for row in rows]
+
+    def cancel(self, task_id):
+        """Убрать из очереди ещё не начатое задание. Возвращает True, если оно было в очереди."""
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            removed = conn.execute("DELETE FROM jobs WHERE task_id = ? AND status = 'queued'", (task_id,)).rowcount
+            if removed:
+                conn.execute('DELETE FROM attachments WHERE task_id = ?', (task_id,))
+            conn.execute('COMMIT')
+            return removed > 0
+
+    def position(self, task_id):
+        """Позиция задания в очереди: 0 — уже выполняется или завершено, None — неизвестно."""
+        with self._connect() as conn:
+            job = conn.execute('SELECT status, priority, created_at FROM jobs WHERE task_id = ?',
+                               (task_id,)).fetchone()
+            if job is None:
+                return None
+            if job['status'] != 'queued':
+                return 0
+            ahead = conn.execute('''
+                SELECT COUNT(*) FROM jobs WHERE status = 'queued'
+                AND (priority > ? OR (priority = ? AND created_at < ?))
+            ''', (job['priority'], job['priority'], job['created_at'])).fetchone()[0]
+            return ahead + 1
+
+    def active_task_ids(self):
+        """Идентификаторы заданий, которые ждут в очереди или выполняются."""
+        with self._connect() as conn:
+            return {row['task_id'] for row in conn.execute('SELECT task_id FROM jobs')}
+
+    def stats(self):
+        """Количество заданий по статусам."""
+        with self._connect() as conn:
+            rows = conn.execute('SELECT status, COUNT(*) AS n FROM jobs GROUP BY status').fetchall()
+        return {row['status']: row['n'] for row in rows}
+
+    def _claim(self):
+        """Атомарно забрать следующее задание из очереди."""
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            if self.max_running:
+                running = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'running'").fetchone()[0]
+                if running >= self.max_running:
+                    conn.execute('ROLLBACK')
+                    return None
+            # Задания группы, у которой занят весь лимит одновременных, пропускаются
+            job = conn.execute('''
+                SELECT task_id, payload FROM jobs AS j WHERE status = 'queued'
+                AND (group_limit = 0 OR (
+                    SELECT COUNT(*) FROM jobs AS r WHERE r.group_key = j.group_key AND r.status = 'running'
+                ) < group_limit)
+                ORDER BY priority DESC, created_at LIMIT 1
+            ''').fetchone()
+            if job is None:
+                conn.execute('ROLLBACK')
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', worker_pid = ?, started_at = ? WHERE task_id = ?",
+                (os.getpid(), time.time(), job['task_id']))
+            conn.execute('COMMIT')
+            return job['task_id'], json.loads(job['payload'])
+
+    def _finish(self, task_id):
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('DELETE FROM jobs WHERE task_id = ?', (task_id,))
+            conn.execute('DELETE FROM attachments WHERE task_id = ?', (task_id,))
+            conn.execute('COMMIT')
+        # Освободилось место под общий предел — свободные воркеры проверяют очередь
+        with self._wakeup:
+            self._wakeup.notify_all()
+
+    def _worker(self):
+        while True:
+            try:
+                job = self._claim()
+            except sqlite3.Error as e:
+                logger.error("Ошибка очереди заданий: %s", e)
+                job = None
+            if job is None:
+                # Ждём сигнала о новом задании; таймаут нужен, чтобы
+                # подхватывать задания, поставленные другими процессами
+                with self._wakeup:
+                    self._wakeup.wait(self.poll_interval)
+                continue
+            task_id, payload = job
+            try:
+                # Записи лога, сделанные во время задания, помечаются его task_id
+                with log_context(task_id=task_id):
+                    self.handler(task_id, payload)
+            except Exception as e:
+                logger.exception("Необработанная ошибка задания %s: %s", task_id, e)
+            finally:
+                self._finish(task_id)
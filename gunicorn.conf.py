@@ -0,0 +1,27 @@
+import os
+
+# Настройки gunicorn (Procfile: gunicorn -c gunicorn.conf.py app:app).
+# Порт gunicorn берёт из переменной PORT сам.
+
+# gthread — пул потоков в каждом процессе: долгое извлечение информации
+# занимает один поток, а не весь процесс. Долгие ответы (поток прогресса,
+# потоковая отдача, ZIP) тоже держат поток, поэтому приложение отдаёт им
+# не больше половины потоков (MAX_LONG_REQUESTS), а поток прогресса
+# закрывается через SSE_MAX_LIFETIME — браузер переходит на опрос.
+# gevent (pip install gevent) — экспериментально и не проверялось: вызовы
+# SQLite и yt-dlp блокируют цикл событий и останавливают все соединения
+# процесса, поэтому по умолчанию и для продакшена — gthread.
+worker_class = os.getenv('WEB_WORKER_CLASS', 'gthread')
+workers = int(os.getenv('WEB_CONCURRENCY', 2))
+threads = int(os.getenv('WEB_THREADS', 64))
+worker_connections = int(os.getenv('WEB_WORKER_CONNECTIONS', 1000))
+
+# Для gthread и gevent timeout — время, за которое процесс должен подать
+# признак жизни, а не предельная длительность запроса
+timeout = int(os.getenv('WEB_TIMEOUT', 60))
+graceful_timeout = 30
+keepalive = 5
+
+# Очередь скачиваний и очистка хранилища запускаются при импорте
+# приложения в каждом процессе: с preload потоки остались бы в мастере
+preload_app = False
@@ -0,0 +1,195 @@
+import os
+import json
+import logging
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from urllib.parse import urlparse, parse_qs
+
+import yt_dlp
+
+logger = logging.getLogger(__name__)
+
+# Запас до истечения ссылок на форматы: кэшированная информация должна
+# оставаться пригодной для скачивания, которое начнётся чуть позже
+EXPIRE_MARGIN = 600
+
+
+@lru_cache(maxsize=4096)
+def canonical_video_id(url):
+    """Ключ видео вида 'Youtube:dQw4w9WgXcQ', определяемый по URL без сетевых запросов.
+
+    Разные формы ссылки на одно видео (youtu.be, watch?v=, shorts) дают один ключ.
+    Если экстрактор не умеет извлекать id из URL, ключом служит сам URL.
+    """
+    for ie in yt_dlp.extractor.gen_extractor_classes():
+        if ie.ie_key() == 'Generic' or not ie.suitable(url):
+            continue
+        try:
+            temp_id = ie.get_temp_id(url)
+        except Exception:
+            temp_id = None
+        if temp_id:
+            return f'{ie.ie_key()}:{temp_id}'
+        break
+    return url
+
+
+def formats_expire_at(info):
+    """Момент истечения самой «короткой» ссылки на формат (параметр expire), если он известен."""
+    expires = []
+    for f in info.get('formats') or []:
+        value = parse_qs(urlparse(f.get('url') or '').query).get('expire')
+        if value and value[0].isdigit():
+            expires.append(int(value[0]))
+    return min(expires) if expires else None
+
+
+class _Flight:
+    """Извлечение, выполняющееся прямо сейчас; остальные запросы ждут его результат."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class InfoCache:
+    """Кэш информации о видео: LRU в памяти плюс необязательный уровень на диске.
+
+    Время жизни записи ограничено сроком действия ссылок на форматы, а
+    одновременные запросы одного видео выполняют одно извлечение.
+    Возвращаемые словари общие для всех потоков — изменять их нельзя.
+    """
+
+    def __init__(self, max_entries=256, ttl=3600, disk_dir=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self._entries = OrderedDict()
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, hashlib.sha1(key.encode()).hexdigest() + '.json')
+
+    def _entry_ttl(self, info):
+        ttl = self.ttl
+        expire_at = formats_expire_at(info)
+        if expire_at is not None:
+            ttl = min(ttl, expire_at - time.time() - EXPIRE_MARGIN)
+        return ttl
+
+    def get(self, key):
+        """Информация о видео из кэша или None."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    return entry[1]
+                del self._entries[key]
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+            expires_at, info = data['expires_at'], data['info']
+            expired = expires_at <= now
+        except OSError:
+            return None
+        except (ValueError, KeyError, TypeError) as e:
+            # Повреждённый или чужой файл считается промахом и удаляется
+            logger.warning("Файл кэша информации о видео повреждён (%s): %s", type(e).__name__, path)
+            expired = True
+        if expired:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        self._remember(key, info, expires_at)
+        return info
+
+    def _remember(self, key, info, expires_at):
+        with self._lock:
+            self._entries[key] = (expires_at, info)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def put(self, key, info):
+        """Сохранить информацию (уже прошедшую YoutubeDL.sanitize_info)."""
+        ttl = self._entry_ttl(info)
+        if ttl <= 0:
+            return
+        expires_at = time.time() + ttl
+        self._remember(key, info, expires_at)
+        if self.disk_dir:
+            path = self._disk_path(key)
+            tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump({'expires_at': expires_at, 'info': info}, f, ensure_ascii=False)
+                os.replace(tmp_path, path)
+            except (OSError, TypeError, ValueError) as e:
+                logger.warning("Не удалось сохранить информацию о видео на диск: %s", e)
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+        if self.disk_dir:
+            try:
+                os.remove(self._disk_path(key))
+            except OSError:
+                pass
+
+    def get_or_extract(self, url, extract):
+        """Информация о видео из кэша; при промахе вызывает extract(url).
+
+        Если то же видео уже извлекается в другом потоке, ждёт его результат
+        вместо повторного извлечения. Возвращает (info, из_кэша).
+        """
+        key = canonical_video_id(url)
+        info = self.get(key)
+        if info is not None:
+            self.hits += 1
+            return info, True
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            self.hits += 1
+            return flight.result, True
+        self.misses += 1
+        try:
+            info = extract(url)
+            if info is not None:
+                info = yt_dlp.YoutubeDL.sanitize_info(info)
+                self.put(key, info)
+            flight.result = info
+            return info, False
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
@@ -0,0 +1,46 @@
+# Версия схемы ответа /api/info: увеличивается при несовместимых изменениях
+SCHEMA_VERSION = 1
+
+# Поля видео, которые использует страница
+VIDEO_FIELDS = (
+    'id', 'title', 'thumbnail', 'duration', 'upload_date', 'webpage_url', 'extractor',
+    'uploader', 'uploader_id', 'channel', 'channel_id', 'channel_follower_count',
+    'view_count', 'like_count',
+)
+
+FORMAT_FIELDS = (
+    'format_id', 'ext', 'format_note', 'filesize', 'filesize_approx',
+    'height', 'width', 'tbr', 'fps', 'acodec', 'vcodec',
+)
+
+FORMAT_EXTS = ('mp4', 'webm', 'm4a', 'mp3')
+
+
+def parse_fields(value):
+    """Набор полей из параметра ?fields=title,formats; None — все поля схемы."""
+    if not value:
+        return None
+    fields = {name.strip() for name in value.split(',') if name.strip()}
+    unknown = fields - set(VIDEO_FIELDS) - {'formats'}
+    if unknown:
+        raise ValueError(f"Неизвестные поля: {', '.join(sorted(unknown))}")
+    return fields
+
+
+def compact_formats(info):
+    return [
+        {name: f.get(name) for name in FORMAT_FIELDS}
+        for f in info.get('formats') or []
+        if f.get('ext') in FORMAT_EXTS
+    ]
+
+
+def compact_info(info, fields=None):
+    """Ответ /api/info по схеме: только нужные странице поля вместо полного info yt-dlp."""
+    result = {'schema_version': SCHEMA_VERSION}
+    for name in VIDEO_FIELDS:
+        if fields is None or name in fields:
+            result[name] = info.get(name)
+    if fields is None or 'formats' in fields:
+        result['formats'] = compact_formats(info)
+    return result
@@ -0,0 +1,158 @@
+import os
+import sys
+import json
+import queue
+import atexit
+import random
+import logging
+import logging.handlers
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# Поля контекста (task_id, request_id), добавляемые ко всем записям потока
+_context = contextvars.ContextVar('log_context', default={})
+
+# Пометка многословных записей: при LOG_VERBOSE_SAMPLE_RATE < 1 пишется
+# только их доля (ошибки и предупреждения не отбрасываются никогда)
+VERBOSE = {'verbose': True}
+
+# Стандартные атрибуты LogRecord — всё остальное считается полями записи
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime', 'verbose'}
+
+_listener = None
+_setup_lock = threading.Lock()
+
+
+def bind_context(**fields):
+    """Добавить поля к записям текущего потока; возвращает токен для reset_context()."""
+    return _context.set(dict(_context.get(), **fields))
+
+
+def reset_context(token):
+    _context.reset(token)
+
+
+@contextmanager
+def log_context(**fields):
+    """Поля контекста на время блока with (например, task_id скачивания)."""
+    token = bind_context(**fields)
+    try:
+        yield
+    finally:
+        reset_context(token)
+
+
+class _ContextFilter(logging.Filter):
+    """Переносит поля контекста в запись в момент вызова, пока поток ещё тот же."""
+
+    def filter(self, record):
+        for key, value in _context.get().items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        return True
+
+
+class _SamplingFilter(logging.Filter):
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if not getattr(record, 'verbose', False) or record.levelno >= logging.WARNING:
+            return True
+        return self.rate >= 1 or random.random() < self.rate
+
+
+def _fields(record):
+    return {key: value for key, value in vars(record).items() if key not in _RECORD_ATTRS}
+
+
+class JsonFormatter(logging.Formatter):
+    """Запись одной строкой JSON: время, уровень, логгер, сообщение и поля контекста."""
+
+    def format(self, record):
+        data = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        data.update(_fields(record))
+        if record.exc_info:
+            data['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Читаемый формат для консоли: поля контекста в конце строки."""
+
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    def format(self, record):
+        line = super().format(record)
+        fields = _fields(record)
+        if fields:
+            line += ' ' + ' '.join(f'{key}={value}' for key, value in fields.items())
+        return line
+
+
+def setup_logging(level=None, fmt=None, sample_rate=None):
+    """Настроить корневой логгер (повторные вызовы только меняют уровень).
+
+    Записи кладутся в очередь и пишутся в stderr отдельным потоком, так
+    что вывод лога не задерживает обработку запросов и интерфейс.
+    По умолчанию настройки берутся из LOG_LEVEL (INFO), LOG_FORMAT
+    (text или json) и LOG_VERBOSE_SAMPLE_RATE (1).
+    """
+    global _listener
+    level = (level or os.getenv('LOG_LEVEL', 'INFO')).upper()
+    root = logging.getLogger()
+    with _setup_lock:
+        root.setLevel(level)
+        if _listener is not None:
+            return
+        fmt = fmt or os.getenv('LOG_FORMAT', 'text')
+        if sample_rate is None:
+            sample_rate = float(os.getenv('LOG_VERBOSE_SAMPLE_RATE', 1))
+
+        output = logging.StreamHandler(sys.stderr)
+        output.setFormatter(JsonFormatter() if fmt == 'json' else TextFormatter())
+        records = queue.SimpleQueue()
+        # Фильтры выполняются в вызывающем потоке: поля контекста попадают
+        # в запись до передачи в поток вывода
+        handler = logging.handlers.QueueHandler(records)
+        handler.addFilter(_ContextFilter())
+        handler.addFilter(_SamplingFilter(sample_rate))
+        for existing in root.handlers[:]:
+            root.removeHandler(existing)
+        root.addHandler(handler)
+        _listener = logging.handlers.QueueListener(records, output, respect_handler_level=True)
+        _listener.start()
+        # Дописать оставшиеся в очереди записи при выходе
+        atexit.register(_listener.stop)
+
+
+class YdlLogger:
+    """Логгер для параметра `logger` yt-dlp: его вывод идёт в logging, а не в stdout.
+
+    Обычные сообщения yt-dlp (в том числе строки прогресса) пишутся на
+    уровне DEBUG как многословные.
+    """
+
+    def __init__(self, name='yt_dlp'):
+        self.logger = logging.getLogger(name)
+
+    def debug(self, message):
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(message.removeprefix('[debug] '), extra=VERBOSE)
+
+    def info(self, message):
+        self.logger.info(message)
+
+    def warning(self, message):
+        self.logger.warning(message.removeprefix('WARNING: '))
+
+    def error(self, message):
+        self.logger.error(message.removeprefix('ERROR: '))
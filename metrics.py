@@ -0,0 +1,296 @@
+import os
+import json
+import logging
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм длительности, секунды
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labels)
+
+    def samples(self):
+        with self._lock:
+            return {key: self._copy(value) for key, value in self._values.items()}
+
+    def _copy(self, value):
+        return value
+
+
+class Counter(_Metric):
+    """Монотонно растущий счётчик."""
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """Текущее значение, которое может как расти, так и уменьшаться."""
+
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    """Распределение значений по корзинам (плюс сумма и количество)."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Замерить длительность блока with (в том числе завершившегося ошибкой)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _copy(self, value):
+        return [list(value[0]), value[1], value[2]]
+
+
+class _Callback(_Metric):
+    """Метрика, значения которой вычисляются функцией в момент сбора."""
+
+    def __init__(self, kind, name, help, labels, func):
+        super().__init__(name, help, labels)
+        self.kind = kind
+        self.func = func
+
+    def samples(self):
+        values = self.func()
+        if not isinstance(values, dict):
+            return {(): values}
+        return {tuple(str(v) for v in (key if isinstance(key, tuple) else (key,))): value
+                for key, value in values.items()}
+
+
+class MetricsRegistry:
+    """Метрики процесса и их выдача в текстовом формате Prometheus.
+
+    Под gunicorn каждый процесс считает свои метрики, а /metrics попадает
+    в случайный процесс. Поэтому процессы раз в `flush_interval` секунд
+    сохраняют снимок своих значений в `directory`, и выдача складывает
+    значения всех живых процессов. Метрики общего состояния (очередь в
+    SQLite, хранилище) регистрируются через collector() и вычисляются
+    один раз при сборе, без сложения.
+    """
+
+    def __init__(self, directory=None, flush_interval=5.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+        self._started = False
+
+    def _register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f'Метрика {metric.name} уже зарегистрирована')
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self._register(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=()):
+        return self._register(Gauge(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DURATION_BUCKETS):
+        return self._register(Histogram(name, help, labels, buckets))
+
+    def counter_func(self, name, help, func, labels=()):
+        """Счётчик процесса, значение которого возвращает func() ({значения меток: число} или число)."""
+        return self._register(_Callback('counter', name, help, labels, func))
+
+    def gauge_func(self, name, help, func, labels=()):
+        return self._register(_Callback('gauge', name, help, labels, func))
+
+    def collector(self, func):
+        """Метрики общего для всех процессов состояния.
+
+        func() возвращает список (имя, тип, описание, метки-словарь, значение).
+        """
+        self._collectors.append(func)
+
+    def snapshot(self):
+        snapshot = {}
+        for metric in list(self._metrics.values()):
+            try:
+                samples = metric.samples()
+            except Exception as e:
+                logger.warning("Не удалось собрать метрику %s: %s", metric.name, e)
+                continue
+            snapshot[metric.name] = {
+                'kind': metric.kind,
+                'help': metric.help,
+                'labels': list(metric.labels),
+                'buckets': list(getattr(metric, 'buckets', ())),
+                'samples': [[list(key), value] for key, value in samples.items()],
+            }
+        return snapshot
+
+    def _snapshot_path(self, pid):
+        return os.path.join(self.directory, f'{pid}.json')
+
+    def flush(self):
+        """Сохранить снимок метрик процесса для остальных процессов."""
+        path = self._snapshot_path(os.getpid())
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp_path, path)
+
+    def start(self):
+        """Фоновое сохранение снимков (только если задан каталог; повторные вызовы игнорируются)."""
+        if not self.directory or self._started:
+            return
+        self._started = True
+        os.makedirs(self.directory, exist_ok=True)
+        threading.Thread(target=self._flusher, name='metrics-flusher', daemon=True).start()
+
+    def _flusher(self):
+        while True:
+            try:
+                self.flush()
+            except (OSError, TypeError, ValueError) as e:
+                logger.warning("Не удалось сохранить метрики: %s", e)
+            time.sleep(self.flush_interval)
+
+    def _other_snapshots(self):
+        """Снимки остальных процессов; давно не обновлявшиеся (процесс завершился) удаляются."""
+        if not self._started:
+            return []
+        snapshots = []
+        own = f'{os.getpid()}.json'
+        stale = time.time() - self.flush_interval * 3
+        for name in os.listdir(self.directory):
+            if name == own or not name.endswith('.json'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) < stale:
+                    os.remove(path)
+                    continue
+                with open(path, encoding='utf-8') as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    def render(self):
+        """Метрики всех процессов в текстовом формате Prometheus."""
+        merged = {}
+        for snapshot in [self.snapshot()] + self._other_snapshots():
+            for name, metric in snapshot.items():
+                target = merged.setdefault(name, dict(metric, samples={}))
+                if metric['buckets'] != target['buckets']:
+                    continue
+                for key, value in metric['samples']:
+                    key = tuple(key)
+                    current = target['samples'].get(key)
+                    if current is None:
+                        target['samples'][key] = value
+                    elif metric['kind'] == 'histogram':
+                        target['samples'][key] = [[a + b for a, b in zip(current[0], value[0])],
+                                                  current[1] + value[1], current[2] + value[2]]
+                    else:
+                        target['samples'][key] = current + value
+
+        lines = []
+        for name, metric in merged.items():
+            lines.append(f"# HELP {name} {metric['help']}")
+            lines.append(f"# TYPE {name} {metric['kind']}")
+            for key, value in sorted(metric['samples'].items()):
+                if metric['kind'] == 'histogram':
+                    cumulative = 0
+                    bounds = metric['buckets'] + [float('inf')]
+                    for bound, count in zip(bounds, value[0]):
+                        cumulative += count
+                        labels = _format_labels(metric['labels'], key, [('le', _format_value(float(bound)))])
+                        lines.append(f'{name}_bucket{labels} {cumulative}')
+                    labels = _format_labels(metric['labels'], key)
+                    lines.append(f'{name}_sum{labels} {_format_value(value[1])}')
+                    lines.append(f'{name}_count{labels} {value[2]}')
+                else:
+                    lines.append(f"{name}{_format_labels(metric['labels'], key)} {_format_value(value)}")
+
+        grouped = {}
+        for collect in self._collectors:
+            try:
+                for name, kind, help, labels, value in collect():
+                    grouped.setdefault(name, (kind, help, []))[2].append((labels, value))
+            except Exception as e:
+                logger.warning("Не удалось собрать метрики: %s", e)
+        for name, (kind, help, samples) in grouped.items():
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in samples:
+                lines.append(f'{name}{_format_labels(labels.keys(), labels.values())} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
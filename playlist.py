@@ -0,0 +1,116 @@
+import io
+import logging
+import zipfile
+
+logger = logging.getLogger(__name__)
+
+# Вкладки канала и вложенные плейлисты разворачиваются не глубже
+MAX_NESTING = 2
+ZIP_CHUNK_SIZE = 256 * 1024
+
+
+def _is_nested(entry):
+    return entry.get('_type') == 'playlist' or entry.get('ie_key') == 'YoutubeTab'
+
+
+def _collect(ydl, info, entries, limit, depth):
+    for entry in info.get('entries') or []:
+        if len(entries) >= limit:
+            return
+        if not entry:
+            # Недоступное видео (ignoreerrors)
+            continue
+        if _is_nested(entry):
+            if depth >= MAX_NESTING:
+                # Глубже не разворачиваем, но и как одно видео не ставим
+                logger.warning("Вложенный плейлист пропущен (глубина больше %d): %s",
+                               MAX_NESTING, entry.get('webpage_url') or entry.get('url'))
+                continue
+            nested = entry if entry.get('entries') is not None else ydl.extract_info(entry['url'], download=False)
+            if nested:
+                _collect(ydl, nested, entries, limit, depth + 1)
+            continue
+        url = entry.get('webpage_url') or entry.get('url')
+        if not url:
+            continue
+        entries.append({'index': len(entries) + 1, 'url': url, 'title': entry.get('title') or url})
+
+
+def extract_entries(ydl, url, limit):
+    """Плоский список видео плейлиста или канала без извлечения каждого видео.
+
+    ydl должен быть создан с extract_flat='in_playlist'. Возвращает
+    (название, [{'index', 'url', 'title'}, ...]), не больше limit видео.
+    """
+    info = ydl.extract_info(url, download=False)
+    if not info:
+        return None, []
+    entries = []
+    _collect(ydl, info, entries, limit, 0)
+    return info.get('title'), entries
+
+
+def summarize(states):
+    """Сводный прогресс по состояниям заданий элементов плейлиста."""
+    counts = {'finished': 0, 'error': 0, 'cancelled': 0, 'queued': 0, 'downloading': 0}
+    total_progress = 0.0
+    for state in states:
+        status = state.get('status')
+        counts[status if status in counts else 'downloading'] += 1
+        total_progress += 100.0 if status in ('finished', 'error', 'cancelled') else state.get('progress') or 0.0
+    total = len(states)
+    done = counts['finished'] + counts['error'] + counts['cancelled']
+    return {
+        'total': total,
+        'finished': counts['finished'],
+        'failed': counts['error'],
+        'cancelled': counts['cancelled'],
+        'queued': counts['queued'],
+        'downloading': counts['downloading'],
+        'progress': total_progress / total if total else 100.0,
+        'status': 'finished' if done == total else 'downloading',
+    }
+
+
+class _ZipSink(io.RawIOBase):
+    """Приёмник архива: копит записанные байты до отправки клиенту."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def iter_zip(files):
+    """ZIP-архив, отдаваемый по частям по мере поступления файлов.
+
+    files — итератор пар (имя в архиве, путь); файлы добавляются без сжатия
+    (видео уже сжато), архив не собирается целиком ни в памяти, ни на диске.
+    """
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for arcname, path in files:
+            try:
+                src = open(path, 'rb')
+            except OSError as e:
+                logger.warning("Файл пропущен в архиве: %s", e)
+                continue
+            with src, archive.open(arcname, 'w', force_zip64=True) as dst:
+                while True:
+                    chunk = src.read(ZIP_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+                    yield sink.drain()
+            yield sink.drain()
+    yield sink.drain()
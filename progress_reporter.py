@@ -0,0 +1,126 @@
+import time
+
+from yt_dlp.utils import DownloadCancelled
+
+
+class ProgressReporter:
+    """Хуки прогресса yt-dlp, записывающие состояние задания в хранилище.
+
+    yt-dlp вызывает progress hook на каждый записанный блок, поэтому
+    обновления объединяются и пишутся не чаще раза в `interval` секунд;
+    смена фазы или статуса записывается сразу.
+
+    Хуки же прерывают скачивание (DownloadCancelled), если задание отменили
+    или ни один клиент не обращался к `watch_ids` дольше `idle_timeout` секунд.
+    `watch_ids` — список или функция, возвращающая список: клиенты могут
+    присоединяться к заданию и отсоединяться от него во время скачивания.
+    """
+
+    def __init__(self, task_id, store, interval=0.5, idle_timeout=0, watch_ids=None):
+        self.task_id = task_id
+        self.store = store
+        self.interval = interval
+        self.idle_timeout = idle_timeout
+        self.watch_ids = watch_ids or [task_id]
+        self.cancelled = None
+        self._last_check = 0.0
+        self._last_write = 0.0
+        self._last_key = None
+        # Для форматов вида video+audio yt-dlp качает потоки по очереди;
+        # общий прогресс считаем с весами по размерам потоков
+        self._weights = None
+        self._stream = 0
+
+    def _stream_weights(self, info):
+        formats = info.get('requested_formats') or [info]
+        sizes = [f.get('filesize') or f.get('filesize_approx') for f in formats]
+        if all(sizes):
+            total = sum(sizes)
+            return [size / total for size in sizes]
+        return [1 / len(formats)] * len(formats)
+
+    def _overall(self, fraction):
+        done = sum(self._weights[:self._stream])
+        weight = self._weights[self._stream] if self._stream < len(self._weights) else 0
+        return round(min((done + weight * fraction) * 100, 100.0), 2)
+
+    def _write(self, force, **fields):
+        now = time.monotonic()
+        key = (fields.get('phase'), fields.get('status'))
+        if not force and key == self._last_key and now - self._last_write < self.interval:
+            return
+        self._last_write = now
+        self._last_key = key
+        self.store.update(self.task_id, **fields)
+
+    def check_cancelled(self):
+        """Поднять DownloadCancelled, если скачивание пора прервать.
+
+        Флаг отмены может поставить другой процесс gunicorn, поэтому он
+        читается из хранилища — не чаще раза в `interval` секунд.
+        """
+        now = time.monotonic()
+        if self.cancelled is None and now - self._last_check >= self.interval:
+            self._last_check = now
+            state = self.store.get(self.task_id) or {}
+            if state.get('cancel_requested'):
+                self.cancelled = 'Скачивание отменено'
+            elif self.idle_timeout:
+                watch_ids = self.watch_ids() if callable(self.watch_ids) else self.watch_ids
+                seen = [t for t in map(self.store.last_seen, watch_ids or [self.task_id]) if t is not None]
+                if seen and time.time() - max(seen) > self.idle_timeout:
+                    self.cancelled = 'Скачивание отменено: прогресс давно никто не запрашивал'
+        if self.cancelled is not None:
+            raise DownloadCancelled(self.cancelled)
+
+    def progress_hook(self, d):
+        self.check_cancelled()
+        status = d.get('status')
+        if self._weights is None:
+            self._weights = self._stream_weights(d.get('info_dict') or {})
+        if status == 'downloading':
+            downloaded = d.get('downloaded_bytes') or 0
+            total = d.get('total_bytes')
+            estimated = total is None
+            if estimated:
+                total = d.get('total_bytes_estimate')
+            fraction = min(downloaded / total, 1.0) if total else 0.0
+            self._write(
+                False,
+                status='downloading',
+                phase='download',
+                progress=self._overall(fraction),
+                stream_index=self._stream + 1,
+                stream_count=len(self._weights),
+                downloaded_bytes=downloaded,
+                total_bytes=int(total) if total else None,
+                total_is_estimate=estimated,
+                speed=d.get('speed'),
+                eta=d.get('eta'),
+                fragment_index=d.get('fragment_index'),
+                fragment_count=d.get('fragment_count'),
+            )
+        elif status == 'finished':
+            total = d.get('total_bytes') or d.get('downloaded_bytes')
+            progress = self._overall(1.0)
+            self._stream += 1
+            self._write(
+                True,
+                status='downloading',
+                phase='download',
+                progress=progress,
+                downloaded_bytes=total,
+                total_bytes=total,
+                total_is_estimate=False,
+                speed=None,
+                eta=0,
+            )
+
+    def postprocessor_hook(self, d):
+        # Merger склеивает видео и аудио, остальные постпроцессоры
+        # (конвертация, перемещение файлов) считаем общей фазой обработки
+        phase = 'merge' if d.get('postprocessor') == 'Merger' else 'postprocess'
+        if d.get('status') == 'started':
+            # До запуска ffmpeg, чтобы отменённое задание не склеивалось
+            self.check_cancelled()
+            self._write(True, status='downloading', phase=phase, postprocessor=d.get('postprocessor'))
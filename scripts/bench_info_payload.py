@@ -0,0 +1,92 @@
+"""Размер ответа /api/info и время его сжатия: полный info yt-dlp против compact_info.
+
+    python scripts/bench_info_payload.py [info.json]
+
+info.json — дамп `yt-dlp -J <url>`; без него используется синтетический
+info, по составу похожий на ответ для ролика YouTube (форматы с длинными
+URL, раскадровки с фрагментами, автосубтитры на сотнях языков, heatmap).
+"""
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compression import _encode, brotli  # noqa: E402
+from info_schema import compact_info  # noqa: E402
+
+ROUNDS = 50
+
+
+def _url(rnd, host):
+    query = '&'.join(f'{rnd.choice("abcdefghijklmnop")}{i}={rnd.getrandbits(64):x}' for i in range(40))
+    return f'https://{host}/videoplayback?{query}'
+
+
+def synthetic_info(seed=1):
+    rnd = random.Random(seed)
+    headers = {'User-Agent': 'Mozilla/5.0', 'Accept': '*/*', 'Accept-Language': 'en-us,en;q=0.5'}
+    formats = []
+    for i in range(4):
+        formats.append({
+            'format_id': f'sb{i}', 'ext': 'mhtml', 'protocol': 'mhtml', 'format_note': 'storyboard',
+            'url': _url(rnd, 'i.ytimg.com'), 'http_headers': headers,
+            'fragments': [{'url': _url(rnd, 'i.ytimg.com'), 'duration': 10.0} for _ in range(60)],
+        })
+    for i, (height, ext) in enumerate([(h, e) for h in (144, 240, 360, 480, 720, 1080, 1440, 2160)
+                                       for e in ('mp4', 'webm')] + [(None, 'm4a'), (None, 'webm')] * 3):
+        formats.append({
+            'format_id': str(100 + i), 'ext': ext, 'format_note': f'{height}p' if height else 'medium',
+            'url': _url(rnd, 'rr1---sn-abc.googlevideo.com'), 'http_headers': headers,
+            'filesize': rnd.randint(10 ** 6, 10 ** 9), 'filesize_approx': None, 'tbr': rnd.uniform(50, 9000),
+            'height': height, 'width': height and height * 16 // 9, 'fps': 30 if height else None,
+            'vcodec': 'avc1.640028' if height else 'none', 'acodec': 'none' if height else 'mp4a.40.2',
+            'asr': None if height else 44100, 'audio_channels': None if height else 2,
+            'container': f'{ext}_dash', 'protocol': 'https', 'downloader_options': {'http_chunk_size': 10485760},
+            'format': f'{100 + i} - {height}p', 'resolution': f'{height}p' if height else 'audio only',
+            'dynamic_range': 'SDR', 'language': None, 'quality': float(i), 'has_drm': False,
+        })
+    captions = {
+        f'lang{n}': [{'ext': ext, 'url': _url(rnd, 'www.youtube.com'), 'name': f'Language {n}'}
+                     for ext in ('json3', 'srv1', 'srv2', 'srv3', 'ttml', 'vtt')]
+        for n in range(160)
+    }
+    return {
+        'id': 'dQw4w9WgXcQ', 'title': 'Synthetic video', 'description': 'Lorem ipsum dolor sit amet. ' * 80,
+        'thumbnail': 'https://i.ytimg.com/vi/dQw4w9WgXcQ/maxresdefault.jpg', 'duration': 600,
+        'upload_date': '20240101', 'webpage_url': 'https://www.youtube.com/watch?v=dQw4w9WgXcQ',
+        'extractor': 'youtube', 'uploader': 'Uploader', 'uploader_id': '@uploader', 'channel': 'Channel',
+        'channel_id': 'UC' + 'x' * 22, 'channel_follower_count': 12345, 'view_count': 1000000,
+        'like_count': 10000, 'tags': [f'tag{n}' for n in range(30)], 'categories': ['Music'],
+        'formats': formats, 'automatic_captions': captions, 'subtitles': {},
+        'thumbnails': [{'url': _url(rnd, 'i.ytimg.com'), 'preference': -n, 'id': str(n)} for n in range(42)],
+        'heatmap': [{'start_time': n * 6.0, 'end_time': n * 6.0 + 6, 'value': rnd.random()} for n in range(100)],
+        'chapters': None, 'http_headers': headers,
+    }
+
+
+def measure(name, payload):
+    data = json.dumps(payload).encode()
+    print(f'{name}: {len(data) / 1024:.1f} КиБ')
+    for encoding in ('gzip', 'br') if brotli else ('gzip',):
+        start = time.perf_counter()
+        for _ in range(ROUNDS):
+            encoded = _encode(data, encoding)
+        elapsed = (time.perf_counter() - start) / ROUNDS
+        print(f'  {encoding}: {len(encoded) / 1024:.1f} КиБ, {elapsed * 1000:.2f} мс на ответ')
+
+
+def main():
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], encoding='utf-8') as f:
+            info = json.load(f)
+    else:
+        info = synthetic_info()
+    measure('полный info', info)
+    measure('compact_info', compact_info(info))
+
+
+if __name__ == '__main__':
+    main()
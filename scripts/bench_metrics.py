@@ -0,0 +1,70 @@
+"""Накладные расходы метрик: стоимость inc/observe и записи метрик одного запроса.
+
+    python scripts/bench_metrics.py [вызовов]
+
+Запрос записывает три значения (как record_request_metrics в app.py):
+длительность в гистограмму, счётчик запросов и счётчик байт. Замер
+выполняется в одном потоке и в 8 потоках, которые делят одни метрики.
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metrics import MetricsRegistry  # noqa: E402
+
+THREADS = 8
+
+
+def run(calls, func, threads=1):
+    """Среднее время одного вызова func, микросекунды."""
+    per_thread = calls // threads
+    barrier = threading.Barrier(threads + 1)
+
+    def worker():
+        barrier.wait()
+        for _ in range(per_thread):
+            func()
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in workers:
+        thread.join()
+    return (time.perf_counter() - start) / (per_thread * threads) * 1e6
+
+
+def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    registry = MetricsRegistry(tempfile.mkdtemp())
+    requests = registry.counter('requests_total', 'Запросы', ['endpoint', 'status'])
+    duration = registry.histogram('request_duration_seconds', 'Длительность', ['endpoint'])
+    response_bytes = registry.counter('response_bytes_total', 'Байты', ['endpoint'])
+
+    def request():
+        duration.observe(0.012, endpoint='get_progress')
+        requests.inc(endpoint='get_progress', status=200)
+        response_bytes.inc(512, endpoint='get_progress')
+
+    cases = [
+        ('Counter.inc', lambda: requests.inc(endpoint='get_progress', status=200)),
+        ('Histogram.observe', lambda: duration.observe(0.012, endpoint='get_progress')),
+        ('метрики одного запроса', request),
+    ]
+    for name, func in cases:
+        single = run(calls, func)
+        shared = run(calls, func, THREADS)
+        print(f'{name}: {single:.2f} мкс в одном потоке, {shared:.2f} мкс в {THREADS} потоках')
+
+    start = time.perf_counter()
+    text = registry.render()
+    print(f'render: {(time.perf_counter() - start) * 1000:.2f} мс, {len(text)} байт')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""Задержка получения YoutubeDL: новый экземпляр на каждый вызов против пула.
+
+    python scripts/bench_ydl_pool.py [раундов]
+
+Каждый вызов берёт экземпляр с настройками /api/info, загружает экстрактор
+YouTube и делает один HTTP-запрос к локальному серверу keep-alive (сеть не
+нужна). Сервер считает принятые TCP-соединения: новый экземпляр каждый раз
+открывает своё, экземпляр из пула переиспользует.
+"""
+import http.server
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import yt_dlp  # noqa: E402
+
+from ydl_pool import YoutubeDLPool  # noqa: E402
+
+PARAMS = {
+    'quiet': True,
+    'no_warnings': True,
+    'extract_flat': False,
+    'format': 'best',
+    'nocheckcertificate': True,
+    'ignoreerrors': True,
+    'socket_timeout': 30,
+}
+
+
+class _Server(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+    connections = 0
+
+    def process_request(self, request, client_address):
+        self.connections += 1
+        super().process_request(request, client_address)
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Заголовки и тело уходят отдельными записями: без этого keep-alive
+    # упирается в задержку ACK (~40 мс) и замер теряет смысл
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        body = b'{}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def _use(ydl, url):
+    ydl.get_info_extractor('Youtube')
+    ydl.urlopen(url).read()
+
+
+def measure(name, server, url, rounds, call):
+    server.connections = 0
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        call()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    print(f'{name}: медиана {timings[len(timings) // 2] * 1000:.2f} мс, '
+          f'p95 {timings[int(len(timings) * 0.95)] * 1000:.2f} мс, TCP-соединений {server.connections}')
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    server = _Server(('127.0.0.1', 0), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}/'
+
+    def per_call():
+        with yt_dlp.YoutubeDL(dict(PARAMS)) as ydl:
+            _use(ydl, url)
+
+    pool = YoutubeDLPool(PARAMS, size=1)
+
+    def pooled():
+        with pool.acquire() as ydl:
+            _use(ydl, url)
+
+    # Прогрев: импорт экстракторов и первый экземпляр пула не входят в замер
+    per_call()
+    pooled()
+    try:
+        measure('новый YoutubeDL на вызов', server, url, rounds, per_call)
+        measure('YoutubeDL из пула', server, url, rounds, pooled)
+    finally:
+        pool.close()
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
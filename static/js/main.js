@@ -16,6 +16,12 @@ document.addEventListener('DOMContentLoaded', function() {
             const submitButton = searchForm.querySelector('button[type="submit"]');
             submitButton.disabled = true;
             submitButton.innerHTML = '<span class="spinner-border spinner-border-sm" role="status" aria-hidden="true"></span> Поиск...';
+            if (isPlaylistUrl(videoUrl)) {
+                await startPlaylist(videoUrl);
+                submitButton.disabled = false;
+                submitButton.innerHTML = 'Поиск';
+                return;
+            }
             try {
                 const response = await fetch('/api/info', {
                     method: 'POST',
@@ -40,6 +46,60 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
 
+    // Плейлист или канал (ссылка на отдельное видео из плейлиста сюда не относится)
+    function isPlaylistUrl(url) {
+        return (/[?&]list=/.test(url) && !/[?&]v=/.test(url)) || /youtube\.com\/(@|channel\/|c\/|user\/)/.test(url);
+    }
+
+    async function startPlaylist(url) {
+        try {
+            const response = await fetch('/api/playlist', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ url: url })
+            });
+            const data = await response.json();
+            if (!response.ok) {
+                videoInfoDiv.innerHTML = `<div class="alert alert-${response.status === 429 ? 'warning' : 'danger'}">${data.error}</div>`;
+                return;
+            }
+            videoInfoDiv.innerHTML = `<h3 class='mb-3'>${data.title || 'Плейлист'}</h3>
+                <div class='progress mb-2' style='height: 28px;'>
+                    <div class='progress-bar progress-bar-striped progress-bar-animated bg-success' role='progressbar' style='width: 0%'>0.00%</div>
+                </div>
+                <div id='playlistStatus' class='mb-3'></div>
+                <a class='btn btn-success' href='/api/playlist/${data.playlist_id}/archive'>⬇ Скачать архив</a>
+                <ul id='playlistItems' class='list-group mt-3'></ul>`;
+            trackPlaylist(data.playlist_id);
+        } catch (error) {
+            videoInfoDiv.innerHTML = `<div class="alert alert-danger">Произошла ошибка при получении плейлиста</div>`;
+        }
+    }
+
+    async function trackPlaylist(playlistId) {
+        const progressBar = videoInfoDiv.querySelector('.progress-bar');
+        const statusDiv = document.getElementById('playlistStatus');
+        const itemsList = document.getElementById('playlistItems');
+        const icons = { finished: '✅', error: '❌', cancelled: '⏹', queued: '⏳', downloading: '⬇' };
+        while (true) {
+            const resp = await fetch(`/api/playlist/${playlistId}`);
+            const data = await resp.json();
+            if (!resp.ok) {
+                statusDiv.innerHTML = `<div class="alert alert-danger">${data.error}</div>`;
+                return;
+            }
+            progressBar.style.width = data.progress.toFixed(2) + '%';
+            progressBar.innerText = data.progress.toFixed(2) + '%';
+            statusDiv.innerText = `Готово ${data.finished} из ${data.total}` + (data.failed ? `, ошибок: ${data.failed}` : '')
+                + (data.cancelled ? `, отменено: ${data.cancelled}` : '');
+            itemsList.innerHTML = data.items.map(item => `<li class='list-group-item'>
+                ${icons[item.status] || '⬇'} ${item.file_url ? `<a href='${item.file_url}'>${item.title}</a>` : item.title}
+            </li>`).join('');
+            if (data.status === 'finished') return;
+            await new Promise(r => setTimeout(r, 2000));
+        }
+    }
+
     function renderVideoInfo(data) {
         // Фильтруем только mp4 и сортируем по убыванию разрешения
         const mp4Formats = (data.formats || [])
@@ -121,6 +181,7 @@ document.addEventListener('DOMContentLoaded', function() {
             <div class='progress' style='height: 28px;'>
                 <div class='progress-bar progress-bar-striped progress-bar-animated bg-success' role='progressbar' style='width: 0%'>0.00%</div>
             </div>
+            <button id='cancelDownload' class='btn btn-outline-secondary btn-sm mt-2' style='display:none;'>Отменить</button>
         </div>`;
         videoInfoDiv.innerHTML = html;
         document.querySelectorAll('.download-btn').forEach(btn => {
@@ -142,15 +203,33 @@ document.addEventListener('DOMContentLoaded', function() {
         progressBarWrap.style.display = 'block';
         progressBar.style.width = '0%';
         progressBar.innerText = '0.00%';
+        // Однофайловые форматы (видео со звуком) сервер может отдать потоком сразу
+        const format = currentFormats.find(f => f.format_id === formatId);
+        const progressive = format && format.vcodec && format.vcodec !== 'none' && format.acodec && format.acodec !== 'none';
         try {
             const response = await fetch('/api/download', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ url: currentUrl, format_id: formatId })
+                body: JSON.stringify({ url: currentUrl, format_id: formatId, mode: progressive ? 'stream' : 'queue' })
             });
             const data = await response.json();
-            if (response.ok && data.task_id) {
-                await pollProgress(data.task_id);
+            if (response.ok && data.stream_url) {
+                saveFile(data.stream_url);
+                resultDiv.innerHTML = `<div class="alert alert-success">Скачивание началось</div>`;
+                progressBarWrap.style.display = 'none';
+            } else if (response.ok && data.task_id) {
+                const cancelButton = document.getElementById('cancelDownload');
+                cancelButton.style.display = 'inline-block';
+                cancelButton.disabled = false;
+                cancelButton.onclick = () => {
+                    cancelButton.disabled = true;
+                    fetch(`/api/download/${data.task_id}?attachment_id=${encodeURIComponent(data.attachment_id)}`, { method: 'DELETE' });
+                };
+                await trackProgress(data.task_id);
+                cancelButton.style.display = 'none';
+            } else if (response.status === 429) {
+                resultDiv.innerHTML = `<div class="alert alert-warning">${data.error || 'Сервер перегружен, попробуйте позже'}</div>`;
+                progressBarWrap.style.display = 'none';
             } else {
                 resultDiv.innerHTML = `<div class="alert alert-danger">${data.error || 'Ошибка при запуске скачивания'}</div>`;
                 progressBarWrap.style.display = 'none';
@@ -161,39 +240,109 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
 
-    async function pollProgress(taskId) {
+    function saveFile(url) {
+        const a = document.createElement('a');
+        a.href = url;
+        a.download = '';
+        document.body.appendChild(a);
+        a.click();
+        document.body.removeChild(a);
+    }
+
+    function formatBytes(bytes) {
+        if (!bytes) return '0 B';
+        const units = ['B', 'KB', 'MB', 'GB'];
+        let i = 0;
+        while (bytes >= 1024 && i < units.length - 1) {
+            bytes /= 1024;
+            i++;
+        }
+        return `${bytes.toFixed(i ? 1 : 0)} ${units[i]}`;
+    }
+
+    function formatProgressLabel(data, prog) {
+        if (data.phase === 'merge') return 'Склейка видео и аудио...';
+        if (data.phase === 'postprocess') return 'Обработка файла...';
+        let label = prog.toFixed(2) + '%';
+        if (data.downloaded_bytes && data.total_bytes) {
+            label += ` · ${formatBytes(data.downloaded_bytes)} / ${data.total_is_estimate ? '~' : ''}${formatBytes(data.total_bytes)}`;
+        }
+        if (data.speed) label += ` · ${formatBytes(data.speed)}/s`;
+        if (data.eta) label += ` · ${formatDuration(Math.round(data.eta))}`;
+        return label;
+    }
+
+    // Возвращает обработчик состояния задания; обработчик возвращает true,
+    // когда задание завершилось (успешно, с ошибкой или отменой)
+    function createProgressHandler() {
         const progressBar = document.querySelector('.progress-bar');
         const progressBarWrap = document.getElementById('progressBarWrap');
         let lastProgress = 0;
-        while (true) {
-            await new Promise(r => setTimeout(r, 500));
-            const resp = await fetch(`/api/progress?task_id=${taskId}`);
-            const data = await resp.json();
+        return function(data) {
             if (data.status === 'error') {
                 resultDiv.innerHTML = `<div class="alert alert-danger">${data.error || 'Ошибка при скачивании'}</div>`;
                 progressBarWrap.style.display = 'none';
-                break;
+                return true;
+            }
+            if (data.status === 'cancelled') {
+                resultDiv.innerHTML = `<div class="alert alert-secondary">Скачивание отменено</div>`;
+                progressBarWrap.style.display = 'none';
+                return true;
+            }
+            if (data.status === 'queued') {
+                progressBar.innerText = data.queue_position ? `В очереди: ${data.queue_position}` : 'В очереди';
+                return false;
             }
             let prog = data.progress || 0;
             // Не даём прогрессу откатываться назад
             if (prog < lastProgress) prog = lastProgress;
             lastProgress = prog;
             progressBar.style.width = prog.toFixed(2) + '%';
-            progressBar.innerText = prog.toFixed(2) + '%';
+            progressBar.innerText = formatProgressLabel(data, prog);
             if (data.status === 'finished' && data.file_url) {
                 progressBar.style.width = '100%';
                 progressBar.innerText = '100.00%';
                 // Автоматически скачиваем файл
-                const a = document.createElement('a');
-                a.href = data.file_url;
-                a.download = '';
-                document.body.appendChild(a);
-                a.click();
-                document.body.removeChild(a);
+                saveFile(data.file_url);
                 resultDiv.innerHTML = `<div class="alert alert-success">Видео успешно скачано!</div>`;
                 setTimeout(() => { progressBarWrap.style.display = 'none'; }, 2000);
+                return true;
+            }
+            return false;
+        };
+    }
+
+    function trackProgress(taskId) {
+        const handleProgress = createProgressHandler();
+        if (!window.EventSource) {
+            return pollProgress(taskId, handleProgress);
+        }
+        return new Promise(resolve => {
+            const source = new EventSource(`/api/progress/stream?task_id=${taskId}`);
+            source.onmessage = (e) => {
+                if (handleProgress(JSON.parse(e.data))) {
+                    source.close();
+                    resolve();
+                }
+            };
+            source.onerror = () => {
+                // Поток недоступен (например, его режет прокси) — переходим на опрос
+                source.close();
+                pollProgress(taskId, handleProgress).then(resolve);
+            };
+        });
+    }
+
+    async function pollProgress(taskId, handleProgress) {
+        while (true) {
+            await new Promise(r => setTimeout(r, 500));
+            const resp = await fetch(`/api/progress?task_id=${taskId}`);
+            const data = await resp.json();
+            if (!resp.ok) {
+                handleProgress({ status: 'error', error: data.error });
                 break;
             }
+            if (handleProgress(data)) break;
         }
     }
 }); 
\ No newline at end of file
@@ -0,0 +1,281 @@
+import os
+import logging
+import shutil
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from content_store import INCOMING_DIR
+
+logger = logging.getLogger(__name__)
+
+# Порядок выбора кандидатов на удаление для каждой политики
+EVICTION_ORDER = {
+    'lru': 'last_access ASC',
+    'lfu': 'hits ASC, last_access ASC',
+    'age': 'created_at ASC',
+}
+
+# Хвосты незавершённых скачиваний yt-dlp
+PARTIAL_SUFFIXES = ('.part', '.ytdl', '.temp')
+
+
+def _entry_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def _latest_mtime(path):
+    """Время последнего изменения каталога или любого файла в нём."""
+    latest = os.path.getmtime(path)
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                latest = max(latest, os.path.getmtime(os.path.join(root, name)))
+            except OSError:
+                pass
+    return latest
+
+
+class StorageManager:
+    """Учёт места, занятого скачанными файлами, и удаление старых по квоте.
+
+    Записью считается элемент верхнего уровня каталога хранилища
+    (каталог с файлом для ключа содержимого или отдельный файл).
+    Учёт ведётся в SQLite, поэтому квота общая для всех процессов.
+    """
+
+    def __init__(self, root, db_path, quota=0, policy='lru', grace=600, max_age=0,
+                 sweep_interval=60, low_watermark=0.9, active_tasks=None):
+        if policy not in EVICTION_ORDER:
+            raise ValueError(f'Неизвестная политика удаления: {policy}')
+        self.root = root
+        self.db_path = db_path
+        self.quota = quota
+        self.policy = policy
+        self.grace = grace
+        self.max_age = max_age
+        self.sweep_interval = sweep_interval
+        self.low_watermark = low_watermark
+        self.active_tasks = active_tasks or (lambda: set())
+        self._pins = {}
+        self._pins_lock = threading.Lock()
+        self._sweep_lock = threading.Lock()
+        self._started = False
+
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS files (
+                    name TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL,
+                    hits INTEGER NOT NULL DEFAULT 0
+                )
+            ''')
+            conn.execute('CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def _name(self, path):
+        """Имя записи верхнего уровня, которой принадлежит путь."""
+        return os.path.relpath(path, self.root).split(os.sep)[0]
+
+    def record(self, path):
+        """Учесть новый файл в хранилище."""
+        name = self._name(path)
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('''
+                INSERT INTO files (name, size, created_at, last_access, hits) VALUES (?, ?, ?, ?, 1)
+                ON CONFLICT(name) DO UPDATE SET size = excluded.size, last_access = excluded.last_access
+            ''', (name, _entry_size(os.path.join(self.root, name)), now, now))
+        if self.quota and self.usage() > self.quota:
+            threading.Thread(target=self.sweep, daemon=True).start()
+
+    def touch(self, path):
+        """Отметить обращение к файлу (для LRU/LFU и защиты от удаления)."""
+        with self._connect() as conn:
+            conn.execute('UPDATE files SET last_access = ?, hits = hits + 1 WHERE name = ?',
+                         (time.time(), self._name(path)))
+
+    def pin(self, path):
+        """Запретить удаление файла, пока он отдаётся клиенту (до unpin)."""
+        name = self._name(path)
+        with self._pins_lock:
+            self._pins[name] = self._pins.get(name, 0) + 1
+        self.touch(path)
+
+    def unpin(self, path):
+        name = self._name(path)
+        with self._pins_lock:
+            count = self._pins.get(name, 0) - 1
+            if count > 0:
+                self._pins[name] = count
+            else:
+                self._pins.pop(name, None)
+        self.touch(path)
+
+    def usage(self):
+        with self._connect() as conn:
+            return conn.execute('SELECT COALESCE(SUM(size), 0) FROM files').fetchone()[0]
+
+    def _add_counter(self, conn, name, value):
+        conn.execute('''
+            INSERT INTO counters (name, value) VALUES (?, ?)
+            ON CONFLICT(name) DO UPDATE SET value = value + excluded.value
+        ''', (name, value))
+
+    def _evict(self, name, reason):
+        """Удалить запись; False, если её уже удалил другой процесс."""
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT size FROM files WHERE name = ?', (name,)).fetchone()
+            if row is None:
+                conn.execute('ROLLBACK')
+                return False
+            conn.execute('DELETE FROM files WHERE name = ?', (name,))
+            self._add_counter(conn, 'evictions', 1)
+            self._add_counter(conn, 'evicted_bytes', row['size'])
+            conn.execute('COMMIT')
+        path = os.path.join(self.root, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        logger.info("Удалён файл из хранилища (%s): %s", reason, name)
+        return True
+
+    def sweep(self):
+        """Удалить устаревшие файлы и освободить место до квоты."""
+        if not self._sweep_lock.acquire(blocking=False):
+            return
+        try:
+            now = time.time()
+            with self._pins_lock:
+                pinned = set(self._pins)
+            with self._connect() as conn:
+                if self.max_age:
+                    expired = conn.execute('SELECT name FROM files WHERE created_at < ? AND last_access < ?',
+                                           (now - self.max_age, now - self.grace)).fetchall()
+                else:
+                    expired = []
+                candidates = conn.execute(
+                    f'SELECT name, size FROM files WHERE last_access < ? ORDER BY {EVICTION_ORDER[self.policy]}',
+                    (now - self.grace,)).fetchall()
+            for row in expired:
+                if row['name'] not in pinned:
+                    self._evict(row['name'], 'истёк срок хранения')
+            usage = self.usage()
+            if not self.quota or usage <= self.quota:
+                return
+            # Освобождаем место с запасом, чтобы не чистить после каждого файла
+            target = self.quota * self.low_watermark
+            for row in candidates:
+                if usage <= target:
+                    break
+                if row['name'] in pinned:
+                    continue
+                if self._evict(row['name'], 'превышена квота'):
+                    usage -= row['size']
+        finally:
+            self._sweep_lock.release()
+
+    def reconcile(self):
+        """Сверка каталога с учётом при запуске.
+
+        Удаляет каталоги незавершённых скачиваний, которые не принадлежат
+        активным заданиям, и хвосты .part/.ytdl; учитывает файлы, которых
+        нет в базе, и забывает записи об удалённых файлах.
+        """
+        removed = 0
+        now = time.time()
+        incoming = os.path.join(self.root, INCOMING_DIR)
+        active = self.active_tasks()
+        for name in os.listdir(incoming) if os.path.isdir(incoming) else []:
+            path = os.path.join(incoming, name)
+            # Недавно изменённые каталоги могут принадлежать потоковой отдаче
+            # в другом процессе, у которой нет задания в очереди
+            if name not in active and _latest_mtime(path) < now - self.grace:
+                shutil.rmtree(path, ignore_errors=True)
+                removed += 1
+        with self._connect() as conn:
+            known = {row['name'] for row in conn.execute('SELECT name FROM files')}
+            present = set()
+            for name in os.listdir(self.root):
+                path = os.path.join(self.root, name)
+                if name == INCOMING_DIR:
+                    continue
+                if name.endswith(PARTIAL_SUFFIXES) and os.path.isfile(path):
+                    os.remove(path)
+                    removed += 1
+                    continue
+                present.add(name)
+                if name not in known:
+                    mtime = os.path.getmtime(path)
+                    conn.execute(
+                        'INSERT OR IGNORE INTO files (name, size, created_at, last_access) VALUES (?, ?, ?, ?)',
+                        (name, _entry_size(path), mtime, mtime))
+            for name in known - present:
+                conn.execute('DELETE FROM files WHERE name = ?', (name,))
+            self._add_counter(conn, 'reconciled_partials', removed)
+        if removed:
+            logger.info("При запуске удалено незавершённых скачиваний: %s", removed)
+
+    def stats(self):
+        """Текущее использование места и счётчики удалений."""
+        with self._connect() as conn:
+            row = conn.execute('SELECT COUNT(*) AS files, COALESCE(SUM(size), 0) AS bytes FROM files').fetchone()
+            counters = {r['name']: r['value'] for r in conn.execute('SELECT name, value FROM counters')}
+        return {
+            'files': row['files'],
+            'used_bytes': row['bytes'],
+            'quota_bytes': self.quota,
+            'policy': self.policy,
+            'evictions': counters.get('evictions', 0),
+            'evicted_bytes': counters.get('evicted_bytes', 0),
+            'reconciled_partials': counters.get('reconciled_partials', 0),
+        }
+
+    def start(self):
+        """Сверка при запуске и фоновая очистка (повторные вызовы игнорируются)."""
+        if self._started:
+            return
+        self._started = True
+        os.makedirs(self.root, exist_ok=True)
+        try:
+            self.reconcile()
+        except OSError as e:
+            logger.error("Ошибка сверки хранилища: %s", e)
+        threading.Thread(target=self._sweeper, name='storage-sweeper', daemon=True).start()
+
+    def _sweeper(self):
+        while True:
+            try:
+                self.sweep()
+            except (OSError, sqlite3.Error) as e:
+                logger.error("Ошибка очистки хранилища: %s", e)
+            time.sleep(self.sweep_interval)
@@ -0,0 +1,81 @@
+import logging
+from urllib.parse import quote
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+# Общая сессия: соединения с серверами источника (googlevideo и т.п.)
+# переиспользуются между запросами вместо нового TLS-рукопожатия
+session = requests.Session()
+session.mount('https://', HTTPAdapter(pool_connections=16, pool_maxsize=64))
+session.mount('http://', HTTPAdapter(pool_connections=16, pool_maxsize=64))
+
+# Заголовки ответа источника, которые передаются клиенту как есть
+PASSTHROUGH_HEADERS = ('Content-Type', 'Content-Length', 'Content-Range', 'Accept-Ranges',
+                       'Last-Modified', 'ETag')
+
+
+def is_progressive(fmt):
+    """Формат — один файл с видео и звуком, доступный по обычной HTTP-ссылке."""
+    return bool(fmt and fmt.get('url')
+                and fmt.get('vcodec') != 'none' and fmt.get('acodec') != 'none'
+                and fmt.get('protocol') in ('http', 'https'))
+
+
+def find_format(info, format_id=None):
+    """Формат по format_id или лучший однофайловый формат (yt-dlp сортирует форматы от худшего к лучшему)."""
+    formats = info.get('formats') or []
+    if format_id:
+        return next((f for f in formats if f.get('format_id') == format_id), None)
+    progressive = [f for f in formats if is_progressive(f)]
+    return progressive[-1] if progressive else None
+
+
+def content_disposition(filename):
+    """Заголовок Content-Disposition с именем файла, в том числе не-ASCII."""
+    ascii_name = filename.encode('ascii', 'replace').decode().replace('?', '_').replace('"', '_')
+    return f"attachment; filename=\"{ascii_name}\"; filename*=UTF-8''{quote(filename)}"
+
+
+def open_upstream(fmt, range_header=None, timeout=30):
+    """Открыть поток к источнику формата, передав ему Range клиента."""
+    headers = dict(fmt.get('http_headers') or {})
+    # Без сжатия: длина и диапазоны должны совпадать с байтами файла
+    headers['Accept-Encoding'] = 'identity'
+    if range_header:
+        headers['Range'] = range_header
+    return session.get(fmt['url'], headers=headers, stream=True, timeout=timeout)
+
+
+def iter_body(upstream, tee_path=None, on_complete=None, on_abort=None):
+    """Отдаёт тело ответа источника по мере поступления.
+
+    Если задан tee_path, байты параллельно пишутся в файл; после полной
+    передачи вызывается on_complete(tee_path), при обрыве — on_abort().
+    """
+    tee = open(tee_path, 'wb') if tee_path else None
+    complete = False
+    received = 0
+    try:
+        for chunk in upstream.iter_content(CHUNK_SIZE):
+            if tee:
+                tee.write(chunk)
+            received += len(chunk)
+            yield chunk
+        expected = upstream.headers.get('Content-Length')
+        complete = expected is None or int(expected) == received
+    finally:
+        upstream.close()
+        if tee:
+            tee.close()
+            try:
+                if complete and on_complete:
+                    on_complete(tee_path)
+                elif on_abort:
+                    on_abort()
+            except OSError as e:
+                logger.warning("Не удалось сохранить файл после потоковой отдачи: %s", e)
@@ -0,0 +1,311 @@
+import os
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+# Статусы, после которых задание больше не меняется и может быть удалено по TTL
+FINAL_STATUSES = ('finished', 'error', 'cancelled')
+
+
+class SQLiteTaskStore:
+    """Хранилище состояния заданий в SQLite (режим WAL).
+
+    Файл базы общий для всех процессов gunicorn, поэтому запрос прогресса
+    может попасть в любой воркер.
+    """
+
+    def __init__(self, path, ttl=3600, purge_interval=60, poll_interval=0.1):
+        self.path = path
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self.poll_interval = poll_interval
+        self._last_purge = 0.0
+        self._purge_lock = threading.Lock()
+        # Подписчики на изменения заданий в этом процессе (см. watch) и
+        # общий для них поток, замечающий изменения из других процессов
+        self._watchers = {}
+        self._watchers_lock = threading.Lock()
+        self._poller = None
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS tasks (
+                    task_id TEXT PRIMARY KEY,
+                    data TEXT NOT NULL,
+                    updated_at REAL NOT NULL,
+                    expires_at REAL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS tasks_expires ON tasks (expires_at)')
+            conn.execute('CREATE INDEX IF NOT EXISTS tasks_updated ON tasks (updated_at)')
+            # Время последнего обращения клиента хранится отдельно: его запись
+            # не меняет updated_at и не будит подписчиков watch
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS task_seen (
+                    task_id TEXT PRIMARY KEY,
+                    seen_at REAL NOT NULL
+                )
+            ''')
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            conn.execute('PRAGMA synchronous=NORMAL')
+            yield conn
+        finally:
+            conn.close()
+
+    def _expires_at(self, data, now):
+        return now + self.ttl if data.get('status') in FINAL_STATUSES else None
+
+    def create(self, task_id, **fields):
+        """Создать (или перезаписать) запись о задании."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO tasks (task_id, data, updated_at, expires_at) VALUES (?, ?, ?, ?)',
+                (task_id, json.dumps(fields), now, self._expires_at(fields, now)))
+        self._notify(task_id)
+        self._maybe_purge()
+
+    def get(self, task_id):
+        """Состояние задания или None, если оно неизвестно или истекло."""
+        with self._connect() as conn:
+            row = conn.execute('SELECT data, expires_at FROM tasks WHERE task_id = ?', (task_id,)).fetchone()
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return None
+        return json.loads(row[0])
+
+    def update(self, task_id, **fields):
+        """Обновить отдельные поля задания."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT data FROM tasks WHERE task_id = ?', (task_id,)).fetchone()
+            data = json.loads(row[0]) if row else {}
+            data.update(fields)
+            conn.execute(
+                'INSERT OR REPLACE INTO tasks (task_id, data, updated_at, expires_at) VALUES (?, ?, ?, ?)',
+                (task_id, json.dumps(data), now, self._expires_at(data, now)))
+            conn.execute('COMMIT')
+        self._notify(task_id)
+
+    def delete(self, task_id):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM tasks WHERE task_id = ?', (task_id,))
+            conn.execute('DELETE FROM task_seen WHERE task_id = ?', (task_id,))
+        self._notify(task_id)
+
+    def touch(self, task_id):
+        """Отметить, что клиент следит за заданием (опрашивает прогресс)."""
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO task_seen (task_id, seen_at) VALUES (?, ?)', (task_id, time.time()))
+
+    def last_seen(self, task_id):
+        """Время (time.time()) последнего обращения клиента к заданию или None."""
+        with self._connect() as conn:
+            row = conn.execute('SELECT seen_at FROM task_seen WHERE task_id = ?', (task_id,)).fetchone()
+        return row[0] if row else None
+
+    def _notify(self, task_id):
+        with self._watchers_lock:
+            events = list(self._watchers.get(task_id, ()))
+        for event in events:
+            event.set()
+
+    def _poll(self):
+        """Поток опроса изменений из других процессов: один на процесс, пока есть подписчики.
+
+        Раз в poll_interval одним запросом выбираются задания, изменённые с
+        прошлого опроса, и будятся только их подписчики, так что открытые,
+        но не меняющиеся потоки прогресса почти не создают нагрузки.
+        """
+        # Записи других процессов могут зафиксироваться чуть позже своего
+        # updated_at, поэтому последняя секунда перечитывается повторно
+        overlap = 1.0
+        since = time.time() - overlap
+        seen = {}
+        with self._connect() as conn:
+            while True:
+                with self._watchers_lock:
+                    if not self._watchers:
+                        self._poller = None
+                        return
+                try:
+                    rows = conn.execute('SELECT task_id, updated_at FROM tasks WHERE updated_at > ?',
+                                        (since,)).fetchall()
+                except sqlite3.Error:
+                    rows = []
+                changed = [task_id for task_id, updated_at in rows if seen.get(task_id) != updated_at]
+                seen.update(rows)
+                if rows:
+                    since = max(since, max(updated_at for _, updated_at in rows) - overlap)
+                    seen = {task_id: updated_at for task_id, updated_at in seen.items() if updated_at > since}
+                for task_id in changed:
+                    self._notify(task_id)
+                time.sleep(self.poll_interval)
+
+    def _versioned(self, task_id):
+        with self._connect() as conn:
+            row = conn.execute('SELECT data, updated_at, expires_at FROM tasks WHERE task_id = ?',
+                               (task_id,)).fetchone()
+        if row is None or (row[2] is not None and row[2] < time.time()):
+            return None, None
+        return json.loads(row[0]), row[1]
+
+    def watch(self, task_id, heartbeat=5.0):
+        """Генератор состояний задания: отдаёт состояние при каждом изменении
+        и None, если за `heartbeat` секунд изменений не было.
+
+        Изменения из этого процесса приходят сразу через событие, из других
+        процессов — через общий поток опроса (см. _poll).
+        """
+        event = threading.Event()
+        with self._watchers_lock:
+            self._watchers.setdefault(task_id, set()).add(event)
+            if self._poller is None:
+                self._poller = threading.Thread(target=self._poll, name='task-store-poller', daemon=True)
+                self._poller.start()
+        try:
+            version = None
+            idle_since = time.monotonic()
+            while True:
+                # Каждое пробуждение (изменение или heartbeat) — один запрос;
+                # по heartbeat замечается и удаление задания другим процессом
+                state, updated_at = self._versioned(task_id)
+                if state is None:
+                    return
+                if updated_at != version:
+                    version = updated_at
+                    idle_since = time.monotonic()
+                    yield state
+                elif time.monotonic() - idle_since >= heartbeat:
+                    idle_since = time.monotonic()
+                    yield None
+                event.wait(max(0.0, heartbeat - (time.monotonic() - idle_since)))
+                event.clear()
+        finally:
+            with self._watchers_lock:
+                watchers = self._watchers.get(task_id)
+                watchers.discard(event)
+                if not watchers:
+                    del self._watchers[task_id]
+
+    def purge_expired(self):
+        """Удалить завершённые задания с истёкшим TTL."""
+        with self._connect() as conn:
+            removed = conn.execute('DELETE FROM tasks WHERE expires_at < ?', (time.time(),)).rowcount
+            conn.execute('DELETE FROM task_seen WHERE task_id NOT IN (SELECT task_id FROM tasks)')
+            return removed
+
+    def _maybe_purge(self):
+        now = time.time()
+        if now - self._last_purge < self.purge_interval or not self._purge_lock.acquire(blocking=False):
+            return
+        try:
+            self._last_purge = now
+            self.purge_expired()
+        finally:
+            self._purge_lock.release()
+
+
+class RedisTaskStore:
+    """Хранилище состояния заданий в Redis (или совместимом сервере).
+
+    Каждое задание — хеш, поля которого хранятся в JSON; истечение
+    завершённых заданий выполняет сам Redis.
+    """
+
+    # Незавершённые задания тоже не должны жить вечно, если процесс упал
+    MAX_ACTIVE_TTL = 24 * 3600
+
+    def __init__(self, url, ttl=3600, prefix='task:'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('Для TASK_STORE_URL=redis://... нужен пакет redis: pip install redis')
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def _key(self, task_id):
+        return self.prefix + task_id
+
+    def _channel(self, task_id):
+        return self.prefix + 'events:' + task_id
+
+    def _seen_key(self, task_id):
+        return self.prefix + 'seen:' + task_id
+
+    def _write(self, task_id, fields, replace):
+        key = self._key(task_id)
+        pipe = self.client.pipeline()
+        if replace:
+            pipe.delete(key)
+        pipe.hset(key, mapping={k: json.dumps(v) for k, v in fields.items()})
+        if fields.get('status') in FINAL_STATUSES:
+            pipe.expire(key, self.ttl)
+        elif replace:
+            pipe.expire(key, self.MAX_ACTIVE_TTL)
+        pipe.publish(self._channel(task_id), '1')
+        pipe.execute()
+
+    def create(self, task_id, **fields):
+        self._write(task_id, fields, replace=True)
+
+    def get(self, task_id):
+        raw = self.client.hgetall(self._key(task_id))
+        if not raw:
+            return None
+        return {k.decode(): json.loads(v) for k, v in raw.items()}
+
+    def update(self, task_id, **fields):
+        self._write(task_id, fields, replace=False)
+
+    def delete(self, task_id):
+        pipe = self.client.pipeline()
+        pipe.delete(self._key(task_id), self._seen_key(task_id))
+        pipe.publish(self._channel(task_id), '1')
+        pipe.execute()
+
+    def touch(self, task_id):
+        self.client.set(self._seen_key(task_id), time.time(), ex=self.MAX_ACTIVE_TTL)
+
+    def last_seen(self, task_id):
+        value = self.client.get(self._seen_key(task_id))
+        return float(value) if value is not None else None
+
+    def watch(self, task_id, heartbeat=5.0):
+        """Генератор состояний задания по уведомлениям Redis Pub/Sub
+        (None — если изменений не было `heartbeat` секунд)."""
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self._channel(task_id))
+        try:
+            state = self.get(task_id)
+            while state is not None:
+                yield state
+                while pubsub.get_message(timeout=heartbeat) is None:
+                    yield None
+                state = self.get(task_id)
+        finally:
+            pubsub.close()
+
+    def purge_expired(self):
+        # Истечение ключей выполняет Redis
+        return 0
+
+
+def create_task_store(url, ttl=3600):
+    """Создать хранилище по URL: redis://..., rediss://..., unix://... или путь к файлу SQLite."""
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisTaskStore(url, ttl=ttl)
+    if url.startswith('sqlite:///'):
+        url = url[len('sqlite:///'):]
+    return SQLiteTaskStore(url, ttl=ttl)
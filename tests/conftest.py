@@ -0,0 +1,140 @@
+import os
+import re
+import sys
+import threading
+import time
+import http.server
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class RangeServer:
+    """Локальный HTTP-сервер с поддержкой Range и ограничением скорости на соединение.
+
+    Заменяет CDN, который режет скорость одного соединения: files — словарь
+    {путь: байты}, rate — байт в секунду на соединение (0 — без ограничения).
+    Считает отданные байты по путям, запросы без Range и наибольшее число
+    одновременных ответов; schedule_outage имитирует кратковременный сбой.
+    """
+
+    def __init__(self, files, rate=0):
+        self.files = files
+        self.rate = rate
+        self.served = {}
+        self.active = 0
+        self.max_active = 0
+        self.full_requests = 0
+        self._outage = None
+        self._down_until = 0.0
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                server._handle(self)
+
+        self._httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._httpd.daemon_threads = True
+        self.base_url = f'http://127.0.0.1:{self._httpd.server_address[1]}'
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+
+    def url(self, path):
+        return self.base_url + path
+
+    def reset_counters(self, timeout=5):
+        """Обнулить счётчики, дождавшись окончания ответов прошлых соединений."""
+        deadline = time.monotonic() + timeout
+        while self.active and time.monotonic() < deadline:
+            time.sleep(0.01)
+        with self._lock:
+            self.served = {}
+            self.max_active = 0
+            self.full_requests = 0
+
+    def schedule_outage(self, after, duration):
+        """Когда будет отдано `after` байт, обрывать все соединения `duration` секунд."""
+        self._outage = (after, duration)
+
+    def _down(self):
+        with self._lock:
+            if self._outage is not None and sum(self.served.values()) >= self._outage[0]:
+                self._down_until = time.monotonic() + self._outage[1]
+                self._outage = None
+            return time.monotonic() < self._down_until
+
+    def _handle(self, handler):
+        if self._down():
+            handler.close_connection = True
+            return
+        data = self.files.get(handler.path)
+        if data is None:
+            handler.send_response(404)
+            handler.send_header('Content-Length', '0')
+            handler.end_headers()
+            return
+        start, end = 0, len(data) - 1
+        match = re.match(r'bytes=(\d+)-(\d*)', handler.headers.get('Range', ''))
+        if match:
+            start = int(match[1])
+            end = min(int(match[2]), end) if match[2] else end
+            handler.send_response(206)
+            handler.send_header('Content-Range', f'bytes {start}-{end}/{len(data)}')
+        else:
+            with self._lock:
+                self.full_requests += 1
+            handler.send_response(200)
+        handler.send_header('Content-Length', str(end - start + 1))
+        handler.send_header('Accept-Ranges', 'bytes')
+        handler.end_headers()
+        with self._lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            position = start
+            started = time.monotonic()
+            while position <= end:
+                if self._down():
+                    handler.close_connection = True
+                    return
+                chunk = data[position:min(position + 64 * 1024, end + 1)]
+                # Учитываем до отправки: клиент может получить последний блок
+                # и завершить скачивание раньше, чем поток сервера вернётся из write
+                with self._lock:
+                    self.served[handler.path] = self.served.get(handler.path, 0) + len(chunk)
+                try:
+                    handler.wfile.write(chunk)
+                except OSError:
+                    return
+                position += len(chunk)
+                if self.rate:
+                    delay = (position - start) / self.rate - (time.monotonic() - started)
+                    if delay > 0:
+                        time.sleep(delay)
+        finally:
+            with self._lock:
+                self.active -= 1
+
+    def close(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+@pytest.fixture
+def range_server():
+    servers = []
+
+    def start(files, rate=0):
+        server = RangeServer(files, rate)
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.close()
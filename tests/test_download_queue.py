@@ -0,0 +1,34 @@
+from download_queue import DownloadQueue
+
+
+def make_queue(tmp_path):
+    # Воркеры не запускаются: проверяется только учёт заданий в базе
+    return DownloadQueue(str(tmp_path / 'queue.db'), handler=None)
+
+
+def test_repeated_detach_does_not_cancel_for_other_clients(tmp_path):
+    queue = make_queue(tmp_path)
+    first, _ = queue.submit('a', {'url': 'x'}, dedup_key='k')
+    second, _ = queue.submit('b', {'url': 'x'}, dedup_key='k')
+    assert first == second == 'a'
+
+    assert queue.detach('a', 'b') == 1
+    # Повтор того же DELETE не отсоединяет других клиентов
+    assert queue.detach('a', 'b') is None
+    assert queue.detach('a', 'a') == 0
+    assert queue.cancel('a')
+    # К отменённому заданию новые запросы не присоединяются
+    assert queue.submit('c', {'url': 'x'}, dedup_key='k')[0] == 'c'
+
+
+def test_watchers_include_every_attached_playlist(tmp_path):
+    queue = make_queue(tmp_path)
+    job_id, _ = queue.submit('a', {'url': 'x'}, dedup_key='k')
+    queue.submit_many([
+        {'task_id': 'p1-item', 'payload': {'url': 'x'}, 'dedup_key': 'k', 'watch_id': 'p1'},
+        {'task_id': 'p2-item', 'payload': {'url': 'x'}, 'dedup_key': 'k', 'watch_id': 'p2'},
+    ])
+    assert sorted(queue.watchers(job_id)) == ['a', 'p1', 'p2']
+
+    queue.detach(job_id, 'p1-item')
+    assert sorted(queue.watchers(job_id)) == ['a', 'p2']
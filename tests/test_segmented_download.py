@@ -0,0 +1,209 @@
+import os
+import sys
+import glob
+import hashlib
+import subprocess
+import threading
+import time
+
+import pytest
+from yt_dlp.utils import DownloadCancelled
+
+import segmented_download
+from segmented_download import SegmentedDownloader, SegmentedYoutubeDL, checkpoint_path
+
+MB = 1024 * 1024
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Скачивание в отдельном процессе, который тест убивает SIGKILL
+KILLED_DOWNLOAD = '''
+import sys
+sys.path.insert(0, sys.argv[1])
+from segmented_download import SegmentedDownloader
+SegmentedDownloader(connections=4).download(sys.argv[2], sys.argv[3], int(sys.argv[4]))
+'''
+
+
+def payload(size, seed):
+    """Детерминированные несжимаемые данные заданного размера."""
+    blocks = []
+    counter = 0
+    while len(blocks) * 32 < size:
+        blocks.append(hashlib.sha256(f'{seed}-{counter}'.encode()).digest())
+        counter += 1
+    return b''.join(blocks)[:size]
+
+
+def sha256(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def test_parallel_ranges_beat_per_connection_throttle(range_server, tmp_path):
+    data = payload(4 * MB, 'throttle')
+    server = range_server({'/file': data}, rate=2 * MB)
+
+    started = time.monotonic()
+    SegmentedDownloader(connections=1).download(server.url('/file'), tmp_path / 'single', len(data))
+    single = time.monotonic() - started
+
+    server.reset_counters()
+    started = time.monotonic()
+    SegmentedDownloader(connections=4).download(server.url('/file'), tmp_path / 'parallel', len(data))
+    parallel = time.monotonic() - started
+
+    assert (tmp_path / 'parallel').read_bytes() == data
+    assert (tmp_path / 'single').read_bytes() == data
+    assert server.max_active == 4
+    assert parallel < single / 2
+    assert not os.path.exists(checkpoint_path(tmp_path / 'parallel'))
+
+
+def test_global_connection_limit(range_server, tmp_path):
+    data = payload(4 * MB, 'limit')
+    server = range_server({'/file': data}, rate=4 * MB)
+    segmented_download.set_connection_limit(2)
+    try:
+        SegmentedDownloader(connections=4).download(server.url('/file'), tmp_path / 'out', len(data))
+    finally:
+        segmented_download.set_connection_limit(16)
+    assert server.max_active <= 2
+    assert (tmp_path / 'out').read_bytes() == data
+
+
+def test_stopped_download_resumes_to_identical_file(range_server, tmp_path):
+    data = payload(8 * MB, 'resume')
+    server = range_server({'/file': data}, rate=2 * MB)
+    path = tmp_path / 'out.seg.part'
+    stop = threading.Event()
+
+    def progress(d):
+        if d['downloaded_bytes'] >= 3 * MB:
+            stop.set()
+
+    with pytest.raises(DownloadCancelled):
+        SegmentedDownloader(connections=4).download(server.url('/file'), path, len(data), progress=progress,
+                                                    stop=stop)
+    checkpoint = segmented_download._Checkpoint.load(checkpoint_path(path), len(data))
+    assert checkpoint is not None
+    saved = checkpoint.downloaded
+    assert 0 < saved < len(data)
+
+    # Повторный запуск запрашивает только недостающие диапазоны
+    server.reset_counters()
+    SegmentedDownloader(connections=4).download(server.url('/file'), path, len(data))
+    assert server.served['/file'] == len(data) - saved
+    assert sha256(path) == hashlib.sha256(data).hexdigest()
+    assert not os.path.exists(checkpoint_path(path))
+
+
+def test_killed_download_resumes_from_periodic_checkpoint(range_server, tmp_path):
+    data = payload(8 * MB, 'kill')
+    server = range_server({'/file': data}, rate=2 * MB)
+    path = tmp_path / 'out.seg.part'
+    child = subprocess.Popen([sys.executable, '-c', KILLED_DOWNLOAD, ROOT, server.url('/file'), str(path),
+                              str(len(data))])
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            checkpoint = segmented_download._Checkpoint.load(checkpoint_path(path), len(data))
+            if checkpoint is not None and checkpoint.downloaded >= 3 * MB:
+                break
+            assert child.poll() is None and time.monotonic() < deadline
+            time.sleep(0.02)
+    finally:
+        # Без возможности сохранить состояние: на диске только периодический checkpoint
+        child.kill()
+        child.wait()
+    saved = segmented_download._Checkpoint.load(checkpoint_path(path), len(data)).downloaded
+    assert saved < len(data)
+
+    server.reset_counters()
+    SegmentedDownloader(connections=4).download(server.url('/file'), path, len(data))
+    assert server.served['/file'] == len(data) - saved
+    assert sha256(path) == hashlib.sha256(data).hexdigest()
+    assert not os.path.exists(checkpoint_path(path))
+
+
+class RecordingYoutubeDL(SegmentedYoutubeDL):
+    """Запоминает, под какими именами yt-dlp запрашивает файлы потоков."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.requested = []
+
+    def dl(self, name, info, subtitle=False, test=False):
+        self.requested.append(name)
+        return super().dl(name, info, subtitle, test)
+
+
+@pytest.mark.parametrize('outtmpl', ['%(title)s.%(ext)s', 'video.mp4'])
+def test_finished_stream_is_not_fetched_again_after_restart(range_server, tmp_path, outtmpl):
+    video = payload(8 * MB, 'video')
+    audio = payload(1 * MB, 'audio')
+    server = range_server({'/v': video, '/a': audio}, rate=2 * MB)
+    info = {
+        'extractor': 'test', 'extractor_key': 'Test', 'webpage_url': server.url('/'),
+        '_type': 'video', 'id': 'x', 'title': 'clip',
+        'formats': [
+            {'format_id': '140', 'url': server.url('/a'), 'ext': 'm4a', 'protocol': 'http',
+             'filesize': len(audio), 'vcodec': 'none', 'acodec': 'mp4a.40.2'},
+            # webm + m4a собираются в mkv: расширение потока и контейнера различаются
+            {'format_id': '248', 'url': server.url('/v'), 'ext': 'webm', 'protocol': 'http',
+             'filesize': len(video), 'vcodec': 'vp9', 'acodec': 'none'},
+        ],
+    }
+    params = {'outtmpl': str(tmp_path / outtmpl), 'format': '248+140', 'quiet': True, 'no_warnings': True,
+              'ignoreerrors': True}
+
+    # Аудио успевает докачаться, видео прерывается до того, как yt-dlp запросит аудио
+    stop = threading.Event()
+
+    def stop_after_audio():
+        while not glob.glob(str(tmp_path / '*.f140.m4a')):
+            time.sleep(0.02)
+        stop.set()
+
+    threading.Thread(target=stop_after_audio, daemon=True).start()
+    with pytest.raises(DownloadCancelled):
+        with RecordingYoutubeDL(dict(params), connections=4, stop=stop) as ydl:
+            ydl.process_ie_result(dict(info), download=True)
+    video_part = glob.glob(str(tmp_path / '*.f248.webm.seg.part'))
+    assert len(video_part) == 1
+    saved = segmented_download._Checkpoint.load(checkpoint_path(video_part[0]), len(video)).downloaded
+
+    server.reset_counters()
+    with RecordingYoutubeDL(dict(params), connections=4) as ydl:
+        ydl.process_ie_result(dict(info), download=True)
+    assert server.served.get('/a', 0) == 0
+    assert server.served['/v'] == len(video) - saved
+
+    video_file, audio_file = ydl.requested
+    assert sha256(video_file) == hashlib.sha256(video).hexdigest()
+    assert sha256(audio_file) == hashlib.sha256(audio).hexdigest()
+    assert not glob.glob(str(tmp_path / '*.seg.part*'))
+
+
+def test_network_outage_resumes_without_losing_progress(range_server, tmp_path, monkeypatch):
+    monkeypatch.setattr(segmented_download, 'MIN_SEGMENTED_SIZE', MB)
+    monkeypatch.setattr(segmented_download, 'RESUME_DELAY', 0.5)
+    data = payload(8 * MB, 'outage')
+    server = range_server({'/file': data}, rate=2 * MB)
+    server.schedule_outage(after=3 * MB, duration=0.3)
+    info = {
+        'extractor': 'test', 'extractor_key': 'Test', 'webpage_url': server.url('/'),
+        '_type': 'video', 'id': 'x', 'title': 'clip',
+        'formats': [{'format_id': '18', 'url': server.url('/file'), 'ext': 'mp4', 'protocol': 'http',
+                     'filesize': len(data), 'vcodec': 'avc1', 'acodec': 'mp4a.40.2'}],
+    }
+    params = {'outtmpl': str(tmp_path / '%(title)s.%(ext)s'), 'quiet': True, 'no_warnings': True}
+    with SegmentedYoutubeDL(params, connections=4) as ydl:
+        # Первый же обрыв диапазона поднимает ошибку до dl()
+        ydl.segmented.retries = 0
+        ydl.process_ie_result(dict(info), download=True)
+
+    # Продолжение с места остановки, а не новое скачивание одним соединением
+    assert server.full_requests == 0
+    assert server.served['/file'] < len(data) + 2 * MB
+    assert sha256(tmp_path / 'clip.mp4') == hashlib.sha256(data).hexdigest()
+    assert not glob.glob(str(tmp_path / '*.seg.part*'))
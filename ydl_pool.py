@@ -0,0 +1,71 @@
+import threading
+from contextlib import contextmanager
+
+import yt_dlp
+
+# После стольких использований экземпляр пересоздаётся, чтобы не копить
+# внутреннее состояние YoutubeDL (кэши сообщений, счётчики)
+MAX_USES = 200
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class YoutubeDLPool:
+    """Пул готовых экземпляров YoutubeDL с одинаковыми настройками.
+
+    Экземпляр сохраняет между запросами экстракторы (с их кэшами, например
+    разобранным плеером YouTube) и HTTP-соединения keep-alive, поэтому
+    повторное извлечение не платит за инициализацию и TLS-рукопожатие.
+    Экземпляр не потокобезопасен: acquire() выдаёт его одному потоку.
+    """
+
+    def __init__(self, params, size=4):
+        self.params = dict(params)
+        self.size = size
+        self._idle = []
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+
+    def _create(self):
+        self.created += 1
+        return yt_dlp.YoutubeDL(dict(self.params))
+
+    @contextmanager
+    def acquire(self):
+        with self._lock:
+            ydl, uses = self._idle.pop() if self._idle else (None, 0)
+            if ydl is not None:
+                self.reused += 1
+        if ydl is None:
+            ydl = self._create()
+        try:
+            yield ydl
+        finally:
+            uses += 1
+            with self._lock:
+                keep = uses < MAX_USES and len(self._idle) < self.size
+                if keep:
+                    self._idle.append((ydl, uses))
+            if not keep:
+                ydl.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for ydl, _ in idle:
+            ydl.close()
+
+
+def get_pool(name, params, size=4):
+    """Пул для профиля настроек `name` (создаётся при первом обращении).
+
+    Настройки должны быть одинаковыми для всех вызовов с этим именем:
+    хуки прогресса и шаблоны имён файлов конкретного задания в пул не кладутся.
+    """
+    with _pools_lock:
+        pool = _pools.get(name)
+        if pool is None:
+            pool = _pools[name] = YoutubeDLPool(params, size)
+        return pool
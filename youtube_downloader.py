@@ -1,6 +1,6 @@
-import yt_dlp
 import sys
 import re
+from ydl_pool import get_pool
 
 def validate_url(url):
     """Проверка корректности URL YouTube."""
@@ -22,8 +22,8 @@ def get_video_info(url):
             'extract_flat': False,  # Отключаем flat извлечение
         }
 
-        # Создаем объект yt-dlp
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        # Берём экземпляр yt-dlp из общего пула
+        with get_pool('cli', ydl_opts, size=1).acquire() as ydl:
             print("Получение информации о видео...")
             # Получаем информацию о видео
             info = ydl.extract_info(url, download=False)
@@ -1,24 +1,37 @@
 import sys
 import os
+import logging
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
                            QHBoxLayout, QLineEdit, QPushButton, QLabel, 
-                           QScrollArea, QFrame, QProgressBar, QGridLayout, QMessageBox, QFileDialog)
-from PyQt6.QtCore import Qt, QThread, pyqtSignal, QSize, QTimer, QRectF, QByteArray, QUrl
-from PyQt6.QtGui import QFont, QIcon, QMovie, QPixmap, QPainter, QPen, QColor, QPainterPath
+                           QScrollArea, QFrame, QProgressBar, QGridLayout, QMessageBox, QFileDialog,
+                           QListView, QStyledItemDelegate, QStyle, QStackedWidget, QSpinBox)
+from PyQt6.QtCore import (Qt, QThread, pyqtSignal, QSize, QTimer, QRectF, QByteArray, QUrl,
+                          QAbstractListModel, QModelIndex, QRect, QObject)
+from PyQt6.QtGui import QFont, QIcon, QMovie, QPixmap, QImage, QPainter, QPen, QColor, QPainterPath, QFontMetrics
 from PyQt6.QtSvg import QSvgRenderer
 from PyQt6.QtNetwork import QNetworkAccessManager, QNetworkRequest
-import yt_dlp
 import re
 from youtube_downloader import validate_url
+from ydl_pool import get_pool
+from segmented_download import SegmentedYoutubeDL
+from bandwidth import BandwidthScheduler
+from log_setup import setup_logging, YdlLogger, VERBOSE
+from yt_dlp.utils import DownloadCancelled
 import json
-import urllib.request
+import glob
+import threading
+import time
+import hashlib
+from collections import OrderedDict
 import requests
 
+logger = logging.getLogger(__name__)
+
 def load_svg_with_color(path, size, color="white"):
     try:
         # Проверяем существование файла
         if not os.path.exists(path):
-            print(f"File not found: {path}")
+            logger.warning("File not found: %s", path)
             return None
 
         # Читаем SVG файл
@@ -34,7 +47,7 @@ def load_svg_with_color(path, size, color="white"):
         # Создаем рендерер и pixmap
         renderer = QSvgRenderer()
         if not renderer.load(bytes(svg_content, encoding='utf-8')):
-            print(f"Failed to load SVG content for {path}")
+            logger.warning("Failed to load SVG content for %s", path)
             return None
         
         pixmap = QPixmap(size)
@@ -47,7 +60,7 @@ def load_svg_with_color(path, size, color="white"):
         
         return pixmap
     except Exception as e:
-        print(f"Error loading SVG {path}: {str(e)}")
+        logger.warning("Error loading SVG %s: %s", path, e)
         return None
 
 class LoadingSpinner(QWidget):
@@ -120,7 +133,7 @@ def resolve_tiktok_url(url):
         response = requests.head(url, allow_redirects=True)
         return response.url
     except Exception as e:
-        print(f"Ошибка при разрешении короткой ссылки: {str(e)}")
+        logger.warning("Ошибка при разрешении короткой ссылки: %s", e)
         return url
 
 def clean_tiktok_url(url):
@@ -153,6 +166,11 @@ def validate_url(url):
                 re.match(tiktok_pattern, url) or 
                 re.match(instagram_pattern, url))
 
+def youtube_video_id(url):
+    """ID видео YouTube из URL (None, если это не ссылка на видео YouTube)"""
+    match = re.search(r'(?:youtube\.com/watch\?(?:\S*&)?v=|youtu\.be/)([a-zA-Z0-9_-]{11})', url)
+    return match.group(1) if match else None
+
 def get_tiktok_photo_info(url):
     """Получает информацию о фото TikTok"""
     try:
@@ -180,49 +198,123 @@ def get_tiktok_photo_info(url):
     except Exception as e:
         raise Exception(f"Ошибка при получении информации о фото: {str(e)}")
 
+SEARCH_YDL_OPTS = {
+    'quiet': True,
+    'no_warnings': True,
+    'extract_flat': False,
+    'socket_timeout': 30,
+    'logger': YdlLogger(),
+}
+
+FLAT_SEARCH_YDL_OPTS = dict(SEARCH_YDL_OPTS, format='best', extract_flat=True)
+
+def format_cards(info):
+    """Подходящие MP4-форматы в порядке показа и тексты их карточек.
+
+    Выполняется в потоке поиска, чтобы не занимать поток интерфейса.
+    """
+    formats = [f for f in info.get('formats', [])
+               if f.get('ext') == 'mp4' and f.get('vcodec') and f.get('vcodec') != 'none']
+    formats.sort(key=lambda x: (
+        -int(x.get('quality', 0) or 0),
+        -float(x.get('tbr', 0) or 0),
+        -(int(x.get('filesize', 0) or 0) if x.get('filesize') is not None else 0),
+        -(int(x.get('filesize_approx', 0) or 0) if x.get('filesize_approx') is not None else 0)
+    ))
+
+    webpage_url = info.get('webpage_url', '').lower()
+    show_dimensions = 'tiktok.com' in webpage_url or 'instagram.com' in webpage_url
+    duration = info.get('duration', 0) or 0
+    cards = []
+    for fmt in formats:
+        height = fmt.get('height', 0)
+        vcodec = fmt.get('vcodec', 'unknown').split('.')[0]
+        if vcodec == 'avc1':
+            vcodec = 'h264'
+
+        filesize = fmt.get('filesize')
+        filesize_approx = fmt.get('filesize_approx')
+        tbr = fmt.get('tbr', 0) or 0
+        if filesize is not None and filesize > 0:
+            size_text = f"📁 {filesize / (1024*1024):.1f} MB"
+        elif filesize_approx is not None and filesize_approx > 0:
+            size_text = f"📁 {filesize_approx / (1024*1024):.1f} MB"
+        elif tbr > 0 and duration > 0:
+            compression_factor = 0.5
+            estimated_size = (tbr * 1024 * duration * compression_factor) / (8 * 1024 * 1024)
+            size_text = f"📁 {estimated_size:.1f} MB"
+        else:
+            size_text = "📁 Размер неизвестен"
+
+        if show_dimensions:
+            # Для TikTok и Instagram показываем размеры видео
+            width = fmt.get('width', 0)
+            dimensions_text = f"📐 {width}x{height}" if width and height else "📐 Размер неизвестен"
+        else:
+            # Для YouTube показываем FPS
+            fps = fmt.get('fps', 0)
+            dimensions_text = f"🎞️ {fps} FPS" if fps else "🎞️ FPS неизвестно"
+
+        cards.append({
+            'format': fmt,
+            'title': f"🎥 {height}p" if height else "🎥 ?",
+            'subtitle': f"MP4 ({vcodec})",
+            'lines': [
+                size_text,
+                dimensions_text,
+                f"📶 {tbr:.0f} Kbps" if tbr > 0 else "📶 Битрейт неизвестен",
+            ],
+        })
+    return cards
+
 class SearchThread(QThread):
-    finished = pyqtSignal(dict)
+    finished = pyqtSignal(dict, list)
     error = pyqtSignal(str)
 
     def __init__(self, url):
         super().__init__()
         self.url = url
+        self._cancelled = False
+
+    def cancel(self):
+        """Отменить поиск: извлечение не прерывается, но его результат не передаётся"""
+        self._cancelled = True
 
     def run(self):
         try:
             # Очищаем URL если это TikTok
             if 'tiktok.com' in self.url:
                 cleaned_url = clean_tiktok_url(self.url)
-                print(f"Оригинальный URL: {self.url}")
-                print(f"Очищенный URL: {cleaned_url}")
+                logger.debug("URL TikTok: %s -> %s", self.url, cleaned_url)
                 self.url = cleaned_url
                 
                 # Проверяем, является ли это фотографией
                 if '/photo/' in self.url:
                     info = get_tiktok_photo_info(self.url)
-                    self.finished.emit(info)
+                    self.finished.emit(info, format_cards(info))
                     return
             
-            ydl_opts = {
-                'quiet': True,
-                'no_warnings': True,
-                'extract_flat': False,
-                'socket_timeout': 30,
-            }
-            
-            # Для TikTok и Instagram добавляем специальные опции
+            # Для TikTok и Instagram — быстрое извлечение информации
             if 'tiktok.com' in self.url or 'instagram.com' in self.url:
-                ydl_opts.update({
-                    'format': 'best',  # Выбираем лучшее качество
-                    'extract_flat': True,  # Быстрое извлечение информации
-                })
+                pool = get_pool('gui_search_flat', FLAT_SEARCH_YDL_OPTS)
+            else:
+                pool = get_pool('gui_search', SEARCH_YDL_OPTS)
             
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            with pool.acquire() as ydl:
                 info = ydl.extract_info(self.url, download=False)
-                self.finished.emit(info)
+            # Полная информация — сотни килобайт JSON: только в режиме отладки
+            # и в этом потоке, а не в потоке интерфейса
+            if self._cancelled:
+                return
+            if info and logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Информация о видео: %s", json.dumps(info, indent=2, ensure_ascii=False),
+                             extra=VERBOSE)
+            self.finished.emit(info, format_cards(info))
         except Exception as e:
+            if self._cancelled:
+                return
             error_msg = str(e)
-            print(f"Ошибка при загрузке: {error_msg}")
+            logger.warning("Ошибка при загрузке: %s", error_msg)
             self.error.emit(error_msg)
 
     def update_info(self, info):
@@ -278,39 +370,72 @@ class SearchThread(QThread):
             self.date_label.setText("📅 Дата неизвестна")
         
         # Загружаем превью
-        if is_tiktok:
-            # Для TikTok используем thumbnail из информации
-            thumbnails = info.get('thumbnails', [])
-            if thumbnails:
-                # Берем последний thumbnail (обычно лучшего качества)
-                thumbnail_url = thumbnails[-1].get('url')
-                if thumbnail_url:
-                    if self.thumbnail_loader is not None:
-                        self.thumbnail_loader.quit()
-                    self.thumbnail_loader = ThumbnailLoader(thumbnail_url)
-                    self.thumbnail_loader.thumbnail_loaded.connect(self.set_thumbnail)
-                    self.thumbnail_loader.start()
-        else:
-            # Для YouTube используем стандартную логику
-            if 'id' in info:
-                video_id = info['id']
-                # Пробуем разные размеры превью
-                thumbnail_urls = [
-                    f"https://i.ytimg.com/vi/{video_id}/maxresdefault.jpg",
-                    f"https://i.ytimg.com/vi/{video_id}/hqdefault.jpg",
-                    f"https://i.ytimg.com/vi/{video_id}/mqdefault.jpg"
-                ]
-                
-                if self.thumbnail_loader is not None:
-                    self.thumbnail_loader.quit()
-                self.thumbnail_loader = ThumbnailLoader(thumbnail_urls[0])  # Начинаем с maxresdefault
-                self.thumbnail_loader.thumbnail_loaded.connect(self.set_thumbnail)
-                self.thumbnail_loader.start()
+        self.load_thumbnail(info)
+
+# Число соединений на одно скачивание
+DOWNLOAD_CONNECTIONS = 4
+
+# Ограничение скорости скачивания, байт в секунду (0 — без ограничения)
+BANDWIDTH_LIMIT = 0
+bandwidth = BandwidthScheduler(rate=BANDWIDTH_LIMIT)
+
+# Журнал незавершённых скачиваний: если программу закрыли во время
+# скачивания, при следующем запуске его можно продолжить с места остановки
+PENDING_DOWNLOADS_FILE = os.path.join(os.path.expanduser('~'), '.video-downloader', 'pending.json')
+
+def load_pending_downloads():
+    try:
+        with open(PENDING_DOWNLOADS_FILE, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return []
+
+def save_pending_downloads(items):
+    os.makedirs(os.path.dirname(PENDING_DOWNLOADS_FILE), exist_ok=True)
+    tmp = PENDING_DOWNLOADS_FILE + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(items, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, PENDING_DOWNLOADS_FILE)
+
+def remember_download(url, format_id, output_path):
+    items = [item for item in load_pending_downloads() if item['output_path'] != output_path]
+    items.append({'url': url, 'format_id': format_id, 'output_path': output_path})
+    save_pending_downloads(items)
+
+def forget_download(output_path):
+    items = load_pending_downloads()
+    remaining = [item for item in items if item['output_path'] != output_path]
+    if len(remaining) != len(items):
+        save_pending_downloads(remaining)
+
+def discard_partial_files(output_path):
+    """Удалить недокачанные файлы скачивания (.part, .ytdl, сегменты, потоки video/audio)"""
+    base = os.path.splitext(output_path)[0]
+    for path in glob.glob(glob.escape(base) + '.*'):
+        suffix = path[len(base):]
+        if '.part' in suffix or suffix.endswith('.ytdl') or re.match(r'\.f[^.]+\.\w+$', suffix):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+# Упреждающий поиск: через сколько миллисекунд после изменения URL он
+# начинается и сколько секунд его результат считается свежим
+PREFETCH_DELAY_MS = 400
+PREFETCH_MAX_AGE = 300
+
+# Сколько скачиваний выполняется одновременно (меняется в панели загрузок)
+MAX_PARALLEL_DOWNLOADS = 2
+# Не чаще чем раз в столько секунд поток скачивания сообщает о прогрессе
+PROGRESS_SIGNAL_INTERVAL = 0.1
+# Как часто при выходе проверяется, остановились ли потоки скачивания (мс)
+SHUTDOWN_POLL_MS = 100
 
 class DownloadThread(QThread):
-    progress = pyqtSignal(float)
+    progress = pyqtSignal(float, float)  # доля от 0 до 1, скорость в байтах в секунду
     finished = pyqtSignal()
     error = pyqtSignal(str)
+    cancelled = pyqtSignal()
 
     def __init__(self, url, format_id, output_path):
         super().__init__()
@@ -318,6 +443,12 @@ class DownloadThread(QThread):
         self.format_id = format_id
         self.output_path = output_path
         self.is_cancelled = False
+        # При паузе недокачанные файлы остаются, чтобы продолжить с того же места
+        self.keep_partial_files = False
+        self._last_progress = 0.0
+        # Отмена кооперативная: загрузчики проверяют событие между блоками
+        # данных и перед запуском ffmpeg, поэтому поток завершается сам
+        self.stop_event = threading.Event()
 
     def run(self):
         try:
@@ -328,39 +459,246 @@ class DownloadThread(QThread):
                 'postprocessor_args': ['-c', 'copy'],
                 'quiet': True,
                 'no_warnings': True,
-                'progress_hooks': [self.progress_hook]
+                # Недокачанные .part, .ytdl и сегменты продолжаются, а не качаются заново
+                'continuedl': True,
+                'concurrent_fragment_downloads': DOWNLOAD_CONNECTIONS,
+                'progress_hooks': [self.progress_hook],
+                'logger': YdlLogger(),
             }
 
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                if not self.is_cancelled:  # Проверяем перед началом загрузки
-                    ydl.download([self.url])
-                    if not self.is_cancelled:  # Проверяем после загрузки
-                        self.finished.emit()
+            # Крупные файлы качаются в несколько соединений
+            with bandwidth.job(id(self)) as throttle, \
+                    SegmentedYoutubeDL(ydl_opts, connections=DOWNLOAD_CONNECTIONS, stop=self.stop_event,
+                                       throttle=throttle) as ydl:
+                ydl.download([self.url])
+            self.finished.emit()
         except Exception as e:
-            if not self.is_cancelled:  # Отправляем ошибку только если не было отмены
+            if isinstance(e, DownloadCancelled) or self.is_cancelled:
+                # Соединения уже закрыты — удаляем недокачанные файлы
+                if not self.keep_partial_files:
+                    discard_partial_files(self.output_path)
+                self.cancelled.emit()
+            else:
                 self.error.emit(str(e))
 
     def progress_hook(self, d):
-        if self.is_cancelled:  # Проверяем отмену перед обновлением прогресса
-            return
-            
+        if self.is_cancelled:  # Прерываем загрузку из хука прогресса
+            raise DownloadCancelled('Загрузка отменена')
+
         if d['status'] == 'downloading':
             total_bytes = d.get('total_bytes') or d.get('total_bytes_estimate', 0)
             downloaded_bytes = d.get('downloaded_bytes', 0)
             
-            if total_bytes > 0:
-                progress = (downloaded_bytes / total_bytes) * 100
+            # Хук вызывается на каждый блок данных: сигналы в интерфейс
+            # реже, чтобы несколько скачиваний не заваливали его событиями
+            now = time.monotonic()
+            if total_bytes > 0 and now - self._last_progress >= PROGRESS_SIGNAL_INTERVAL:
+                self._last_progress = now
                 # Ограничиваем прогресс до 100%
-                progress = min(progress, 100)
-                self.progress.emit(progress / 100)
+                self.progress.emit(min(downloaded_bytes / total_bytes, 1.0), float(d.get('speed') or 0))
         
         elif d['status'] == 'finished':
-            self.progress.emit(1.0)
+            self.progress.emit(1.0, 0.0)
 
     def cancel(self):
+        """Запросить отмену; по завершении поток отправит сигнал cancelled"""
         self.is_cancelled = True
-        self.terminate()
-        self.wait()
+        self.stop_event.set()
+
+    def pause(self):
+        """Остановить скачивание, сохранив недокачанные файлы (сигнал cancelled)"""
+        self.keep_partial_files = True
+        self.cancel()
+
+def format_speed(speed):
+    if speed >= 1024 * 1024:
+        return f"{speed / (1024 * 1024):.1f} MB/s"
+    return f"{speed / 1024:.0f} KB/s"
+
+class DownloadJob:
+    """Скачивание в очереди менеджера загрузок"""
+
+    def __init__(self, url, format_id, output_path):
+        self.url = url
+        self.format_id = format_id
+        self.output_path = output_path
+        self.name = os.path.basename(output_path)
+        # queued, running, pausing, paused, cancelling, finished, error, cancelled
+        self.state = 'queued'
+        self.progress = 0.0
+        self.speed = 0.0
+        self.error = None
+        self.thread = None
+
+    @property
+    def is_active(self):
+        return self.state in ('queued', 'running', 'pausing', 'paused', 'cancelling')
+
+class DownloadManager(QObject):
+    """Очередь скачиваний: не больше max_parallel одновременно, остальные ждут по порядку.
+
+    Каждое скачивание — свой DownloadThread; пауза останавливает поток,
+    оставляя недокачанные файлы, и продолжение начинается с того же места.
+    Незавершённые скачивания хранятся в журнале до конца или отмены.
+    """
+
+    changed = pyqtSignal()  # добавление, удаление или перестановка
+    job_updated = pyqtSignal(object)
+    stopped = pyqtSignal()  # после shutdown() все потоки завершились
+
+    def __init__(self, max_parallel=MAX_PARALLEL_DOWNLOADS, parent=None):
+        super().__init__(parent)
+        self.max_parallel = max(1, max_parallel)
+        self.jobs = []
+        self.shutting_down = False
+
+    def add(self, url, format_id, output_path):
+        for job in self.jobs:
+            if job.output_path == output_path and job.is_active:
+                return job
+        # Запоминаем скачивание до начала, чтобы продолжить его после перезапуска
+        remember_download(url, format_id, output_path)
+        job = DownloadJob(url, format_id, output_path)
+        self.jobs.append(job)
+        self.changed.emit()
+        self._schedule()
+        return job
+
+    def set_max_parallel(self, value):
+        self.max_parallel = max(1, value)
+        self._schedule()
+
+    def running(self):
+        return [job for job in self.jobs if job.state in ('running', 'pausing', 'cancelling')]
+
+    def total_speed(self):
+        return sum(job.speed for job in self.jobs if job.state == 'running')
+
+    def _schedule(self):
+        if self.shutting_down:
+            return
+        free = self.max_parallel - len(self.running())
+        for job in self.jobs:
+            if free <= 0:
+                break
+            if job.state == 'queued':
+                self._start(job)
+                free -= 1
+
+    def _start(self, job):
+        if job.thread is not None:
+            # Прошлый поток (до паузы) уже отправил последний сигнал
+            job.thread.wait()
+        job.state = 'running'
+        job.speed = 0.0
+        job.error = None
+        thread = job.thread = DownloadThread(job.url, job.format_id, job.output_path)
+        thread.progress.connect(lambda progress, speed: self._on_progress(job, progress, speed))
+        thread.finished.connect(lambda: self._on_done(job, 'finished'))
+        thread.error.connect(lambda message: self._on_done(job, 'error', message))
+        thread.cancelled.connect(lambda: self._on_cancelled(job))
+        thread.start()
+        self.job_updated.emit(job)
+
+    def _on_progress(self, job, progress, speed):
+        if job.state != 'running':
+            return
+        job.progress = max(job.progress, progress)
+        job.speed = speed
+        self.job_updated.emit(job)
+
+    def _on_done(self, job, state, error=None):
+        forget_download(job.output_path)
+        job.state = state
+        job.error = error
+        job.speed = 0.0
+        if state == 'finished':
+            job.progress = 1.0
+        self.job_updated.emit(job)
+        self._schedule()
+
+    def _on_cancelled(self, job):
+        job.speed = 0.0
+        if job.state == 'pausing':
+            job.state = 'paused'
+        else:
+            forget_download(job.output_path)
+            job.state = 'cancelled'
+        self.job_updated.emit(job)
+        self._schedule()
+
+    def pause(self, job):
+        if job.state == 'running':
+            job.state = 'pausing'
+            job.thread.pause()
+        elif job.state == 'queued':
+            job.state = 'paused'
+        self.job_updated.emit(job)
+        self._schedule()
+
+    def resume(self, job):
+        if job.state == 'paused':
+            job.state = 'queued'
+            self.job_updated.emit(job)
+            self._schedule()
+
+    def cancel(self, job):
+        if job.state in ('running', 'pausing'):
+            job.state = 'cancelling'
+            # Отмена во время паузы всё-таки удаляет недокачанное
+            job.thread.keep_partial_files = False
+            job.thread.cancel()
+            self.job_updated.emit(job)
+        elif job.state in ('queued', 'paused'):
+            # Поток не выполняется: после паузы остались недокачанные файлы
+            discard_partial_files(job.output_path)
+            forget_download(job.output_path)
+            job.state = 'cancelled'
+            self.job_updated.emit(job)
+
+    def remove(self, job):
+        """Убрать завершённое скачивание из списка"""
+        if job.is_active:
+            return
+        if job.thread is not None:
+            job.thread.wait()
+        self.jobs.remove(job)
+        self.changed.emit()
+
+    def move(self, job, delta):
+        """Передвинуть скачивание в очереди на delta позиций"""
+        index = self.jobs.index(job)
+        target = max(0, min(len(self.jobs) - 1, index + delta))
+        if target != index:
+            self.jobs.insert(target, self.jobs.pop(index))
+            self.changed.emit()
+
+    def busy(self):
+        """Есть ли ещё работающие потоки скачивания"""
+        return any(job.thread is not None and job.thread.isRunning() for job in self.jobs)
+
+    def shutdown(self):
+        """Остановить скачивания при выходе; журнал продолжит их при следующем запуске.
+
+        Не ждёт потоки: поток может заканчивать склейку ffmpeg. Если после
+        вызова busy() истинно, по завершении всех потоков придёт сигнал stopped.
+        """
+        self.shutting_down = True
+        for job in self.jobs:
+            if job.state == 'running':
+                job.state = 'pausing'
+                job.thread.pause()
+        if self.busy():
+            QTimer.singleShot(SHUTDOWN_POLL_MS, self._wait_stopped)
+
+    def _wait_stopped(self):
+        if self.busy():
+            QTimer.singleShot(SHUTDOWN_POLL_MS, self._wait_stopped)
+            return
+        for job in self.jobs:
+            if job.thread is not None:
+                job.thread.wait()
+        self.stopped.emit()
 
 def sanitize_filename(filename):
     # Заменяем недопустимые символы на безопасные
@@ -370,167 +708,202 @@ def sanitize_filename(filename):
     # Ограничиваем длину имени файла
     return filename[:200]  # Оставляем место для расширения
 
-class VideoInfoWidget(QFrame):
-    def __init__(self, format_info, parent=None):
-        super().__init__(parent)
-        self.format_info = format_info
-        self.setup_ui()
+# Кэш превью: уменьшенные картинки в памяти и на диске, ключ — видео,
+# вариант превью и размер, в котором его показывают
+THUMBNAIL_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.video-downloader', 'thumbnails')
+THUMBNAIL_MEMORY_LIMIT = 32 * 1024 * 1024
+THUMBNAIL_DISK_LIMIT = 64 * 1024 * 1024
 
-    def setup_ui(self):
-        self.setFrameShape(QFrame.Shape.StyledPanel)
-        self.setFixedSize(240, 240)  # Размер карточки
-        self.setStyleSheet("""
-            QFrame {
-                background-color: #1e1e1e;
-                border-radius: 12px;
-                padding: 20px 24px;
-                margin: 0px;
-            }
-            QLabel {
-                color: #FFFFFF;
-                padding: 0px;
-                margin: 0px;
-            }
-            QLabel.title {
-                color: white;
-                font-size: 20px;
-                font-weight: 600;
-            }
-            QLabel.format {
-                color: #999999;
-                font-size: 13px;
-                font-weight: 400;
-            }
-            QLabel.info {
-                color: #CCCCCC;
-                font-size: 14px;
-                font-weight: 400;
-            }
-            QPushButton {
-                background-color: #1DB954;
-                color: white;
-                border: none;
-                border-radius: 8px;
-                font-size: 14px;
-                font-weight: 600;
-                padding: 10px 0;
-                margin-top: 18px;
-            }
-            QPushButton:hover {
-                background-color: #17a74a;
-            }
-        """)
+# Варианты превью YouTube от лучшего к худшему: maxresdefault есть не у всех видео
+YOUTUBE_THUMBNAIL_LADDER = ('maxresdefault', 'sddefault', 'hqdefault', 'mqdefault', 'default')
 
-        main_layout = QVBoxLayout()
-        main_layout.setSpacing(4)  # Уменьшенный отступ между элементами
-        main_layout.setContentsMargins(24, 20, 24, 20)  # Отступы как в дизайне
-        
-        # Заголовок с разрешением
-        height = self.format_info.get('height', '?')
-        resolution_text = f"{height}p"
-        title_label = QLabel("🎥 " + resolution_text)
-        title_label.setProperty("class", "title")
+def youtube_thumbnail_candidates(video_id):
+    return [(f"youtube-{video_id}-{name}", f"https://i.ytimg.com/vi/{video_id}/{name}.jpg")
+            for name in YOUTUBE_THUMBNAIL_LADDER]
 
-        # Размер файла
-        filesize = self.format_info.get('filesize', 0)
-        filesize_approx = self.format_info.get('filesize_approx', 0)
-        tbr = self.format_info.get('tbr', 0)
-        duration = self.format_info.get('duration', 0)
-        
-        if filesize > 0:
-            size_text = f"📁 {filesize / (1024*1024):.1f} MB"
-        elif filesize_approx > 0:
-            size_text = f"📁 {filesize_approx / (1024*1024):.1f} MB"
-        elif tbr > 0 and duration > 0:
-            # Если есть битрейт и длительность, можем оценить размер
-            estimated_size = (tbr * 1024 * duration) / (8 * 1024)  # Конвертируем в МБ
-            size_text = f"📁 {estimated_size:.1f} MB"
-        else:
-            size_text = "📁 Размер неизвестен"
-        size_label = QLabel(size_text)
-        size_label.setProperty("class", "info")
-        
-        # Размеры видео
-        width = self.format_info.get('width', 0)
-        height = self.format_info.get('height', 0)
-        if width and height:
-            dimensions_text = f"📐 {width}x{height}"
-        else:
-            dimensions_text = "📐 Размер неизвестен"
-        dimensions_label = QLabel(dimensions_text)
-        dimensions_label.setProperty("class", "info")
-        
-        # Аудиокодек
-        acodec = self.format_info.get('acodec', 'none')
-        if acodec != 'none':
-            if acodec == 'mp4a.40.2':
-                acodec = 'AAC'
-            elif acodec == 'opus':
-                acodec = 'Opus'
-            audio_text = f"🔊 {acodec}"
-        else:
-            audio_text = "🔇 Без звука"
-        audio_label = QLabel(audio_text)
-        audio_label.setProperty("class", "info")
-        
-        # Добавляем элементы в layout
-        main_layout.addWidget(title_label)
-        main_layout.addSpacing(12)  # Отступ перед информационными строками
-        main_layout.addWidget(size_label)
-        main_layout.addWidget(dimensions_label)
-        main_layout.addWidget(audio_label)
-        main_layout.addStretch()
-        
-        # Кнопка скачивания
-        download_btn = QPushButton("⬇ Скачать видео")
-        download_btn.clicked.connect(self.start_download)
-        main_layout.addWidget(download_btn)
-        
-        self.setLayout(main_layout)
-
-    def start_download(self):
-        main_window = None
-        parent = self.parent()
-        while parent is not None:
-            if isinstance(parent, MainWindow):  # Changed from YouTubeDownloader to MainWindow
-                main_window = parent
+def thumbnail_candidates(info):
+    """Превью видео в порядке предпочтения: список (ключ кэша, URL)."""
+    video_id = info.get('id')
+    candidates = []
+    extractor = (info.get('extractor_key') or info.get('extractor') or '').lower()
+    if video_id and (extractor.startswith('youtube') or 'youtube.com' in info.get('webpage_url', '')):
+        candidates = youtube_thumbnail_candidates(video_id)
+    # Превью из информации yt-dlp: последние обычно лучшего качества
+    thumbnails = [t for t in info.get('thumbnails') or [] if t.get('url')]
+    for index, thumbnail in reversed(list(enumerate(thumbnails))):
+        key = f"{extractor or 'video'}-{video_id}-{thumbnail.get('id', index)}" if video_id else thumbnail['url']
+        candidates.append((key, thumbnail['url']))
+    if not candidates and info.get('thumbnail'):
+        candidates.append((f"{extractor or 'video'}-{video_id}" if video_id else info['thumbnail'], info['thumbnail']))
+    unique = []
+    urls = set()
+    for key, url in candidates:
+        if url not in urls:
+            urls.add(url)
+            unique.append((key, url))
+    return unique
+
+class ThumbnailCache:
+    """LRU-кэш уменьшенных превью (QImage) в памяти и JPEG-файлов на диске.
+
+    Оба уровня ограничены по размеру. Методы можно вызывать из любого
+    потока: QImage, в отличие от QPixmap, не привязан к потоку интерфейса.
+    """
+
+    def __init__(self, directory=THUMBNAIL_CACHE_DIR, memory_limit=THUMBNAIL_MEMORY_LIMIT,
+                 disk_limit=THUMBNAIL_DISK_LIMIT):
+        self.directory = directory
+        self.memory_limit = memory_limit
+        self.disk_limit = disk_limit
+        self._images = OrderedDict()
+        self._memory_size = 0
+        # Варианты, которых у видео нет (404), чтобы не запрашивать их снова
+        self._missing = set()
+        self._lock = threading.Lock()
+        self._session = requests.Session()
+        self._session.mount('https://', requests.adapters.HTTPAdapter(pool_maxsize=8))
+
+    def _path(self, key, size):
+        digest = hashlib.sha1(f"{key}@{size.width()}x{size.height()}".encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, f"{digest}.jpg")
+
+    def get(self, key, size):
+        cache_key = (key, size.width(), size.height())
+        with self._lock:
+            image = self._images.get(cache_key)
+            if image is not None:
+                self._images.move_to_end(cache_key)
+                return image
+        if not self.directory:
+            return None
+        path = self._path(key, size)
+        image = QImage(path)
+        if image.isNull():
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self._remember(cache_key, image)
+        return image
+
+    def _remember(self, cache_key, image):
+        with self._lock:
+            previous = self._images.pop(cache_key, None)
+            if previous is not None:
+                self._memory_size -= previous.sizeInBytes()
+            self._images[cache_key] = image
+            self._memory_size += image.sizeInBytes()
+            while self._memory_size > self.memory_limit and len(self._images) > 1:
+                _, old = self._images.popitem(last=False)
+                self._memory_size -= old.sizeInBytes()
+
+    def put(self, key, size, image):
+        self._remember((key, size.width(), size.height()), image)
+        if not self.directory:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = self._path(key, size)
+            tmp_path = f"{path}.tmp"
+            if image.save(tmp_path, 'JPG', 90):
+                os.replace(tmp_path, path)
+                self._prune_disk()
+        except OSError as e:
+            logger.warning("Не удалось сохранить превью в кэш: %s", e)
+
+    def _prune_disk(self):
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.jpg'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        for _, file_size, path in sorted(entries):
+            if total <= self.disk_limit:
                 break
-            parent = parent.parent()
-        
-        if main_window:
-            main_window.start_download(self.format_info)
+            try:
+                os.remove(path)
+                total -= file_size
+            except OSError:
+                pass
+
+    def fetch(self, candidates, size, cancelled=lambda: False):
+        """Первое доступное превью из candidates, уменьшенное до size (или None).
+
+        Скачивает в память, декодирует и уменьшает в вызывающем потоке;
+        недоступные варианты пропускаются.
+        """
+        for key, url in candidates:
+            if cancelled():
+                return None
+            image = self.get(key, size)
+            if image is not None:
+                return image
+            if key in self._missing:
+                continue
+            try:
+                response = self._session.get(url, timeout=10)
+            except requests.RequestException as e:
+                logger.debug("Превью %s недоступно: %s", url, e)
+                continue
+            if response.status_code in (403, 404, 410):
+                self._missing.add(key)
+                continue
+            if not response.ok:
+                continue
+            image = QImage.fromData(response.content)
+            if image.isNull():
+                self._missing.add(key)
+                continue
+            image = scale_thumbnail(image, size)
+            self.put(key, size, image)
+            return image
+        return None
+
+def scale_thumbnail(image, size):
+    """Уменьшить картинку до size с обрезкой краёв по центру."""
+    scaled = image.scaled(size, Qt.AspectRatioMode.KeepAspectRatioByExpanding,
+                          Qt.TransformationMode.SmoothTransformation)
+    x = (scaled.width() - size.width()) // 2
+    y = (scaled.height() - size.height()) // 2
+    return scaled.copy(x, y, size.width(), size.height())
+
+thumbnail_cache = ThumbnailCache()
 
 class ThumbnailLoader(QThread):
-    thumbnail_loaded = pyqtSignal(QPixmap)
-    
-    def __init__(self, url):
-        super().__init__()
-        self.url = url
-        
+    """Загрузка превью в фоне: скачивание, декодирование и уменьшение вне потока интерфейса."""
+
+    thumbnail_loaded = pyqtSignal(QImage)
+
+    def __init__(self, candidates, size, parent=None):
+        super().__init__(parent)
+        self.candidates = candidates
+        self.size = size
+        self._cancelled = False
+        # Выставляется в конце run(): после этого объект Qt может быть уже удалён
+        self.done = False
+        self.finished.connect(self.deleteLater)
+
+    def cancel(self):
+        self._cancelled = True
+
     def run(self):
         try:
-            # Создаем временный файл для превью
-            temp_path = "temp_thumbnail.jpg"
-            
-            # Скачиваем превью
-            urllib.request.urlretrieve(self.url, temp_path)
-            
-            # Загружаем в QPixmap
-            pixmap = QPixmap(temp_path)
-            if not pixmap.isNull():
-                self.thumbnail_loaded.emit(pixmap)
-            
-            # Удаляем временный файл
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
-                
+            image = thumbnail_cache.fetch(self.candidates, self.size, lambda: self._cancelled)
+            if image is not None and not self._cancelled:
+                self.thumbnail_loaded.emit(image)
         except Exception as e:
-            print(f"Ошибка загрузки превью: {str(e)}")
+            logger.warning("Ошибка загрузки превью: %s", e)
+        finally:
+            self.done = True
 
 class VideoInfoHeader(QWidget):
     def __init__(self, parent=None):
         super().__init__(parent)
         self.thumbnail_loader = None
+        self.prefetch_loader = None
         self.setup_ui()
         
     def setup_ui(self):
@@ -703,40 +1076,76 @@ class VideoInfoHeader(QWidget):
             self.date_label.setText("📅 Дата неизвестна")
         
         # Загружаем превью
-        if is_tiktok:
-            # Для TikTok используем thumbnail из информации
-            thumbnails = info.get('thumbnails', [])
-            if thumbnails:
-                # Берем последний thumbnail (обычно лучшего качества)
-                thumbnail_url = thumbnails[-1].get('url')
-                if thumbnail_url:
-                    if self.thumbnail_loader is not None:
-                        self.thumbnail_loader.quit()
-                    self.thumbnail_loader = ThumbnailLoader(thumbnail_url)
-                    self.thumbnail_loader.thumbnail_loaded.connect(self.set_thumbnail)
-                    self.thumbnail_loader.start()
-        else:
-            # Для YouTube используем стандартную логику
-            if 'id' in info:
-                video_id = info['id']
-                # Пробуем разные размеры превью
-                thumbnail_urls = [
-                    f"https://i.ytimg.com/vi/{video_id}/maxresdefault.jpg",
-                    f"https://i.ytimg.com/vi/{video_id}/hqdefault.jpg",
-                    f"https://i.ytimg.com/vi/{video_id}/mqdefault.jpg"
-                ]
-                
-                if self.thumbnail_loader is not None:
-                    self.thumbnail_loader.quit()
-                self.thumbnail_loader = ThumbnailLoader(thumbnail_urls[0])  # Начинаем с maxresdefault
-                self.thumbnail_loader.thumbnail_loaded.connect(self.set_thumbnail)
-                self.thumbnail_loader.start()
+        self.load_thumbnail(info)
     
-    def set_thumbnail(self, pixmap):
+    def thumbnail_size(self):
+        # Превью уменьшается сразу до размера на экране с учётом масштаба
+        return self.preview.size() * self.devicePixelRatioF()
+
+    def cached_thumbnail(self, candidates):
+        size = self.thumbnail_size()
+        for key, _ in candidates:
+            image = thumbnail_cache.get(key, size)
+            if image is not None:
+                return image
+        return None
+
+    def load_thumbnail(self, info):
+        """Загрузить превью видео в фоне (из кэша — сразу)"""
+        if self.thumbnail_loader is not None:
+            self.thumbnail_loader.cancel()
+            self.thumbnail_loader = None
+        # Превью прошлого видео не должно оставаться на месте нового
+        self.preview.clear()
+        candidates = thumbnail_candidates(info)
+        if not candidates:
+            return
+        image = self.cached_thumbnail(candidates)
+        if image is not None:
+            self.set_thumbnail(image)
+            return
+        # Превью этого видео уже загружается заранее — дожидаемся его
+        loader = self.prefetch_loader
+        self.prefetch_loader = None
+        if (loader is not None and not loader.done and loader.size == self.thumbnail_size()
+                and candidates[:len(loader.candidates)] == loader.candidates):
+            self.thumbnail_loader = loader
+            loader.thumbnail_loaded.connect(self.set_thumbnail)
+            # Загрузка могла завершиться до подключения сигнала
+            image = self.cached_thumbnail(candidates)
+            if image is not None:
+                self.set_thumbnail(image)
+            return
+        self.cancel_prefetch()
+        self.thumbnail_loader = ThumbnailLoader(candidates, self.thumbnail_size(), self)
+        self.thumbnail_loader.thumbnail_loaded.connect(self.set_thumbnail)
+        self.thumbnail_loader.start()
+
+    def prefetch_thumbnail(self, candidates):
+        """Заранее загрузить превью в кэш, не показывая его"""
+        if not candidates or self.cached_thumbnail(candidates) is not None:
+            return
+        loader = self.prefetch_loader
+        if loader is not None and not loader.done and loader.candidates == candidates:
+            return
+        self.cancel_prefetch()
+        self.prefetch_loader = ThumbnailLoader(candidates, self.thumbnail_size(), self)
+        self.prefetch_loader.start()
+
+    def cancel_prefetch(self):
+        if self.prefetch_loader is not None:
+            self.prefetch_loader.cancel()
+            self.prefetch_loader = None
+
+    def set_thumbnail(self, image):
         """Установить загруженное превью"""
-        if not pixmap.isNull():
+        loader = self.sender()
+        if isinstance(loader, ThumbnailLoader) and loader is not self.thumbnail_loader:
+            return
+        if not image.isNull():
             # Создаем новый pixmap с закругленными углами
-            rounded_pixmap = QPixmap(self.preview.size())
+            ratio = self.devicePixelRatioF()
+            rounded_pixmap = QPixmap(image.size())
             rounded_pixmap.fill(Qt.GlobalColor.transparent)
             
             painter = QPainter(rounded_pixmap)
@@ -744,19 +1153,319 @@ class VideoInfoHeader(QWidget):
             
             # Создаем путь с закругленными углами
             path = QPainterPath()
-            path.addRoundedRect(0, 0, self.preview.width(), self.preview.height(), 8, 8)
+            path.addRoundedRect(0, 0, image.width(), image.height(), 8 * ratio, 8 * ratio)
             
-            # Отрисовываем изображение с маской
+            # Отрисовываем изображение с маской (уже нужного размера)
             painter.setClipPath(path)
-            painter.drawPixmap(0, 0, pixmap.scaled(
-                self.preview.size(),
-                Qt.AspectRatioMode.KeepAspectRatioByExpanding,
-                Qt.TransformationMode.SmoothTransformation
-            ))
+            painter.drawImage(0, 0, image)
             painter.end()
             
+            rounded_pixmap.setDevicePixelRatio(ratio)
             self.preview.setPixmap(rounded_pixmap)
-            print("\nПревью успешно установлено")
+
+class FormatListModel(QAbstractListModel):
+    """Карточки форматов (словари из format_cards) для сетки форматов"""
+
+    CardRole = Qt.ItemDataRole.UserRole + 1
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.cards = []
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.cards)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        card = self.cards[index.row()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            return card['title']
+        if role == self.CardRole:
+            return card
+        return None
+
+    def set_cards(self, cards):
+        # Одна перестройка модели вместо удаления и создания виджетов по одному
+        self.beginResetModel()
+        self.cards = list(cards)
+        self.endResetModel()
+
+class FormatCardDelegate(QStyledItemDelegate):
+    """Рисует карточку формата вместо отдельного QFrame с надписями и стилями на каждую"""
+
+    CARD_SIZE = QSize(220, 208)
+    MARGIN = 20
+    BUTTON_HEIGHT = 35
+    BUTTON_TEXT = "⬇ Скачать видео"
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.title_font = QFont('Arial')
+        self.title_font.setPixelSize(24)
+        self.title_font.setWeight(QFont.Weight.DemiBold)
+        self.text_font = QFont('Arial')
+        self.text_font.setPixelSize(14)
+        self.button_font = QFont(self.text_font)
+        self.button_font.setWeight(QFont.Weight.DemiBold)
+        self.title_height = QFontMetrics(self.title_font).height()
+        self.text_height = QFontMetrics(self.text_font).height()
+        # Строка, над кнопкой которой сейчас курсор
+        self.hovered_row = None
+
+    def sizeHint(self, option, index):
+        return self.CARD_SIZE
+
+    def card_rect(self, rect):
+        """Карточка по центру ячейки сетки"""
+        card = QRect(0, 0, self.CARD_SIZE.width(), self.CARD_SIZE.height())
+        card.moveCenter(rect.center())
+        return card
+
+    def button_rect(self, rect):
+        card = self.card_rect(rect)
+        return QRect(card.left() + self.MARGIN, card.bottom() + 1 - self.MARGIN - self.BUTTON_HEIGHT,
+                     card.width() - 2 * self.MARGIN, self.BUTTON_HEIGHT)
+
+    def paint(self, painter, option, index):
+        card = index.data(FormatListModel.CardRole)
+        if card is None:
+            return
+        enabled = bool(option.state & QStyle.StateFlag.State_Enabled)
+        rect = self.card_rect(option.rect)
+        painter.save()
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        painter.setPen(Qt.PenStyle.NoPen)
+        painter.setBrush(QColor('#2A2A2A'))
+        painter.drawRoundedRect(QRectF(rect), 12, 12)
+
+        text_width = rect.width() - 2 * self.MARGIN
+        x = rect.left() + self.MARGIN
+        y = rect.top() + self.MARGIN
+        painter.setFont(self.title_font)
+        painter.setPen(QColor('#FFFFFF'))
+        painter.drawText(QRect(x, y, text_width, self.title_height), Qt.AlignmentFlag.AlignLeft, card['title'])
+        y += self.title_height + 1
+
+        painter.setFont(self.text_font)
+        painter.setPen(QColor('#999999'))
+        painter.drawText(QRect(x, y, text_width, self.text_height), Qt.AlignmentFlag.AlignLeft, card['subtitle'])
+        y += self.text_height + 4
+
+        painter.setPen(QColor('#CCCCCC'))
+        for line in card['lines']:
+            painter.drawText(QRect(x, y, text_width, self.text_height), Qt.AlignmentFlag.AlignLeft, line)
+            y += self.text_height + 1
+
+        button = self.button_rect(option.rect)
+        if not enabled:
+            color = '#404040'
+        elif self.hovered_row == index.row():
+            color = '#17a74a'
+        else:
+            color = '#1DB954'
+        painter.setPen(Qt.PenStyle.NoPen)
+        painter.setBrush(QColor(color))
+        painter.drawRoundedRect(QRectF(button), 8, 8)
+        painter.setFont(self.button_font)
+        painter.setPen(QColor('#FFFFFF'))
+        painter.drawText(button, Qt.AlignmentFlag.AlignCenter, self.BUTTON_TEXT)
+        painter.restore()
+
+class FormatGridView(QListView):
+    """Сетка карточек форматов: рисуются только видимые карточки, обработка нажатий на их кнопки"""
+
+    download_requested = pyqtSignal(dict)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setViewMode(QListView.ViewMode.IconMode)
+        self.setFlow(QListView.Flow.LeftToRight)
+        self.setWrapping(True)
+        self.setResizeMode(QListView.ResizeMode.Adjust)
+        self.setMovement(QListView.Movement.Static)
+        self.setUniformItemSizes(True)
+        # Ячейка сетки на 16 пикселей больше карточки — отступы между карточками
+        self.setGridSize(FormatCardDelegate.CARD_SIZE + QSize(16, 16))
+        self.setSelectionMode(QListView.SelectionMode.NoSelection)
+        self.setFocusPolicy(Qt.FocusPolicy.NoFocus)
+        self.setVerticalScrollMode(QListView.ScrollMode.ScrollPerPixel)
+        self.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
+        self.setMouseTracking(True)
+        self.setViewportMargins(12, 0, 0, 12)
+        self.card_delegate = FormatCardDelegate(self)
+        self.setItemDelegate(self.card_delegate)
+
+    def _button_index(self, pos):
+        """Карточка, на кнопку которой указывает pos, или недействительный индекс"""
+        index = self.indexAt(pos)
+        if index.isValid() and self.card_delegate.button_rect(self.visualRect(index)).contains(pos):
+            return index
+        return QModelIndex()
+
+    def _set_hovered(self, row):
+        if row != self.card_delegate.hovered_row:
+            self.card_delegate.hovered_row = row
+            self.viewport().setCursor(Qt.CursorShape.PointingHandCursor if row is not None
+                                      else Qt.CursorShape.ArrowCursor)
+            self.viewport().update()
+
+    def mouseMoveEvent(self, event):
+        index = self._button_index(event.position().toPoint())
+        self._set_hovered(index.row() if index.isValid() else None)
+        super().mouseMoveEvent(event)
+
+    def leaveEvent(self, event):
+        self._set_hovered(None)
+        super().leaveEvent(event)
+
+    def mouseReleaseEvent(self, event):
+        index = self._button_index(event.position().toPoint())
+        if event.button() == Qt.MouseButton.LeftButton and index.isValid():
+            self.download_requested.emit(index.data(FormatListModel.CardRole)['format'])
+        super().mouseReleaseEvent(event)
+
+DOWNLOAD_STATE_TEXT = {
+    'queued': 'В очереди',
+    'running': 'Загрузка',
+    'pausing': 'Приостановка...',
+    'paused': 'Пауза',
+    'cancelling': 'Отмена...',
+    'finished': 'Готово',
+    'error': 'Ошибка',
+    'cancelled': 'Отменено',
+}
+
+class DownloadRow(QFrame):
+    """Строка скачивания в панели загрузок: имя, состояние, прогресс и управление"""
+
+    def __init__(self, manager, job, parent=None):
+        super().__init__(parent)
+        self.manager = manager
+        self.job = job
+        self.setObjectName("downloadRow")
+        layout = QHBoxLayout(self)
+        layout.setContentsMargins(12, 6, 12, 6)
+        layout.setSpacing(8)
+
+        self.name_label = QLabel()
+        self.name_label.setFixedWidth(300)
+        self.name_label.setToolTip(job.output_path)
+        self.status_label = QLabel()
+        self.status_label.setObjectName("downloadStatus")
+        self.status_label.setFixedWidth(170)
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setMaximum(10000)
+        self.progress_bar.setFixedHeight(20)
+
+        self.up_button = self._button("▲", "Выше в очереди", lambda: manager.move(self.job, -1))
+        self.down_button = self._button("▼", "Ниже в очереди", lambda: manager.move(self.job, 1))
+        self.pause_button = self._button("⏸", "Пауза", self.toggle_pause)
+        self.close_button = self._button("✕", "Отменить", self.cancel_or_remove)
+
+        layout.addWidget(self.name_label)
+        layout.addWidget(self.progress_bar, 1)
+        layout.addWidget(self.status_label)
+        for button in (self.up_button, self.down_button, self.pause_button, self.close_button):
+            layout.addWidget(button)
+        self.refresh()
+
+    def _button(self, text, tooltip, slot):
+        button = QPushButton(text)
+        button.setObjectName("downloadRowButton")
+        button.setFixedSize(30, 26)
+        button.setToolTip(tooltip)
+        button.clicked.connect(slot)
+        return button
+
+    def toggle_pause(self):
+        if self.job.state == 'paused':
+            self.manager.resume(self.job)
+        else:
+            self.manager.pause(self.job)
+
+    def cancel_or_remove(self):
+        if self.job.is_active:
+            self.manager.cancel(self.job)
+        else:
+            self.manager.remove(self.job)
+
+    def refresh(self):
+        job = self.job
+        metrics = QFontMetrics(self.name_label.font())
+        self.name_label.setText(metrics.elidedText(job.name, Qt.TextElideMode.ElideMiddle, 300))
+        status = DOWNLOAD_STATE_TEXT[job.state]
+        if job.state == 'running' and job.speed:
+            status += f" · {format_speed(job.speed)}"
+        self.status_label.setText(status)
+        self.status_label.setToolTip(job.error or "")
+        self.progress_bar.setValue(int(job.progress * 10000))
+        self.progress_bar.setFormat(f"{job.progress * 100:.1f}%")
+        self.pause_button.setText("▶" if job.state == 'paused' else "⏸")
+        self.pause_button.setToolTip("Продолжить" if job.state == 'paused' else "Пауза")
+        self.pause_button.setEnabled(job.state in ('queued', 'running', 'paused'))
+        self.close_button.setToolTip("Отменить" if job.is_active else "Убрать из списка")
+        self.close_button.setEnabled(job.state not in ('cancelling',))
+
+class DownloadsPanel(QFrame):
+    """Панель загрузок: строка на каждое скачивание и число одновременных скачиваний"""
+
+    def __init__(self, manager, parent=None):
+        super().__init__(parent)
+        self.manager = manager
+        self.rows = {}
+        self.setObjectName("downloadsPanel")
+
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(20, 0, 0, 0)
+        layout.setSpacing(6)
+
+        header = QHBoxLayout()
+        title = QLabel("Загрузки")
+        title.setObjectName("downloadsTitle")
+        self.parallel_input = QSpinBox()
+        self.parallel_input.setRange(1, 8)
+        self.parallel_input.setValue(manager.max_parallel)
+        self.parallel_input.valueChanged.connect(manager.set_max_parallel)
+        header.addWidget(title)
+        header.addStretch()
+        header.addWidget(QLabel("Одновременно:"))
+        header.addWidget(self.parallel_input)
+        layout.addLayout(header)
+
+        self.rows_widget = QWidget()
+        self.rows_layout = QVBoxLayout(self.rows_widget)
+        self.rows_layout.setContentsMargins(0, 0, 0, 0)
+        self.rows_layout.setSpacing(4)
+        self.rows_layout.addStretch()
+        scroll = QScrollArea()
+        scroll.setWidgetResizable(True)
+        scroll.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
+        scroll.setWidget(self.rows_widget)
+        scroll.setFixedHeight(150)
+        layout.addWidget(scroll)
+
+        manager.changed.connect(self.rebuild)
+        manager.job_updated.connect(self.update_job)
+        self.hide()
+
+    def rebuild(self):
+        """Перестроить строки после добавления, удаления или перестановки"""
+        for job, row in list(self.rows.items()):
+            if job not in self.manager.jobs:
+                row.deleteLater()
+                del self.rows[job]
+        for position, job in enumerate(self.manager.jobs):
+            row = self.rows.get(job)
+            if row is None:
+                row = self.rows[job] = DownloadRow(self.manager, job)
+            self.rows_layout.insertWidget(position, row)
+        self.setVisible(bool(self.manager.jobs))
+
+    def update_job(self, job):
+        row = self.rows.get(job)
+        if row is not None:
+            row.refresh()
 
 class MainWindow(QMainWindow):
     def __init__(self):
@@ -769,7 +1478,19 @@ class MainWindow(QMainWindow):
         # Инициализация переменных
         self.current_url = ""
         self.search_thread = None
-        self.download_thread = None
+        # Упреждающий поиск по вставленному URL: {'url', 'thread', 'started',
+        # 'result', 'error', 'adopted' — уже нажат «Поиск»}
+        self.prefetch = None
+        # Отменённые потоки поиска, которые ещё не завершились
+        self._stale_searches = []
+        self.prefetch_timer = QTimer(self)
+        self.prefetch_timer.setSingleShot(True)
+        self.prefetch_timer.setInterval(PREFETCH_DELAY_MS)
+        self.prefetch_timer.timeout.connect(self.start_prefetch)
+        self.download_manager = DownloadManager(MAX_PARALLEL_DOWNLOADS, self)
+        self._download_states = {}
+        self.download_manager.job_updated.connect(self.on_download_updated)
+        self.download_manager.changed.connect(self.update_download_totals)
         self.current_video_info = None
         
         # Создание центрального виджета
@@ -789,6 +1510,7 @@ class MainWindow(QMainWindow):
         self.url_input = QLineEdit()
         self.url_input.setPlaceholderText("Введите URL видео с YouTube, TikTok или Instagram")
         self.url_input.returnPressed.connect(self.search_video)
+        self.url_input.textChanged.connect(self.on_url_changed)
         
         self.search_button = SearchButton()
         self.search_button.clicked.connect(self.search_video)
@@ -801,21 +1523,27 @@ class MainWindow(QMainWindow):
         self.video_info_header = VideoInfoHeader()
         self.video_info_header.hide()  # Скрываем до первого поиска
         
-        # Область для информации о видео
-        self.scroll_area = QScrollArea()
-        self.scroll_area.setWidgetResizable(True)
-        self.scroll_area.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
-        
-        self.content_widget = QWidget()
-        self.content_layout = QGridLayout(self.content_widget)
-        self.content_layout.setSpacing(16)
-        self.content_layout.setContentsMargins(20, 0, 20, 20)
-        self.scroll_area.setWidget(self.content_widget)
+        # Область для информации о видео: сетка форматов или сообщение
+        self.format_model = FormatListModel(self)
+        self.format_view = FormatGridView()
+        self.format_view.setModel(self.format_model)
+        self.format_view.download_requested.connect(self.start_download)
+
+        self.message_label = QLabel()
+        self.message_label.setObjectName("contentMessage")
+        self.message_label.setAlignment(Qt.AlignmentFlag.AlignHCenter | Qt.AlignmentFlag.AlignTop)
+
+        self.content_stack = QStackedWidget()
+        self.content_stack.addWidget(self.format_view)
+        self.content_stack.addWidget(self.message_label)
         
         # Добавляем все в основной layout
         main_layout.addLayout(top_panel)
         main_layout.addWidget(self.video_info_header)
-        main_layout.addWidget(self.scroll_area, 1)
+        main_layout.addWidget(self.content_stack, 1)
+        # Панель загрузок появляется с первым скачиванием
+        self.downloads_panel = DownloadsPanel(self.download_manager)
+        main_layout.addWidget(self.downloads_panel)
         
         # Статус бар для отображения прогресса
         self.setupStatusBar()
@@ -826,6 +1554,9 @@ class MainWindow(QMainWindow):
         # Показываем начальное сообщение
         self.showStatusMessage("Готово к работе")
 
+        # Незавершённые скачивания предлагаем продолжить после показа окна
+        QTimer.singleShot(0, self.offer_resume_downloads)
+
     def setupStatusBar(self):
         """Настройка статус бара"""
         self.statusBar().setFixedHeight(50)
@@ -879,7 +1610,7 @@ class MainWindow(QMainWindow):
         """)
 
         # Кнопка отмены
-        self.cancel_button = QPushButton("Отмена")
+        self.cancel_button = QPushButton("Отменить все")
         self.cancel_button.setFixedSize(120, 30)
         self.cancel_button.setStyleSheet("""
             QPushButton {
@@ -940,10 +1671,42 @@ class MainWindow(QMainWindow):
             QPushButton:disabled {
                 background-color: #404040;
             }
-            QScrollArea {
+            QScrollArea, QListView {
                 border: none;
                 background-color: transparent;
             }
+            QLabel#contentMessage {
+                color: white;
+                font-size: 16px;
+                padding-top: 20px;
+            }
+            QLabel#downloadsTitle {
+                font-size: 16px;
+                font-weight: bold;
+            }
+            QFrame#downloadRow {
+                background-color: #2A2A2A;
+                border-radius: 8px;
+            }
+            QLabel#downloadStatus {
+                color: #CCCCCC;
+            }
+            QPushButton#downloadRowButton {
+                background-color: #404040;
+                padding: 0;
+                font-weight: normal;
+            }
+            QPushButton#downloadRowButton:hover {
+                background-color: #505050;
+            }
+            QPushButton#downloadRowButton:disabled {
+                color: #777777;
+                background-color: #333333;
+            }
+            QSpinBox {
+                background-color: #2A2A2A;
+                padding: 2px 6px;
+            }
             QProgressBar {
                 border: 1px solid #404040;
                 border-radius: 4px;
@@ -973,56 +1736,128 @@ class MainWindow(QMainWindow):
         """)
 
     def search_video(self):
+        # Поиск запускается сам, отложенная предзагрузка того же URL больше не нужна
+        self.prefetch_timer.stop()
         url = self.url_input.text().strip()
         if not url:
-            error_label = QLabel("Вставьте URL видео с YouTube, TikTok или Instagram")
-            error_label.setStyleSheet("""
-                QLabel {
-                    color: white;
-                    font-size: 16px;
-                }
-            """)
-            error_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
-            for i in reversed(range(self.content_layout.count())): 
-                widget = self.content_layout.itemAt(i).widget()
-                if widget:
-                    widget.deleteLater()
-            self.content_layout.addWidget(error_label, 0, 0, 1, 4, Qt.AlignmentFlag.AlignCenter)
+            self.show_content_message("Вставьте URL видео с YouTube, TikTok или Instagram")
             return
             
         if not validate_url(url):
-            error_label = QLabel("Неверный формат URL. Поддерживаются YouTube, TikTok и Instagram.")
-            error_label.setStyleSheet("""
-                QLabel {
-                    color: white;
-                    font-size: 16px;
-                }
-            """)
-            error_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
-            for i in reversed(range(self.content_layout.count())): 
-                widget = self.content_layout.itemAt(i).widget()
-                if widget:
-                    widget.deleteLater()
-            self.content_layout.addWidget(error_label, 0, 0, 1, 4, Qt.AlignmentFlag.AlignCenter)
+            self.show_content_message("Неверный формат URL. Поддерживаются YouTube, TikTok и Instagram.")
             return
 
         self.current_url = url
+        prefetch = self.take_prefetch(url)
+        if prefetch is not None and prefetch['result'] is not None:
+            # Информация уже получена заранее
+            self.on_search_complete(*prefetch['result'])
+            return
+
         self.disable_interface()
         self.search_button.startLoading()
         self.showStatusMessage("Поиск видео...")
         
         # Очищаем предыдущие результаты
-        for i in reversed(range(self.content_layout.count())): 
-            widget = self.content_layout.itemAt(i).widget()
-            if widget:
-                widget.deleteLater()
+        self.format_model.set_cards([])
+        self.content_stack.setCurrentWidget(self.format_view)
         
+        if prefetch is not None:
+            # Упреждающий поиск ещё идёт — его результат станет результатом поиска
+            prefetch['adopted'] = True
+            self.search_thread = prefetch['thread']
+            return
+
         self.search_thread = SearchThread(url)
         self.search_thread.finished.connect(self.on_search_complete)
         self.search_thread.error.connect(self.on_search_error)
         self.search_thread.start()
 
-    def on_search_complete(self, info):
+    def on_url_changed(self, text):
+        """Запланировать упреждающий поиск, когда в поле оказывается подходящий URL"""
+        self.prefetch_timer.stop()
+        url = text.strip()
+        if self.prefetch is not None and self.prefetch['url'] != url:
+            self.cancel_prefetch()
+        if validate_url(url):
+            self.prefetch_timer.start()
+
+    def start_prefetch(self):
+        """Начать получение информации и превью до нажатия «Поиск»"""
+        url = self.url_input.text().strip()
+        if not validate_url(url) or not self.url_input.isEnabled():
+            return
+        if self.prefetch is not None:
+            if self.prefetch['url'] == url and time.monotonic() - self.prefetch['started'] < PREFETCH_MAX_AGE:
+                return
+            self.cancel_prefetch()
+        logger.debug("Упреждающий поиск: %s", url)
+        thread = SearchThread(url)
+        thread.finished.connect(self.on_prefetch_complete)
+        thread.error.connect(self.on_prefetch_error)
+        self.prefetch = {'url': url, 'thread': thread, 'started': time.monotonic(),
+                         'result': None, 'error': None, 'adopted': False}
+        thread.start()
+        # Превью YouTube известно по ID видео, не дожидаясь информации
+        video_id = youtube_video_id(url)
+        if video_id:
+            self.video_info_header.prefetch_thumbnail(youtube_thumbnail_candidates(video_id))
+
+    def on_prefetch_complete(self, info, cards):
+        prefetch = self.prefetch
+        if prefetch is None or prefetch['thread'] is not self.sender():
+            return
+        if prefetch['adopted']:
+            self.prefetch = None
+            self.on_search_complete(info, cards)
+            return
+        prefetch['result'] = (info, cards)
+        if info:
+            self.video_info_header.prefetch_thumbnail(thumbnail_candidates(info))
+
+    def on_prefetch_error(self, error_msg):
+        prefetch = self.prefetch
+        if prefetch is None or prefetch['thread'] is not self.sender():
+            return
+        if prefetch['adopted']:
+            self.prefetch = None
+            self.on_search_error(error_msg)
+            return
+        prefetch['error'] = error_msg
+
+    def take_prefetch(self, url):
+        """Забрать упреждающий поиск для url (None, если его нет или он устарел)"""
+        prefetch = self.prefetch
+        if prefetch is None:
+            return None
+        # Ошибка упреждающего поиска могла быть временной — тогда ищем заново
+        if (prefetch['url'] != url or prefetch['error'] is not None
+                or time.monotonic() - prefetch['started'] > PREFETCH_MAX_AGE):
+            self.cancel_prefetch()
+            return None
+        if prefetch['result'] is not None:
+            self.prefetch = None
+        return prefetch
+
+    def cancel_prefetch(self):
+        """Отменить упреждающий поиск и загрузку превью"""
+        if self.prefetch is not None:
+            thread = self.prefetch['thread']
+            thread.cancel()
+            # Поток нельзя уничтожать до завершения извлечения
+            self._stale_searches = [t for t in self._stale_searches if not t.isFinished()]
+            if not thread.isFinished():
+                self._stale_searches.append(thread)
+            self.prefetch = None
+        self.video_info_header.cancel_prefetch()
+
+    def show_content_message(self, message):
+        """Показать сообщение вместо сетки форматов"""
+        self.format_model.set_cards([])
+        self.message_label.setText(message)
+        self.content_stack.setCurrentWidget(self.message_label)
+
+    def on_search_complete(self, info, cards):
         self.current_video_info = info
         self.search_button.stopLoading()
         self.enable_interface()
@@ -1031,204 +1866,16 @@ class MainWindow(QMainWindow):
         self.video_info_header.update_info(info)
         self.video_info_header.show()
         
-        print("\nПревью (thumbnails):")
-        if 'thumbnails' in info:
-            print(json.dumps(info['thumbnails'], indent=2, ensure_ascii=False))
-        else:
-            print("Информация о превью отсутствует")
-
-        print("\nВся информация о видео:")
-        print(json.dumps(info, indent=2, ensure_ascii=False))
-        
-        # Фильтруем и сортируем форматы
-        formats = []
-        for f in info.get('formats', []):
-            if f.get('ext') == 'mp4' and f.get('vcodec') and f.get('vcodec') != 'none':
-                formats.append(f)
-        
-        formats.sort(key=lambda x: (
-            -int(x.get('quality', 0) or 0),
-            -float(x.get('tbr', 0) or 0),
-            -(int(x.get('filesize', 0) or 0) if x.get('filesize') is not None else 0),
-            -(int(x.get('filesize_approx', 0) or 0) if x.get('filesize_approx') is not None else 0)
-        ))
-        
-        if not formats:
+        # Форматы уже отфильтрованы и отсортированы в потоке поиска
+        if not cards:
             QMessageBox.warning(self, "Внимание", "Не найдено подходящих MP4 форматов для скачивания")
             self.showStatusMessage("Готово для работы")
             return
             
-        # Создаем карточки форматов в сетке 4 столбца
-        row = 0
-        col = 0
-        for fmt in formats:
-            format_card = self.create_format_card(fmt)
-            self.content_layout.addWidget(format_card, row, col)
-            col += 1
-            if col >= 4:  # Переходим на новую строку после 4 карточек
-                col = 0
-                row += 1
-            
-        self.showStatusMessage(f"Найдено {len(formats)} форматов")
-
-    def create_format_card(self, fmt):
-        card = QFrame()
-        card.setFrameStyle(QFrame.Shape.StyledPanel)
-        card.setFixedSize(220, 208)
-        card.setStyleSheet("""
-            QFrame {
-                background-color: #2A2A2A;
-                border-radius: 12px;
-                padding: 0;
-                margin: 0;
-            }
-            QLabel {
-                color: #FFFFFF;
-                padding: 0;
-                margin: 0;
-                line-height: 1;
-            }
-            QLabel.title {
-                color: white;
-                font-size: 24px;
-                font-weight: 600;
-            }
-            QLabel.subtitle {
-                color: #999999;
-                font-size: 14px;
-                font-weight: 400;
-            }
-            QLabel.info {
-                color: #CCCCCC;
-                font-size: 14px;
-                font-weight: 400;
-            }
-            QPushButton {
-                background-color: #1DB954;
-                color: white;
-                border: none;
-                border-radius: 8px;
-                font-size: 14px;
-                font-weight: 600;
-                padding: 0;
-                margin: 0;
-                height: 35px;
-                min-height: 35px;
-                max-height: 35px;
-            }
-            QPushButton:hover {
-                background-color: #17a74a;
-            }
-        """)
-        
-        main_layout = QVBoxLayout()
-        main_layout.setSpacing(0)
-        main_layout.setContentsMargins(20, 20, 20, 20)
-        
-        # Контейнер для информации
-        info_container = QWidget()
-        info_layout = QVBoxLayout(info_container)
-        info_layout.setSpacing(0)  # Убираем отступ между элементами
-        info_layout.setContentsMargins(0, 0, 0, 0)
-        
-        # Заголовок с разрешением
-        height = fmt.get('height', 0)
-        resolution = f"{height}p" if height else "?"
-        title_label = QLabel(f"🎥 {resolution}")
-        title_label.setProperty("class", "title")
-        
-        # Формат и кодек как подзаголовок
-        vcodec = fmt.get('vcodec', 'unknown').split('.')[0]
-        if vcodec == 'avc1':
-            vcodec = 'h264'
-        elif vcodec == 'vp09':
-            vcodec = 'vp09'
-        format_text = f"MP4 ({vcodec})"
-        format_label = QLabel(format_text)
-        format_label.setProperty("class", "subtitle")
-        
-        # Добавляем заголовок и подзаголовок
-        info_layout.addWidget(title_label)
-        info_layout.addSpacing(1)  # Отступ между разрешением и форматом
-        info_layout.addWidget(format_label)
-        info_layout.addSpacing(4)  # Отступ перед метриками
-        
-        # Контейнер для метрик (размер, FPS, битрейт)
-        metrics_container = QWidget()
-        metrics_layout = QVBoxLayout(metrics_container)
-        metrics_layout.setSpacing(1)  # Отступ между метриками как на картинке
-        metrics_layout.setContentsMargins(0, 0, 0, 0)
-        
-        # Размер файла
-        filesize = fmt.get('filesize')
-        filesize_approx = fmt.get('filesize_approx')
-        if filesize is not None and filesize > 0:
-            size_text = f"📁 {filesize / (1024*1024):.1f} MB"
-        elif filesize_approx is not None and filesize_approx > 0:
-            size_text = f"📁 {filesize_approx / (1024*1024):.1f} MB"
-        else:
-            tbr = fmt.get('tbr', 0)
-            duration = self.current_video_info.get('duration', 0)
-            if tbr > 0 and duration > 0:
-                compression_factor = 0.5
-                estimated_size = (tbr * 1024 * duration * compression_factor) / (8 * 1024 * 1024)
-                size_text = f"📁 {estimated_size:.1f} MB"
-            else:
-                size_text = "📁 Размер неизвестен"
-        size_label = QLabel(size_text)
-        size_label.setProperty("class", "info")
-        
-        # Определяем тип видео
-        webpage_url = self.current_video_info.get('webpage_url', '').lower()
-        is_tiktok = 'tiktok.com' in webpage_url
-        is_instagram = 'instagram.com' in webpage_url
-        
-        if is_tiktok or is_instagram:
-            # Для TikTok и Instagram показываем размеры видео
-            width = fmt.get('width', 0)
-            height = fmt.get('height', 0)
-            if width and height:
-                dimensions_text = f"📐 {width}x{height}"
-            else:
-                dimensions_text = "📐 Размер неизвестен"
-            dimensions_label = QLabel(dimensions_text)
-            dimensions_label.setProperty("class", "info")
-        else:
-            # Для YouTube показываем FPS
-            fps = fmt.get('fps', 0)
-            fps_text = f"🎞️ {fps} FPS" if fps else "🎞️ FPS неизвестно"
-            dimensions_label = QLabel(fps_text)
-            dimensions_label.setProperty("class", "info")
-        
-        # Битрейт (меняем иконку на 📶)
-        tbr = fmt.get('tbr', 0)
-        if tbr > 0:
-            bitrate_text = f"📶 {tbr:.0f} Kbps"
-        else:
-            bitrate_text = "📶 Битрейт неизвестен"
-        bitrate_label = QLabel(bitrate_text)
-        bitrate_label.setProperty("class", "info")
-        
-        # Добавляем метрики
-        metrics_layout.addWidget(size_label)
-        metrics_layout.addWidget(dimensions_label)
-        metrics_layout.addWidget(bitrate_label)
-        
-        # Добавляем контейнер с метриками
-        info_layout.addWidget(metrics_container)
-        info_layout.addStretch()
-        
-        # Добавляем информационный контейнер в главный layout
-        main_layout.addWidget(info_container)
-        
-        # Кнопка скачивания
-        download_btn = QPushButton("⬇ Скачать видео")
-        download_btn.setFixedHeight(35)
-        download_btn.clicked.connect(lambda: self.start_download(fmt))
-        main_layout.addWidget(download_btn)
-        
-        card.setLayout(main_layout)
-        return card
+        # Сетка рисует только видимые карточки, по 4 в ряд
+        self.format_model.set_cards(cards)
+        self.content_stack.setCurrentWidget(self.format_view)
+        self.showStatusMessage(f"Найдено {len(cards)} форматов")
 
     def start_download(self, fmt):
         if not self.current_video_info:
@@ -1248,114 +1895,108 @@ class MainWindow(QMainWindow):
         
         if not file_path:
             return
-            
-        self.disable_interface()
-        # Сбрасываем прогресс бар
-        self.progress_bar.setValue(0)
-        self.progress_bar.hide()
-        self.cancel_button.hide()
-        self.showStatusMessage("Подготовка...")
-        
-        self.download_thread = DownloadThread(
-            self.current_url,
-            fmt['format_id'],
-            file_path
-        )
-        self.download_thread.progress.connect(self.update_progress)
-        self.download_thread.finished.connect(self.on_download_complete)
-        self.download_thread.error.connect(self.on_download_error)
-        self.download_thread.start()
-
-    def update_progress(self, progress):
-        """Обновить прогресс загрузки"""
-        if self.download_thread.is_cancelled:  # Проверяем отмену
+
+        self.begin_download(self.current_url, fmt['format_id'], file_path)
+
+    def begin_download(self, url, format_id, file_path):
+        # Скачивание встаёт в очередь менеджера, поиск остаётся доступен
+        self.download_manager.add(url, format_id, file_path)
+
+    def on_download_updated(self, job):
+        """Сообщить о завершении скачивания и обновить общий прогресс"""
+        previous = self._download_states.get(job)
+        self._download_states[job] = job.state
+        if previous != job.state:
+            if job.state == 'finished':
+                self.showStatusMessage(f"Видео скачано: {job.name}")
+            elif job.state == 'cancelled':
+                self.showStatusMessage(f"Загрузка отменена: {job.name}")
+            elif job.state == 'error':
+                self.showStatusMessage("Ошибка при загрузке")
+                QMessageBox.critical(self, "Ошибка", f"Не удалось загрузить видео:\n{job.error}")
+        self.update_download_totals()
+
+    def update_download_totals(self):
+        """Общий прогресс и скорость активных скачиваний в статус баре"""
+        self._download_states = {job: state for job, state in self._download_states.items()
+                                 if job in self.download_manager.jobs}
+        jobs = [job for job in self.download_manager.jobs if job.state in ('queued', 'running')]
+        if not jobs:
+            self.progress_bar.hide()
+            self.cancel_button.hide()
             return
-            
-        # При первом обновлении прогресса показываем элементы загрузки
         if not self.progress_bar.isVisible():
-            self.showStatusMessage("Загрузка видео...")
-            self.progress_bar.setValue(0)
             self.progress_bar.show()
             self.cancel_button.show()
             self.status_widget.show()
+        progress = sum(job.progress for job in jobs) / len(jobs)
+        running = sum(1 for job in jobs if job.state == 'running')
+        self.progress_bar.setValue(int(progress * 10000))
+        self.progress_bar.setFormat(
+            f"{progress * 100:.1f}% · загружается {running}, в очереди {len(jobs) - running}"
+            f" · {format_speed(self.download_manager.total_speed())}")
 
-        # Обновляем значение прогресса (progress приходит как число от 0 до 1)
-        current_value = self.progress_bar.value()
-        new_value = int(progress * 10000)
-        
-        # Обновляем только если новое значение больше текущего
-        if new_value > current_value:
-            self.progress_bar.setValue(new_value)
-            self.progress_bar.setFormat(f"{progress * 100:.2f}%")
-
-    def on_download_complete(self):
-        self.progress_bar.hide()
-        self.cancel_button.hide()
-        self.enable_interface()
-        self.showStatusMessage("Видео скачано")
+    def offer_resume_downloads(self):
+        """Предложить продолжить скачивания, прерванные закрытием программы"""
+        active = {job.output_path for job in self.download_manager.jobs if job.is_active}
+        pending = [item for item in load_pending_downloads() if item['output_path'] not in active]
+        if not pending:
+            return
+        paths = "\n".join(item['output_path'] for item in pending)
+        answer = QMessageBox.question(
+            self,
+            "Незавершённые скачивания",
+            f"Скачивания не были завершены:\n{paths}\n\nПродолжить с места остановки?"
+        )
+        if answer != QMessageBox.StandardButton.Yes:
+            for item in pending:
+                forget_download(item['output_path'])
+                discard_partial_files(item['output_path'])
+            return
+        for item in pending:
+            self.download_manager.add(item['url'], item['format_id'], item['output_path'])
 
     def on_search_error(self, error_msg):
         self.search_button.stopLoading()
         self.enable_interface()
-        # Создаем и показываем сообщение об ошибке по центру
-        error_label = QLabel("Видео не найдено")
-        error_label.setStyleSheet("""
-            QLabel {
-                color: white;
-                font-size: 16px;
-            }
-        """)
-        error_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
-        # Добавляем метку в центр content_layout
-        self.content_layout.addWidget(error_label, 0, 0, 1, 4, Qt.AlignmentFlag.AlignCenter)
-
-    def on_download_error(self, error_msg):
-        self.progress_bar.hide()
-        self.cancel_button.hide()
-        self.enable_interface()
-        self.showStatusMessage("Ошибка при загрузке")
-        QMessageBox.critical(self, "Ошибка", f"Не удалось загрузить видео:\n{error_msg}")
+        self.show_content_message("Видео не найдено")
 
     def disable_interface(self):
         self.url_input.setEnabled(False)
         self.search_button.setEnabled(False)
         
         # Отключаем все кнопки загрузки
-        for i in range(self.content_layout.count()):
-            widget = self.content_layout.itemAt(i).widget()
-            if isinstance(widget, QFrame):
-                for child in widget.findChildren(QPushButton):
-                    child.setEnabled(False)
+        self.format_view.setEnabled(False)
 
     def enable_interface(self):
         self.url_input.setEnabled(True)
         self.search_button.setEnabled(True)
         
         # Включаем все кнопки загрузки
-        for i in range(self.content_layout.count()):
-            widget = self.content_layout.itemAt(i).widget()
-            if isinstance(widget, QFrame):
-                for child in widget.findChildren(QPushButton):
-                    child.setEnabled(True)
+        self.format_view.setEnabled(True)
 
     def cancel_download(self):
-        """Отмена загрузки"""
-        if self.download_thread and self.download_thread.isRunning():
-            # Блокируем кнопку отмены
-            self.cancel_button.setEnabled(False)
-            
-            # Отменяем загрузку
-            self.download_thread.cancel()
-            
-            # Очищаем интерфейс
-            self.progress_bar.setValue(0)
-            self.progress_bar.hide()
-            self.cancel_button.hide()
-            self.enable_interface()
-            self.showStatusMessage("Загрузка отменена")
-            
-            # Восстанавливаем кнопку отмены
-            self.cancel_button.setEnabled(True)
+        """Отмена всех активных скачиваний"""
+        for job in list(self.download_manager.jobs):
+            self.download_manager.cancel(job)
+
+    def closeEvent(self, event):
+        # Идущие скачивания приостанавливаются и продолжатся при следующем запуске.
+        # Окно скрывается сразу, а закрывается, когда потоки остановятся
+        if not self.download_manager.shutting_down:
+            self.download_manager.shutdown()
+            if self.download_manager.busy():
+                event.ignore()
+                self.hide()
+                self.download_manager.stopped.connect(self.finish_close)
+                return
+        super().closeEvent(event)
+
+    def finish_close(self):
+        self.close()
+        # Закрытие уже скрытого окна само не завершает приложение
+        if QApplication.quitOnLastWindowClosed():
+            QApplication.quit()
 
     def showStatusMessage(self, message):
         """Показать сообщение в статус баре"""
@@ -1389,6 +2030,8 @@ class MainWindow(QMainWindow):
             self.statusBar().addWidget(spacer)
 
 if __name__ == '__main__':
+    # --debug (или LOG_LEVEL=DEBUG) включает подробный лог, в том числе полную информацию о видео
+    setup_logging('DEBUG' if '--debug' in sys.argv else None)
     app = QApplication(sys.argv)
     window = MainWindow()
     window.show()